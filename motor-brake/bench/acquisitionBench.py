@@ -0,0 +1,111 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# End-to-end acquisition benchmark: it runs the MotorBrakeManager against
+# the DSP6001Simulator on a pseudo-terminal and reports, for each
+# acquisition mode and baud rate:
+#  - samples/sec
+#  - period jitter (std and max deviation from the mean period)
+#  - CPU time of the process per sample (simulator included, so it is
+#    meaningful to compare versions of the manager)
+#  - setpoint command-to-wire latency and round-trip latency, i.e. the time
+#    from sendTorqueSetpoint() to the first acquired sample with the new value
+# Run it from the motor-brake folder:
+#   python3 -m bench.acquisitionBench
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from motorBrakeManager import MotorBrakeManager
+from src.motorBrakeSimulator import DSP6001Simulator
+from src.motorBrakeBinLog import openBinLog
+from src.motorBrakeBinLog import isGapRecord
+from src.motorBrakeDriver import acqModes
+from src.motorBrakeDriver import ACQ_MODE_CONTINUOUS
+
+# -------------------------------------------------------------------------
+# Single run
+# -------------------------------------------------------------------------
+def runBench(acqMode, baudrate, period, duration, latency, corruptProb, numOfSetpoints=5):
+    #in continuous mode the simulated device sends a data string every period without requests
+    continuousPeriod = period if acqMode == ACQ_MODE_CONTINUOUS else 0.0
+    sim = DSP6001Simulator(baudrate=baudrate, latency=latency, corruptProb=corruptProb, continuousPeriod=continuousPeriod)
+    sim.start()
+    logFile = os.path.join(tempfile.mkdtemp(), "bench.bin")
+    brkManager = MotorBrakeManager()
+    ret = brkManager.init(sim.portName, baudrate, False, period, logFile, "bin", acqMode)
+    if ret != 0:
+        sim.stop()
+        raise RuntimeError("MotorBrakeManager init failed: " + str(ret))
+    cpuStart = time.process_time()
+    brkManager.startAcquisition(logFile)
+
+    wireLatency = []
+    roundTrip = []
+    time.sleep(duration / (numOfSetpoints + 1))
+    for i in range(numOfSetpoints):
+        torque = 100.0 * (i + 1) #mNm
+        startNs = time.monotonic_ns()
+        brkManager.sendTorqueSetpoint(torque).result()
+        wireLatency.append(sim.lastSetpointRxNs - startNs)
+        while abs(brkManager.motor_br_dev.mydata.torque - torque/1000) > 1e-9:
+            if time.monotonic_ns() - startNs > 2e9:
+                break
+            time.sleep(0.0001)
+        roundTrip.append(time.monotonic_ns() - startNs)
+        time.sleep(duration / (numOfSetpoints + 1))
+
+    brkManager.deinit()
+    cpuTime = time.process_time() - cpuStart
+    sim.stop()
+
+    records = openBinLog(logFile)
+    ts = np.array(records["timestampNs"][~isGapRecord(records)], dtype=np.int64)
+    records = None
+    os.remove(logFile)
+    diffs = np.diff(ts) / 1e9
+    hasDiffs = len(diffs) > 0 #at least two samples
+    return {
+        "samples/sec": (len(ts) - 1) / ((ts[-1] - ts[0]) / 1e9) if hasDiffs else 0.0,
+        "period mean[ms]": diffs.mean() * 1e3 if hasDiffs else 0.0,
+        "jitter std[ms]": diffs.std() * 1e3 if hasDiffs else 0.0,
+        "jitter max[ms]": np.abs(diffs - diffs.mean()).max() * 1e3 if hasDiffs else 0.0,
+        "cpu/sample[us]": cpuTime / len(ts) * 1e6 if len(ts) > 0 else 0.0,
+        "cmd-to-wire[ms]": np.mean(wireLatency) / 1e6,
+        "round-trip[ms]": np.mean(roundTrip) / 1e6,
+    }
+
+# -------------------------------------------------------------------------
+# main
+# -------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end acquisition benchmark on a simulated DSP6001",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=acqModes[:2], choices=acqModes, help="acquisition modes to benchmark")
+    parser.add_argument("--baudrates", nargs="+", type=int, default=[19200, 115200], help="baud rates to benchmark")
+    parser.add_argument("-p", "--period", default=0.015, type=float, help="acquisition data period(seconds)")
+    parser.add_argument("--duration", default=5.0, type=float, help="duration of each run (seconds)")
+    parser.add_argument("--latency", default=0.002, type=float, help="simulated device response latency (seconds)")
+    parser.add_argument("--corruptProb", default=0.0, type=float, help="probability of a corrupted frame")
+    args = parser.parse_args()
+
+    results = []
+    for acqMode in args.modes:
+        for baudrate in args.baudrates:
+            res = runBench(acqMode, baudrate, args.period, args.duration, args.latency, args.corruptProb)
+            results.append((acqMode, baudrate, res))
+
+    print('-------------------------------------------------')
+    keys = list(results[0][2].keys())
+    print("mode\tbaud\t" + "\t".join(keys))
+    for acqMode, baudrate, res in results:
+        print(acqMode + "\t" + str(baudrate) + "\t" + "\t".join("%.3f" % res[k] for k in keys))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Micro-benchmark that compares the DSP6001FrameParser with the regex based
+# parsing previously used by MotorBrake.getData.
+# Run it from the motor-brake folder:
+#   python3 -m bench.frameParserBench
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import re
+import timeit
+from src.motorBrakeFrameParser import DSP6001FrameParser
+from src.motorBrakeDriver import MotorBrakeOuputData
+
+frames = [b'S    0T0.488R\r\n', b'S 1200T-35.12L\r\n', b'S  360T100.5R\r\n']
+
+# the parsing done by MotorBrake.getData before DSP6001FrameParser
+def regexParse(frame, mydata):
+    data = frame.decode()
+    if re.search("^S.+T.+R.+",data):
+        data_split_str = re.split("[S,T,R,L]", ''.join(data))
+        mydata.speed = (float(data_split_str[1])*60/360)
+        mydata.torque = (float(data_split_str[2])/1000)
+        mydata.rotation = data[12]
+
+def main():
+    number = 200000
+    data = MotorBrakeOuputData()
+    parser = DSP6001FrameParser()
+
+    tRegex = min(timeit.repeat(lambda: [regexParse(f, data) for f in frames], number=number//len(frames), repeat=3))
+    tParser = min(timeit.repeat(lambda: [parser.parseInto(f, data) for f in frames], number=number//len(frames), repeat=3))
+
+    print("regex path:   %.3f us/frame" % (tRegex/number*1e6))
+    print("frame parser: %.3f us/frame" % (tParser/number*1e6))
+    print("speed-up:     %.2fx" % (tRegex/tParser))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Startup benchmark of the Motor Brake Manager. It reports:
+#  - the import time of motorBrakeManager, measured with "python -X importtime"
+#    in fresh interpreters, and the modules that take most of it
+#  - the time to first sample, i.e. from the start of a fresh interpreter to
+#    the first sample acquired from the DSP6001Simulator
+# It also checks that the optional heavy modules (matplotlib and yarp) are
+# not imported when plots and yarp services are not requested.
+# The exit code is 1 if a check fails or a budget is exceeded, so it can
+# be used to guard the startup time.
+# Run it from the motor-brake folder:
+#   python3 -m bench.startupBench
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import sys
+import time
+import argparse
+import subprocess
+import numpy as np
+from src.motorBrakeSimulator import DSP6001Simulator
+
+# Modules that must be loaded only on request
+lazyModules = ["matplotlib", "yarp"]
+
+# Default budgets of the medians: about 2x the times measured on a desktop PC
+# (import ~170 ms, first sample ~190 ms at 19200 baud), so a slower PC passes
+# but a regression of the size of loading matplotlib at startup doesn't
+IMPORT_BUDGET_MS = 300
+FIRST_SAMPLE_BUDGET_MS = 500
+
+# Script run by the child interpreter for the time to first sample: it prints
+# the monotonic time of the first sample (the monotonic clock is shared by the
+# processes of the host)
+firstSampleScript = """
+import sys, time
+from motorBrakeManager import MotorBrakeManager
+brkManager = MotorBrakeManager()
+if brkManager.init(sys.argv[1], int(sys.argv[2]), False, 0.015, "") != 0:
+    sys.exit(1)
+brkManager.startAcquisition("")
+while brkManager.motor_br_dev.mydata.progNum == 0:
+    time.sleep(0.0001)
+print(time.monotonic_ns())
+brkManager.deinit()
+"""
+
+# -------------------------------------------------------------------------
+# Import time
+# -------------------------------------------------------------------------
+
+# Returns (cumulative import time [ms] of motorBrakeManager, dictionary module -> cumulative time [ms])
+def measureImportTime():
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import motorBrakeManager"],
+                          capture_output=True, text=True, check=True)
+    modules = {}
+    for line in proc.stderr.splitlines():
+        #import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            modules[fields[2].strip()] = int(fields[1]) / 1000
+        except ValueError:
+            continue #the header line
+    return modules.get("motorBrakeManager", 0.0), modules
+
+# -------------------------------------------------------------------------
+# Time to first sample
+# -------------------------------------------------------------------------
+def measureFirstSample(baudrate):
+    sim = DSP6001Simulator(baudrate=baudrate)
+    sim.start()
+    try:
+        startNs = time.monotonic_ns()
+        proc = subprocess.run([sys.executable, "-c", firstSampleScript, sim.portName, str(baudrate)],
+                              capture_output=True, text=True, timeout=60)
+    finally:
+        sim.stop()
+    for line in proc.stdout.splitlines():
+        if line.strip().isdigit():
+            return (int(line) - startNs) / 1e6
+    raise RuntimeError("no sample acquired: " + proc.stderr[-500:])
+
+# -------------------------------------------------------------------------
+# main
+# -------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark: import time and time to first sample",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--runs", default=5, type=int, help="number of fresh interpreters for each measure")
+    parser.add_argument("--top", default=10, type=int, help="number of slowest modules to show")
+    parser.add_argument("-b", "--baudrate", default=19200, type=int, help="baud rate of the simulated device")
+    parser.add_argument("--importBudgetMs", default=IMPORT_BUDGET_MS, type=float, help="max median import time (0: no check)")
+    parser.add_argument("--firstSampleBudgetMs", default=FIRST_SAMPLE_BUDGET_MS, type=float, help="max median time to first sample (0: no check)")
+    args = parser.parse_args()
+
+    ok = True
+    importTimes = []
+    for i in range(args.runs):
+        total, modules = measureImportTime()
+        importTimes.append(total)
+    loaded = [name for name in lazyModules if any(m == name or m.startswith(name + ".") for m in modules)]
+
+    firstSampleTimes = [measureFirstSample(args.baudrate) for i in range(args.runs)]
+
+    print('-------------------------------------------------')
+    print("import motorBrakeManager [ms]: median= %.1f  min= %.1f  max= %.1f" % (np.median(importTimes), min(importTimes), max(importTimes)))
+    print("slowest modules (cumulative [ms], last run):")
+    for name, ms in sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print("  %8.1f  %s" % (ms, name))
+    print("time to first sample [ms]: median= %.1f  min= %.1f  max= %.1f" % (np.median(firstSampleTimes), min(firstSampleTimes), max(firstSampleTimes)))
+
+    if loaded:
+        print("FAIL: modules loaded at startup without being requested:", loaded)
+        ok = False
+    if args.importBudgetMs > 0 and np.median(importTimes) > args.importBudgetMs:
+        print("FAIL: import time over budget (%.1f ms)" % args.importBudgetMs)
+        ok = False
+    if args.firstSampleBudgetMs > 0 and np.median(firstSampleTimes) > args.firstSampleBudgetMs:
+        print("FAIL: time to first sample over budget (%.1f ms)" % args.firstSampleBudgetMs)
+        ok = False
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Python script that converts a binary acquisition log, written by the
+# Motor Brake Manager with the option "--format bin", in the tab separated
+# format used by the "--format tsv" option.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import sys
+import argparse
+from src.motorBrakeBinLog import binLogToTsv
+
+# -------------------------------------------------------------------------
+# parseInputArgument
+# -------------------------------------------------------------------------
+def parseInputArgument(argv):
+    parser = argparse.ArgumentParser(description="Converts a motor brake binary log in the tab separated format",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("binFile", help="binary log file to convert")
+    parser.add_argument("tsvFile", help="name of the tab separated output file")
+    args = parser.parse_args()
+    return args
+
+# -------------------------------------------------------------------------
+# main
+# -------------------------------------------------------------------------
+def main():
+    args = parseInputArgument(sys.argv)
+    try:
+        numOfRecords = binLogToTsv(args.binFile, args.tsvFile)
+    except (OSError, ValueError) as e:
+        print("ERROR: " + str(e))
+        return 1
+    print("Converted", numOfRecords, "records in", args.tsvFile)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
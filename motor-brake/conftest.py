@@ -0,0 +1 @@
+# The tests import the modules of src as the scripts do: this folder is put in sys.path by pytest
@@ -0,0 +1,67 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Python script that analyzes an acquisition log written by the Motor Brake
+# Manager (tab separated or binary, optionally compressed, or the session
+# index of a log split in chunks). It prints the summary statistics of
+# speed, torque, power and sample intervals and the steady-state segments,
+# and optionally writes the signals resampled on a uniform grid and filtered.
+# Logs of any size are processed in chunks with bounded memory (see
+# src/motorBrakeLogAnalysis.py).
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import sys
+import argparse
+from termcolor import colored
+from src.motorBrakeLogAnalysis import analyzeLog
+
+# -------------------------------------------------------------------------
+# parseInputArgument
+# -------------------------------------------------------------------------
+def parseInputArgument(argv):
+    parser = argparse.ArgumentParser(description="Analyzes a motor brake acquisition log",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("logFile", help="log file (.tsv, .bin, optionally compressed) or session index (.index)")
+    parser.add_argument("-p", "--period", default=0.01, type=float, help="period (seconds) of the uniform resampling grid")
+    parser.add_argument("--filterWindow", default=0.1, type=float, help="length (seconds) of the moving average filter (0: disabled)")
+    parser.add_argument("--steadyWindow", default=1.0, type=float, help="length (seconds) of the window used to detect the steady states")
+    parser.add_argument("--speedTol", default=5.0, type=float, help="max speed std [deg/sec] in a steady state")
+    parser.add_argument("--torqueTol", default=0.02, type=float, help="max torque std [Nm] in a steady state")
+    parser.add_argument("--minSteady", default=2.0, type=float, help="min duration (seconds) of a steady state")
+    parser.add_argument("-o", "--out", default="", help="tab separated file where the resampled and filtered signals are written (empty: not written)")
+    parser.add_argument("--chunkSize", default=65536, type=int, help="number of samples processed at a time")
+    args = parser.parse_args()
+    return args
+
+# -------------------------------------------------------------------------
+# main
+# -------------------------------------------------------------------------
+def main():
+    args = parseInputArgument(sys.argv)
+    try:
+        summaries, intervals, segments = analyzeLog(args.logFile, args.period, args.filterWindow, args.steadyWindow, args.speedTol,
+                                                    args.torqueTol, args.minSteady, args.out, args.chunkSize)
+    except (OSError, ValueError, ImportError) as e:
+        print("ERROR: " + str(e))
+        return 1
+
+    print(colored('------- SUMMARY -------', 'blue'))
+    for summary in summaries:
+        summary.printSummary()
+    print("sample interval[ms]      min=%.3f  p50=%.3f  p99=%.3f  p999=%.3f  max=%.3f" % (intervals.min*1000, intervals.getPercentile(0.5)*1000,
+                                                                                   intervals.getPercentile(0.99)*1000, intervals.getPercentile(0.999)*1000,
+                                                                                   intervals.max*1000))
+    print(colored('------- STEADY STATES -------', 'blue'))
+    print("start[s]\tend[s]\tspeed[deg/sec]\tspeed std\ttorque[Nm]\ttorque std\tpower[W]")
+    for seg in segments:
+        print("%.3f\t%.3f\t%.3f\t%.3f\t%.5f\t%.5f\t%.3f" % (seg["start"], seg["end"], seg["speedMean"], seg["speedStd"],
+                                                          seg["torqueMean"], seg["torqueStd"], seg["powerMean"]))
+    if args.out:
+        print("Resampled signals written in", args.out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
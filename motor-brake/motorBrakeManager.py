@@ -9,22 +9,39 @@
 # <andrea.mura@iit.it> <valentina.gaggero@iit.it>
 # -------------------------------------------------------------------------
 
-from concurrent.futures import thread
-
-import yarp
 from threading import Thread
 from threading import Event
-from threading import Lock
 from termcolor import colored
 from colorama import init
+import os
 import sys
 import argparse
 import time
 import signal
-from src.motorBrakeYarpCmdReader import MotorBrakeYarpCmdReader as yCmdReader
+import multiprocessing
 import src.motorBrakePromptMenu as menu
 from src.MotorBrakeDataCollector import MotorBrakeDataCollectorThread
+from src.motorBrakeIoThread import MotorBrakeIoThread
+from src.motorBrakeRingBuffer import SampleRingBuffer
+from src.motorBrakeCharacterization import TorqueSpeedMap
+from src.motorBrakeShmRing import ShmRecordRing
+from src.motorBrakeShmRing import shmSinksConsumer
 from src.motorBrakeDriver import MotorBrake as MotBrDriver
+from src.motorBrakeDriver import acqModes
+from src.motorBrakeScheduler import overrunPolicies
+from src.motorBrakeLogWriter import MotorBrakeLogCfg
+from src.motorBrakeLogWriter import logCompressions
+from src.motorBrakeLogWriter import isLogCompressionAvailable
+from src.motorBrakeInstrumentation import stageTimers
+from src.motorBrakeInstrumentation import STAGE_GET_DATA
+from src.motorBrakeInstrumentation import MotorBrakeStatsExporter
+from src.motorBrakeProfile import loadProfile
+from src.motorBrakeProfile import MotorBrakeProfileRunner
+from src.motorBrakeDiscovery import discoverDevice
+from src.motorBrakeDiscovery import discoveryCacheFile
+from src.motorBrakeReplay import MotorBrakeLogReplay
+from src.motorBrakeSetpointCoalescer import SETPOINT_DEFAULT_MAX_RATE
+from src.MotorBrakeDataCollector import MotorBrakeDataSinks
 # -------------------------------------------------------------------------
 # General
 # -------------------------------------------------------------------------
@@ -46,8 +63,25 @@ class MotorBrakeManager:
     # - 0 if all is ok
     # - 1 if serial opening fails
     # - 2 if yarp init fails
-    def init(self, serialport, baudrate, yarpServiceOn, period, file):
+    #The yarp port names are prefixed by portPrefix (e.g. "/brake1"), so more managers can run on the same yarp network
+    #If shmRingSize > 0 the data collector only writes the samples in a shared memory ring of shmRingSize records
+    #and the log, the yarp publishing and the characterization map are done by consumer processes
+    #The stage timers (see motorBrakeInstrumentation) are exported every statsPeriod seconds in the Prometheus
+    #file statsFile, if not empty, and on the yarp port /motorbrake/stats:o, if the yarp service is enabled
+    #The setpoints received on the yarp port are coalesced and sent at most maxCmdRate times per second (see motorBrakeSetpointCoalescer)
+    def init(self, serialport, baudrate, yarpServiceOn, period, file, logFormat="tsv", acqMode="poll", overrunPolicy="catchup", publishBatch=1, publishBatchMs=0, livePlot=False, charMap=None, portPrefix="", shmRingSize=0, logCfg=None, statsFile="", statsPeriod=1.0, maxCmdRate=SETPOINT_DEFAULT_MAX_RATE):
         self.yarpServiceOn = yarpServiceOn
+        self.charMap = charMap #TorqueSpeedMap computed online, None if not used
+        self.logFormat = logFormat
+        self.logCfg = logCfg #compression and rotation of the log, see MotorBrakeLogCfg
+        self.publishBatch = publishBatch
+        self.publishBatchMs = publishBatchMs
+        self.portPrefix = portPrefix
+        self.shmRing = None
+        self.shmConsumers = []
+        self.profileTh = None
+        #ring buffer read by the live plot
+        self.ringBuffer = SampleRingBuffer() if livePlot else None
         #1. open the serial port and init the driver
         self.motor_br_dev = MotBrDriver(serialport, baudrate)
         ret = self.motor_br_dev.openSerialPort()
@@ -56,6 +90,7 @@ class MotorBrakeManager:
         print ("Serial Port opened successfully")
         #2. start yarp network init
         if yarpServiceOn == True:
+            import yarp #yarp is loaded only when its service is enabled
             yarp.Network.init()
             if not yarp.Network.checkNetwork():
                 print("yarpserver is not running")
@@ -63,53 +98,123 @@ class MotorBrakeManager:
             print ("yarp network init successfully")
         else:
             print ("yarp network is not available ")
-        #3. Start the Data Collerctor and the Yarp Command Reader
+        #3. Start the serial I/O owner, the Data Collerctor and the Yarp Command Reader
         self.stopThreadsEvt = Event()
-        self.lock = Lock()
-        self.dataCollectorTh = MotorBrakeDataCollectorThread(self.motor_br_dev, self.stopThreadsEvt, self.lock, period, file, yarpServiceOn)
-        self.yCmdReaderTh = yCmdReader(self.motor_br_dev, self.stopThreadsEvt, self.lock)
+        self.ioTh = MotorBrakeIoThread(self.motor_br_dev)
+        self.ioTh.start()
+        if shmRingSize > 0:
+            self.shmRing = ShmRecordRing(capacity=shmRingSize)
+        self.dataCollectorTh = MotorBrakeDataCollectorThread(self.motor_br_dev, self.stopThreadsEvt, self.ioTh, period, file, yarpServiceOn and self.shmRing is None, logFormat, acqMode, overrunPolicy,
+                                                             publishBatch, publishBatchMs, self.ringBuffer, charMap, portPrefix, self.shmRing, logCfg)
+        self.yCmdReaderTh = None
         if yarpServiceOn == True:
+            from src.motorBrakeYarpCmdReader import MotorBrakeYarpCmdReader as yCmdReader
+            self.yCmdReaderTh = yCmdReader(self.motor_br_dev, self.stopThreadsEvt, self.ioTh, portPrefix, maxCmdRate)
             self.yCmdReaderTh.start()  
+        self.statsExporterTh = None
+        if statsFile or yarpServiceOn:
+            self.statsExporterTh = MotorBrakeStatsExporter(stageTimers, statsPeriod, statsFile, portPrefix + "/motorbrake/stats:o" if yarpServiceOn else "")
+            self.statsExporterTh.start()
         
         return 0
 
     def startAcquisition(self, filename):
         self.dataCollectorTh.setLogFileName(filename)
+        if self.shmRing is not None:
+            self.__startShmConsumers(filename)
         self.dataCollectorTh.start()
 
     def stopAcquisition(self):
         if self.dataCollectorTh.is_alive():
             self.stopThreadsEvt.set()
             self.dataCollectorTh.join()
+        #the collector has closed the ring: the consumers drain it and exit
+        for consumer in self.shmConsumers:
+            consumer.join()
+        self.shmConsumers.clear()
 
+    #The commands are queued to the serial I/O owner with priority over the data polling.
+    #They return a Future: call result() on it to wait for the device answer.
     def sendTorqueSetpoint(self, torque):
-        with self.lock:
-            self.motor_br_dev.sendTorqueSetpoint(torque)
+        return self.ioTh.submitCommand(self.motor_br_dev.sendTorqueSetpoint, torque)
 
     def sendSpeedSetpoint(self, speed):
-        with self.lock:
-            self.motor_br_dev.sendSpeedSetpoint(speed)
+        return self.ioTh.submitCommand(self.motor_br_dev.sendSpeedSetpoint, speed)
 
     def sendCustomCommand(self, command):
-        with self.lock:
-            self.motor_br_dev.sendCommand(command)
+        return self.ioTh.submitCommand(self.motor_br_dev.sendCommand, command)
+
+    #Runs in background the setpoint profile described in fileName (see motorBrakeProfile).
+    #If the acquisition is running with a log file, the setpoints are tagged with the sample index in <log file>.profile.tsv
+    #Returns False if the profile cannot be loaded or another profile is running
+    def runProfile(self, fileName):
+        if self.profileTh is not None and self.profileTh.is_alive():
+            print(colored('ERROR: a profile is already running', 'white', 'on_red'))
+            return False
+        try:
+            setpoints, durationNs = loadProfile(fileName)
+        except (OSError, ValueError) as e:
+            print(colored('ERROR: cannot load the profile: ' + str(e), 'white', 'on_red'))
+            return False
+        tagFileName = ""
+        if self.dataCollectorTh.is_alive() and self.dataCollectorTh.filelog:
+            tagFileName = self.dataCollectorTh.filelog + ".profile.tsv"
+        self.profileTh = MotorBrakeProfileRunner(self.motor_br_dev, self.ioTh, setpoints, durationNs, tagFileName)
+        self.profileTh.start()
+        return True
+
+    def stopProfile(self):
+        if self.profileTh is not None and self.profileTh.is_alive():
+            self.profileTh.stop()
 
     def deinit(self):
-        if self.dataCollectorTh.is_alive() or self.yCmdReaderTh.is_alive():
+        self.stopProfile()
+        yCmdReaderIsAlive = self.yCmdReaderTh is not None and self.yCmdReaderTh.is_alive()
+        if self.dataCollectorTh.is_alive() or yCmdReaderIsAlive:
             self.stopThreadsEvt.set()
         if self.dataCollectorTh.is_alive():
             print("Waiting for data collector...")
             self.dataCollectorTh.join()
-        if self.yCmdReaderTh.is_alive():
+        if yCmdReaderIsAlive:
             print("Waiting for yCmdReader...")
             self.yCmdReaderTh.join()
+        if self.ioTh.is_alive():
+            print("Waiting for serial I/O thread...")
+            self.ioTh.stop()
+            self.ioTh.printStats()
+        for consumer in self.shmConsumers:
+            print("Waiting for " + consumer.name + "...")
+            consumer.join()
+        if self.shmRing is not None:
+            self.shmRing.close()
+        if self.statsExporterTh is not None:
+            self.statsExporterTh.stop()
         print("closing serial port")
         self.motor_br_dev.closeSerialPort()
         if self.yarpServiceOn:
             print("closing yarp network")
+            import yarp
             yarp.Network.fini()
         print("All services are closed")        
 
+    #One consumer process for each enabled sink, so a slow sink doesn't delay the others
+    def __startShmConsumers(self, filename): #private method
+        #spawn: the consumers don't inherit the threads of this process
+        mpContext = multiprocessing.get_context("spawn")
+        consumerArgs = []
+        if filename:
+            consumerArgs.append(("log", filename, self.logFormat, "", 1, 0, None, self.logCfg))
+        if self.yarpServiceOn:
+            consumerArgs.append(("yarp", "", self.logFormat, self.portPrefix + "/motorbrake/out", self.publishBatch, self.publishBatchMs, None, None))
+        if self.charMap is not None:
+            #the map is computed and saved by the consumer, so it cannot be shown by the menu
+            consumerArgs.append(("analysis", "", self.logFormat, "", 1, 0, self.charMap, None))
+            self.charMap = None
+        for args in consumerArgs:
+            consumer = mpContext.Process(target=shmSinksConsumer, name="ShmRingConsumer_" + args[0], args=(self.shmRing.name,) + args)
+            consumer.start()
+            self.shmConsumers.append(consumer)
+
 
 # -------------------------------------------------------------------------
 # parseInputArgument
@@ -122,9 +227,31 @@ def parseInputArgument(argv):
     parser.add_argument("-y", "--yarpServiceOn", action="store_true", help="enable yarp service")
     parser.add_argument("-d", "--daemon", action="store_true", help="starting as daemon, without menu for user interaction")
     parser.add_argument("-f", "--file", default="", help="name of file where log data")
+    parser.add_argument("--format", default="tsv", choices=["tsv", "bin"], help="format of the log file: tab separated text or compact binary records")
+    parser.add_argument("--compress", default="none", choices=logCompressions, help="compression of the log file (zstd and lz4 need the zstandard and lz4 packages)")
+    parser.add_argument("--rotateSize", default=0, type=float, help="size (MB, before compression) of the log chunks (0: disabled)")
+    parser.add_argument("--rotateInterval", default=0, type=float, help="duration (seconds) of the log chunks (0: disabled)")
     parser.add_argument("-p", "--period", default=0.015, type=float,help="acquisition data period(seconds)")
-    parser.add_argument("-s", "--serialPort", default='/dev/ttyUSB0', help="Serial port")
+    parser.add_argument("--overrunPolicy", default="catchup", choices=overrunPolicies, help="what to do when a sample misses its deadline: acquire the missed samples immediately (catchup) or skip them (skip)")
+    parser.add_argument("-m", "--acqMode", default="poll", choices=acqModes, help="acquisition mode: request/response (poll), one request always in flight (pipeline) or device continuous output (continuous)")
+    parser.add_argument("--publishBatch", default=1, type=int, help="number of samples published in each bottle on /motorbrake/out (1: one sample per bottle)")
+    parser.add_argument("--publishBatchMs", default=0, type=float, help="max age (milliseconds) of the first sample of a batch before it is published (0: disabled)")
+    parser.add_argument("-l", "--livePlot", action="store_true", help="enable the live plot of speed and torque (in daemon mode it is shown at start)")
+    parser.add_argument("--charMap", default="", help="name of the .npz file where the torque-speed characterization map computed online is saved at stop (empty: disabled)")
+    parser.add_argument("--charSpeedBins", nargs=3, type=float, default=[-3600.0, 3600.0, 72], metavar=("MIN", "MAX", "BINS"), help="speed range [deg/sec] and number of bins of the characterization map")
+    parser.add_argument("--charTorqueBins", nargs=3, type=float, default=[-10.0, 10.0, 40], metavar=("MIN", "MAX", "BINS"), help="torque range [Nm] and number of bins of the characterization map")
+    parser.add_argument("--shmRing", default=0, type=int, help="number of records of the shared memory ring: if greater than 0 the acquisition only writes the samples in the ring and log, yarp publishing and characterization map run in separate processes (0: disabled)")
+    parser.add_argument("--profile", default="", help="name of the JSON file of the setpoint profile run when the acquisition starts in daemon mode (empty: disabled)")
+    parser.add_argument("--stageTimers", action="store_true", help="enable the timers of the acquisition stages at start (they can be enabled later by the menu or by the yarp command 'stats on')")
+    parser.add_argument("--statsFile", default="", help="name of the file where the stage timers are exported in the Prometheus text format (empty: disabled)")
+    parser.add_argument("--statsPeriod", default=1.0, type=float, help="export period (seconds) of the stage timers")
+    parser.add_argument("--maxCmdRate", default=SETPOINT_DEFAULT_MAX_RATE, type=float, help="max number of setpoints/sec sent to the device from the yarp port: only the latest value of each type is sent (0: no limit)")
+    parser.add_argument("-a", "--asyncio", action="store_true", help="run driver, acquisition and commands as coroutines on one asyncio event loop")
+    parser.add_argument("-s", "--serialPort", default='/dev/ttyUSB0', help="Serial port ('auto': the device is discovered, see --discoveryCache)")
+    parser.add_argument("--discoveryCache", default=discoveryCacheFile, help="file where the port, baud rate and id of the device discovered are cached (empty: no cache)")
     parser.add_argument("-b", "--baudrate", default=19200, type=int, help="Serial port baud rate")
+    parser.add_argument("-r", "--replay", default="", help="name of the log to replay on /motorbrake/out instead of acquiring from the device (tsv, bin, compressed or .index; empty: disabled)")
+    parser.add_argument("--replaySpeed", default=1.0, type=float, help="speed of the replay: 1 keeps the original timing, N is N times faster, 0 is as fast as possible")
     args = parser.parse_args()
     config = vars(args)
     print(config)
@@ -149,15 +276,15 @@ def runWithPromptMenu():
         elif cmd_menu == menu.MENU_CODE_set_trq:
             print(colored('Type the torque value to send:  ', 'green'), end='\b')
             torque = menu.inputFloatValue()
-            brkManager.sendTorqueSetpoint(torque)
+            brkManager.sendTorqueSetpoint(torque).result()
         elif cmd_menu == menu.MENU_CODE_set_sp:
             print(colored('Type the speed value to send:  ', 'green'), end='\b')
             speed = menu.inputFloatValue()
-            brkManager.sendSpeedSetpoint(speed)
+            brkManager.sendSpeedSetpoint(speed).result()
         elif cmd_menu == menu.MENU_CODE_custom:
             print(colored('Type the command to send:  ', 'green'), end='\b')
             message_send = input()
-            brkManager.sendCustomCommand(message_send)
+            brkManager.sendCustomCommand(message_send).result()
         elif cmd_menu == menu.MENU_CODE_quit:
             print ("Recived quit command")
             brkManager.deinit()
@@ -166,12 +293,40 @@ def runWithPromptMenu():
         elif cmd_menu == menu.MENU_CODE_ena_disa_acqtiming:
             print(colored('Type 0 to disable or 1 to enable:  ', 'green'), end='\b')
             cmd = menu.inputIntValue()
+            #the duration of getData is the stage get_data of the stage timers: it is printed here, out of the acquisition
             if cmd == 0:
-                brkManager.motor_br_dev.disableAcquisitionTiming()
+                stageTimers.disable()
+                stageTimers.stats[STAGE_GET_DATA].printStats()
             elif cmd == 1:
-                print(colored('Type the period in seconds:  ', 'green'), end='\b')
-                period = menu.inputFloatValue()
-                brkManager.motor_br_dev.enableAcquisitionTiming(period)
+                stageTimers.enable()
+            else:
+                print('Admited values: 0 (diable) and 1 (enable)')
+        elif cmd_menu == menu.MENU_CODE_live_plot:
+            if brkManager.ringBuffer is None:
+                print('The live plot is not enabled: please restart with --livePlot option')
+            else:
+                print('Close the plot window to return to the menu')
+                from src.motorBrakeLivePlot import MotorBrakeLivePlot #matplotlib is loaded only when the plot is shown
+                MotorBrakeLivePlot(brkManager.ringBuffer).show()
+        elif cmd_menu == menu.MENU_CODE_char_map:
+            if brkManager.charMap is None:
+                print('The characterization map is not enabled: please restart with --charMap option')
+            else:
+                brkManager.charMap.printSummary()
+        elif cmd_menu == menu.MENU_CODE_profile:
+            print(colored('Type the profile file name (empty to stop the running profile):  ', 'green'), end='\b')
+            profileFileName = input()
+            if profileFileName:
+                brkManager.runProfile(profileFileName)
+            else:
+                brkManager.stopProfile()
+        elif cmd_menu == menu.MENU_CODE_stage_timers:
+            print(colored('Type 0 to disable or 1 to enable:  ', 'green'), end='\b')
+            cmd = menu.inputIntValue()
+            if cmd == 0:
+                stageTimers.disable()
+            elif cmd == 1:
+                stageTimers.enable()
             else:
                 print('Admited values: 0 (diable) and 1 (enable)')
 
@@ -180,15 +335,56 @@ def runWithPromptMenu():
 # -------------------------------------------------------------------------
 def runAsDaemon(args):
     brkManager.startAcquisition(args.file)
+    if args.profile:
+        brkManager.runProfile(args.profile)
+    if args.livePlot:
+        #the plot runs in the main thread, the acquisition goes on in background
+        from src.motorBrakeLivePlot import MotorBrakeLivePlot
+        MotorBrakeLivePlot(brkManager.ringBuffer).show()
     while(True):
         time.sleep(0.1)
 
+# -------------------------------------------------------------------------
+# runReplay
+# -------------------------------------------------------------------------
+#The log is published on /motorbrake/out with the same bottles of the acquisition; the device is not used
+def runReplay(args):
+    if not os.path.isfile(args.replay):
+        print(colored('ERROR: the log ' + args.replay + ' does not exist', 'white', 'on_red'))
+        return
+    if args.replaySpeed < 0:
+        print(colored('ERROR: the replay speed cannot be negative', 'white', 'on_red'))
+        return
+    import yarp #yarp is loaded only when its service is enabled
+    yarp.Network.init()
+    if not yarp.Network.checkNetwork():
+        print(colored('ERROR: fail init yarp network!!', 'white', 'on_red'))
+        return
+    yarpOutPort = yarp.BufferedPortBottle()
+    yarpOutPort.open("/motorbrake/out")
+    sinks = MotorBrakeDataSinks("", args.format, yarpOutPort, args.publishBatch, args.publishBatchMs)
+    replayTh = MotorBrakeLogReplay(args.replay, sinks, args.replaySpeed)
+    signal.signal(signal.SIGINT, lambda signum, frame: replayTh.stopEvt.set())
+    replayTh.start()
+    while replayTh.is_alive():
+        replayTh.join(0.1)
+    yarpOutPort.close()
+    yarp.Network.fini()
+
 # -------------------------------------------------------------------------
 # main
 # -------------------------------------------------------------------------
 brkManager = MotorBrakeManager();
 
 
+def initManager(args, serialPort, baudrate, charMap, logCfg):
+    if args.asyncio:
+        return brkManager.init(serialPort, baudrate, args.yarpServiceOn, args.period, args.file, args.format, args.acqMode, args.overrunPolicy,
+                               args.publishBatch, args.publishBatchMs, args.livePlot, charMap, logCfg, args.statsFile, args.statsPeriod, args.maxCmdRate)
+    return brkManager.init(serialPort, baudrate, args.yarpServiceOn, args.period, args.file, args.format, args.acqMode, args.overrunPolicy,
+                           args.publishBatch, args.publishBatchMs, args.livePlot, charMap, shmRingSize=args.shmRing, logCfg=logCfg,
+                           statsFile=args.statsFile, statsPeriod=args.statsPeriod, maxCmdRate=args.maxCmdRate)
+
 def sigIntHandler(signum, frame) -> int:
     print ("Recived ctrl +c")
     brkManager.deinit()
@@ -207,20 +403,61 @@ def main():
 
     args = parseInputArgument(sys.argv)
 
-    ret = brkManager.init(args.serialPort, args.baudrate,args.yarpServiceOn, args.period, args.file)
+    if args.replay:
+        runReplay(args)
+        return
+
+    global brkManager
+    if args.asyncio:
+        from src.motorBrakeAsyncManager import MotorBrakeAsyncRunner
+        brkManager = MotorBrakeAsyncRunner()
+
+    if not isLogCompressionAvailable(args.compress):
+        print(colored('ERROR: the package for ' + args.compress + ' compression is not installed', 'white', 'on_red'))
+        return
+    logCfg = MotorBrakeLogCfg(args.compress, int(args.rotateSize * 1e6), args.rotateInterval)
+    if args.stageTimers:
+        stageTimers.enable()
+
+    charMap = None
+    if args.charMap:
+        charMap = TorqueSpeedMap((args.charSpeedBins[0], args.charSpeedBins[1]), int(args.charSpeedBins[2]),
+                                 (args.charTorqueBins[0], args.charTorqueBins[1]), int(args.charTorqueBins[2]), args.charMap)
+
+    if args.asyncio and args.shmRing > 0:
+        print(colored('WARNING: the shared memory ring is not available with --asyncio, it is ignored', 'white', 'on_cyan'))
+
+    serialPort = args.serialPort
+    baudrate = args.baudrate
+    discoveryDone = False
+    if serialPort == "auto":
+        dev = discoverDevice(args.discoveryCache)
+        discoveryDone = True
+        if dev is not None:
+            serialPort = dev.port
+            baudrate = dev.baudrate
+    ret = initManager(args, serialPort, baudrate, charMap, logCfg)
     #if ret == 0 all is ok
     if ret == 1:
         print(colored('ERROR: fail open the serial port!!', 'white', 'on_red'))
-        #if it fails and not is running ad deamon a prompt menu is proposed to the user
-        if args.daemon == False:
-            chosen_com_port = scanComPort()
-            if chosen_com_port == 0:
+        #the device is searched on all the serial ports; if it is not found and not is running as daemon a prompt menu is proposed to the user
+        dev = discoverDevice(args.discoveryCache) if not discoveryDone else None
+        if dev is not None:
+            serialPort = dev.port
+            baudrate = dev.baudrate
+        elif args.daemon == False:
+            serialPort = menu.scanComPort()
+            if serialPort == 0:
                 print(colored('ERROR: I cannot open the serial port...exiting', 'white', 'on_red')) 
                 return
-            brkManager.init(args.serialPort, args.yarpServiceOn, args.period, args.file)
         else:
+            print(colored('ERROR: the device has not been found...exiting', 'white', 'on_red'))
+            return
+        ret = initManager(args, serialPort, baudrate, charMap, logCfg)
+        if ret == 1:
+            print(colored('ERROR: I cannot open the serial port ' + str(serialPort) + '...exiting', 'white', 'on_red'))
             return
-    elif ret == 2:
+    if ret == 2:
         print(colored('ERROR: fail init yarp network!!', 'white', 'on_red'))
         return
 
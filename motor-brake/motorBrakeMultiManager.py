@@ -0,0 +1,254 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Python script for acquiring data from several motor brake devices at the
+# same time. The devices are listed in a JSON configuration file (see the
+# README). Each device is managed by a MotorBrakeManager running in its own
+# process, so the devices don't share any lock nor the GIL: a slow device
+# cannot stall the acquisition of the others.
+# The yarp ports of each device are prefixed with its name, e.g.
+# "/brake1/motorbrake/out" and "/brake1/motorbrake/cmd:i".
+# At stop the per-device binary logs are merged in one time-aligned tab
+# separated log and the throughput of each device is printed.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import multiprocessing
+from termcolor import colored
+from colorama import init
+from src.motorBrakeBinLog import mergeBinLogs
+
+# -------------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------------
+
+# Default values of the device settings: the top level of the configuration
+# file can override them for all the devices and each device for itself.
+deviceCfgDefaults = {
+    "baudrate": 19200,
+    "period": 0.015,
+    "acqMode": "poll",
+    "overrunPolicy": "catchup",
+    "publishBatch": 1,
+    "publishBatchMs": 0,
+    "maxCmdRate": 20.0,
+}
+
+# Reads the configuration file and returns the tuple (yarpServiceOn, file, list of device configurations)
+# Each device configuration is a dictionary with all the keys of deviceCfgDefaults plus "name" and "serialPort"
+def loadConfig(fileName):
+    with open(fileName) as f:
+        cfg = json.load(f)
+    devices = cfg.get("devices", [])
+    if len(devices) == 0:
+        raise ValueError(fileName + ": no devices configured")
+    common = {key: cfg.get(key, value) for key, value in deviceCfgDefaults.items()}
+    devCfgList = []
+    for dev in devices:
+        if "name" not in dev or "serialPort" not in dev:
+            raise ValueError(fileName + ": each device needs a name and a serialPort")
+        devCfg = dict(common)
+        devCfg.update(dev)
+        devCfgList.append(devCfg)
+    names = [devCfg["name"] for devCfg in devCfgList]
+    if len(set(names)) != len(names):
+        raise ValueError(fileName + ": the device names must be unique")
+    return cfg.get("yarpServiceOn", False), cfg.get("file", ""), devCfgList
+
+# -------------------------------------------------------------------------
+# Device worker
+# -------------------------------------------------------------------------
+
+# Body of the process of one device. It receives the requests on cmdQueue as
+# tuples (command, argument) and puts the replies on resultQueue as tuples
+# (device name, command, result).
+def deviceWorker(devCfg, yarpServiceOn, cmdQueue, resultQueue):
+    #ctrl+c is handled by the main process, that stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from motorBrakeManager import MotorBrakeManager
+    name = devCfg["name"]
+    brkManager = MotorBrakeManager()
+    ret = brkManager.init(devCfg["serialPort"], devCfg["baudrate"], yarpServiceOn, devCfg["period"], "", "bin",
+                          devCfg["acqMode"], devCfg["overrunPolicy"], devCfg["publishBatch"], devCfg["publishBatchMs"],
+                          portPrefix="/" + name, maxCmdRate=devCfg["maxCmdRate"])
+    resultQueue.put((name, "init", ret))
+    if ret != 0:
+        return
+    while True:
+        cmd, arg = cmdQueue.get()
+        if cmd == "start":
+            brkManager.startAcquisition(arg)
+        elif cmd == "stop":
+            brkManager.stopAcquisition()
+            collector = brkManager.dataCollectorTh
+            resultQueue.put((name, "stop", {"samples": collector.numOfSamples, "duration": collector.acqDuration,
+                                            "overruns": collector.scheduler.numOfOverruns,
+                                            "jitter": collector.scheduler.jitterStats.getSnapshot()}))
+        elif cmd == "torque":
+            brkManager.sendTorqueSetpoint(arg).result()
+        elif cmd == "speed":
+            brkManager.sendSpeedSetpoint(arg).result()
+        elif cmd == "quit":
+            brkManager.deinit()
+            resultQueue.put((name, "quit", 0))
+            return
+
+# -------------------------------------------------------------------------
+# Multi device manager
+# -------------------------------------------------------------------------
+class MotorBrakeMultiManager:
+    def __init__(self):
+        #spawn: the workers don't inherit threads and yarp state of this process
+        self.mpContext = multiprocessing.get_context("spawn")
+        self.workers = {}
+        self.cmdQueues = {}
+        self.resultQueue = self.mpContext.Queue()
+        self.logFiles = {}
+        self.stats = {}
+
+    #Starts one worker process for each device and waits for their init
+    #Returns the list of the names of the devices whose init failed (see MotorBrakeManager.init)
+    def init(self, devCfgList, yarpServiceOn):
+        for devCfg in devCfgList:
+            name = devCfg["name"]
+            self.cmdQueues[name] = self.mpContext.Queue()
+            self.workers[name] = self.mpContext.Process(target=deviceWorker, name="MotorBrake_" + name,
+                                                        args=(devCfg, yarpServiceOn, self.cmdQueues[name], self.resultQueue))
+            self.workers[name].start()
+        failed = []
+        for name, ret in self.__waitReplies("init").items():
+            if ret != 0:
+                print(colored('ERROR: init of device ' + name + ' failed with code ' + str(ret), 'white', 'on_red'))
+                failed.append(name)
+        for name in failed:
+            self.workers.pop(name).join()
+            self.cmdQueues.pop(name)
+        return failed
+
+    #Each device logs on <file>_<device name>.bin; if file is empty the data aren't dumped
+    def startAcquisition(self, file):
+        self.logFiles.clear()
+        for name, cmdQueue in self.cmdQueues.items():
+            if file:
+                self.logFiles[name] = file + "_" + name + ".bin"
+            cmdQueue.put(("start", self.logFiles.get(name, "")))
+
+    def stopAcquisition(self):
+        for cmdQueue in self.cmdQueues.values():
+            cmdQueue.put(("stop", None))
+        self.stats = self.__waitReplies("stop")
+
+    def sendTorqueSetpoint(self, name, torque):
+        self.cmdQueues[name].put(("torque", torque))
+
+    def sendSpeedSetpoint(self, name, speed):
+        self.cmdQueues[name].put(("speed", speed))
+
+    # Merges the logs of the last acquisition in one tab separated file ordered by time.
+    # Only the devices that replied to stop are merged: the log of a device whose process
+    # terminated unexpectedly could be missing or truncated.
+    # Returns the number of merged records
+    def mergeLogs(self, tsvFileName):
+        names = [name for name in self.logFiles if name in self.stats and os.path.isfile(self.logFiles[name])]
+        for name in self.logFiles:
+            if name not in names:
+                print(colored('WARNING: the log of device ' + name + ' is not merged', 'white', 'on_cyan'))
+        if len(names) == 0:
+            return 0
+        return mergeBinLogs([self.logFiles[name] for name in names], names, tsvFileName)
+
+    def printStats(self):
+        print(colored('------- MULTI DEVICE THROUGHPUT -------', 'blue'))
+        totSamples = 0
+        for name, st in self.stats.items():
+            rate = st["samples"] / st["duration"] if st["duration"] > 0 else 0
+            totSamples += st["samples"]
+            print(colored("%-12s samples=%9d  rate=%9.2f samples/sec  overruns=%6d  jitter p99=%8.3f ms" % (
+                name, st["samples"], rate, st["overruns"], st["jitter"]["p99"] * 1000), 'blue'))
+        print(colored("total samples=" + str(totSamples), 'blue'))
+
+    def deinit(self):
+        for cmdQueue in self.cmdQueues.values():
+            cmdQueue.put(("quit", None))
+        self.__waitReplies("quit")
+        for worker in self.workers.values():
+            worker.join()
+        print("All devices are closed")
+
+    # Returns the dictionary device name -> result of the replies to cmd.
+    # A worker that terminated without replying is removed.
+    def __waitReplies(self, cmd): #private method
+        replies = {}
+        while len(replies) < len(self.workers):
+            try:
+                name, replyCmd, result = self.resultQueue.get(timeout=1.0)
+            except queue.Empty:
+                for name, worker in list(self.workers.items()):
+                    if name not in replies and not worker.is_alive():
+                        print(colored('ERROR: the process of device ' + name + ' terminated unexpectedly', 'white', 'on_red'))
+                        self.workers.pop(name)
+                        self.cmdQueues.pop(name)
+                continue
+            if replyCmd == cmd:
+                replies[name] = result
+        return replies
+
+# -------------------------------------------------------------------------
+# parseInputArgument
+# -------------------------------------------------------------------------
+def parseInputArgument(argv):
+    parser = argparse.ArgumentParser(description="Acquires data from several motor brake devices listed in a configuration file",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("config", help="JSON configuration file with the list of devices")
+    parser.add_argument("-d", "--daemon", action="store_true", help="starting as daemon: the acquisition stops with ctrl+c instead of Enter")
+    args = parser.parse_args()
+    return args
+
+# -------------------------------------------------------------------------
+# main
+# -------------------------------------------------------------------------
+def main():
+    init()
+    args = parseInputArgument(sys.argv)
+    try:
+        yarpServiceOn, file, devCfgList = loadConfig(args.config)
+    except (OSError, ValueError) as e:
+        print(colored('ERROR: ' + str(e), 'white', 'on_red'))
+        return 1
+
+    multiManager = MotorBrakeMultiManager()
+    multiManager.init(devCfgList, yarpServiceOn)
+    if len(multiManager.workers) == 0:
+        print(colored('ERROR: no device available...exiting', 'white', 'on_red'))
+        return 1
+
+    multiManager.startAcquisition(file)
+    print("Acquiring from", list(multiManager.workers.keys()))
+    try:
+        if args.daemon:
+            while True:
+                time.sleep(0.1)
+        else:
+            print(colored('press Enter to stop the acquisition', 'green'))
+            input()
+    except KeyboardInterrupt:
+        print ("Recived ctrl +c")
+    multiManager.stopAcquisition()
+    multiManager.printStats()
+    if file:
+        numOfRecords = multiManager.mergeLogs(file + "_merged.tsv")
+        print("Merged", numOfRecords, "records in", file + "_merged.tsv")
+    multiManager.deinit()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,8 @@
 # Here the class MotorBrakeDataCollectorThread id defined. As its name says, 
 # it is a thread that collects the data from the motor-brake device and
 # dumps them on file and/or publish them on yarp port "/motorbrake/out"
-# depending by its configuration.
+# (optionally with a prefix, e.g. "/brake1/motorbrake/out") depending by its
+# configuration.
 # The interaction with the hardware device is performed by the driver developed 
 # in MotorBrakeDriver.py for the DSP6001 Dynamometer Controller
 #
@@ -12,68 +13,301 @@
 # <valentina.gaggero@iit.it>
 # -------------------------------------------------------------------------
 
-import yarp
 from threading import Thread
 from threading import Event
-from threading import Lock
 from src.motorBrakeDriver import MotorBrake as MotBrDriver
+from src.motorBrakeDriver import ACQ_MODE_POLL
+from src.motorBrakeDriver import MotorBrakeGap
+from src.motorBrakeDriver import GAP_REASON_GARBAGE
+from src.motorBrakeDriver import GAP_REASON_PORT_LOST
+from src.motorBrakeLogWriter import MotorBrakeLogWriter
+from src.motorBrakeLogWriter import TsvRecordFormat
+from src.motorBrakeLogWriter import WallClockFormatter
+from src.motorBrakeLogWriter import MotorBrakeLogCfg
+from src.motorBrakeBinLog import BinRecordFormat
+from src.motorBrakeScheduler import DeadlineScheduler
+from src.motorBrakeScheduler import OVERRUN_POLICY_CATCHUP
+from src.motorBrakeShmRing import ShmRingSink
+from src.motorBrakeInstrumentation import stageTimers, STAGE_LOG_WRITE, STAGE_YARP_PUBLISH
+from src.motorBrakeStatistics import StreamingStatistics
+from termcolor import colored
+import serial
 import time
+# -------------------------------------------------------------------------
+# Data sinks
+# -------------------------------------------------------------------------
+
+# It dumps each sample on the log file and/or publishes it on the yarp port.
+# It is used by MotorBrakeDataCollectorThread and by the asyncio manager.
+# On the yarp port the samples can be published one per bottle (publishBatch=1
+# and publishBatchMs=0, the default) or in batches: a batch is sent when it
+# contains publishBatch samples or when its first sample is older than
+# publishBatchMs milliseconds. See the README for the layout of the bottles.
+class MotorBrakeDataSinks:
+    def __init__(self, logFileName, logFormat, yarpOutPort, publishBatch=1, publishBatchMs=0, ringBuffer=None, charMap=None, logCfg=None):
+        self.filelog = logFileName
+        self.logFormat = logFormat #"tsv" or "bin"
+        self.logCfg = logCfg if logCfg is not None else MotorBrakeLogCfg() #compression and rotation of the log
+        self.yarpOutPort = yarpOutPort #None if yarp service is disabled
+        self.publishBatch = max(1, publishBatch)
+        self.publishBatchNs = int(publishBatchMs * 1e6)
+        self.batchIsEna = self.publishBatch > 1 or self.publishBatchNs > 0
+        self.batch = []
+        self.logWriter = None
+        self.ringBuffer = ringBuffer #SampleRingBuffer read by the live plot, None if not used
+        self.charMap = charMap #TorqueSpeedMap updated online, None if not used
+        self.numOfBottles = 0
+
+    def open(self):
+        #single wall-clock anchor of the session: the samples carry only their monotonic timestamp
+        self.clock = WallClockFormatter()
+        if self.filelog:
+            #the log file stays open for the whole session, see MotorBrakeLogWriter
+            if self.logFormat == "bin":
+                recordFormat = BinRecordFormat(self.clock.wallAnchorNs, self.clock.monoAnchorNs)
+            else:
+                recordFormat = TsvRecordFormat(self.clock.wallAnchorNs, self.clock.monoAnchorNs)
+            self.logWriter = MotorBrakeLogWriter(self.filelog, recordFormat, logCfg=self.logCfg)
+            self.logWriter.open()
+
+    def write(self, motor_br_data):
+        if self.logWriter is not None:
+            t = stageTimers.start()
+            self.logWriter.writeRecord(motor_br_data)
+            stageTimers.lap(STAGE_LOG_WRITE, t)
+        if self.ringBuffer is not None:
+            self.ringBuffer.write(motor_br_data.timestampNs, motor_br_data.speed, motor_br_data.torque)
+        if self.charMap is not None:
+            self.charMap.addSample(motor_br_data.speed, motor_br_data.torque)
+        if self.yarpOutPort is None:
+            return
+        if not self.batchIsEna:
+            t = stageTimers.start()
+            bottle = self.yarpOutPort.prepare()
+            bottle.clear()
+            bottle.addFloat32(motor_br_data.speed)
+            bottle.addFloat32(motor_br_data.torque)
+            bottle.addString(motor_br_data.rotation) #R is Clockwise dynamometer shaft rotation (right), while L is Counterclockwise dynamometer shaft rotation (left).
+            bottle.addFloat64(self.clock.toWallTimeNs(motor_br_data.timestampNs)/1e9) #wall-clock time of the sample (seconds since epoch)
+            self.yarpOutPort.write()
+            stageTimers.lap(STAGE_YARP_PUBLISH, t)
+            self.numOfBottles += 1
+            return
+        #the sample is copied because motor_br_data is updated by the driver
+        self.batch.append((motor_br_data.progNum, motor_br_data.timestampNs, motor_br_data.speed, motor_br_data.torque, motor_br_data.rotation))
+        if len(self.batch) >= self.publishBatch or \
+           (self.publishBatchNs > 0 and motor_br_data.timestampNs - self.batch[0][1] >= self.publishBatchNs):
+            self.__publishBatch()
+
+    # The gap is written only in the log: the yarp readers see it as missing samples
+    def writeGap(self, gap):
+        if self.logWriter is not None:
+            self.logWriter.writeGap(gap)
+
+    def close(self):
+        if self.batch:
+            self.__publishBatch()
+        if self.charMap is not None:
+            self.charMap.save() #dumps the map computed during the session
+        if self.yarpOutPort is not None:
+            print("MotorBrakeDataSinks: published", self.numOfBottles, "bottles")
+        if self.logWriter is not None:
+            self.logWriter.close()
+            self.logWriter.printStats()
+            self.logWriter = None
+
+    def __publishBatch(self): #private method
+        t = stageTimers.start()
+        bottle = self.yarpOutPort.prepare()
+        bottle.clear()
+        bottle.addString("batch")
+        bottle.addInt32(len(self.batch))
+        for progNum, timestampNs, speed, torque, rotation in self.batch:
+            bottle.addInt64(progNum)
+            bottle.addFloat64(self.clock.toWallTimeNs(timestampNs)/1e9)
+            bottle.addFloat32(speed)
+            bottle.addFloat32(torque)
+            bottle.addString(rotation)
+        self.yarpOutPort.write()
+        stageTimers.lap(STAGE_YARP_PUBLISH, t)
+        self.numOfBottles += 1
+        self.batch.clear()
+
+
 # -------------------------------------------------------------------------
 # Data acquisition
 # -------------------------------------------------------------------------
 
+# Recovery of the acquisition:
+#  - a garbled or missing data string is dropped and the input of the port is
+#    resynchronized (see MotorBrake.resync)
+#  - after MAX_CONSECUTIVE_BAD_FRAMES bad data strings, or if the port raises an
+#    error, the port is considered lost and it is reopened with an exponential
+#    backoff from RECONNECT_MIN_DELAY to RECONNECT_MAX_DELAY seconds
+# The session goes on: each period without valid samples is written in the log
+# as a gap (see MotorBrakeGap) and counted in the statistics printed at stop.
+MAX_CONSECUTIVE_BAD_FRAMES = 10
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
+
 class MotorBrakeDataCollectorThread (Thread):
-    def __init__(self, motor_br_dev, stopEvt, lock, period, logFileName, yarpSrvEnable):
+    def __init__(self, motor_br_dev, stopEvt, ioTh, period, logFileName, yarpSrvEnable, logFormat="tsv", acqMode=ACQ_MODE_POLL, overrunPolicy=OVERRUN_POLICY_CATCHUP, publishBatch=1, publishBatchMs=0, ringBuffer=None, charMap=None, portPrefix="", shmRing=None, logCfg=None):
         Thread.__init__(self)
         self.motor_br_dev = motor_br_dev
         self.period = period
         self.stopEvt = stopEvt
         self.filelog = logFileName
+        self.logFormat = logFormat #"tsv" or "bin"
+        self.acqMode = acqMode #see acquisition modes in motorBrakeDriver
+        self.scheduler = DeadlineScheduler(period, overrunPolicy)
         self.yarpSrvEnable =yarpSrvEnable
-        self.lock = lock
+        self.publishBatch = publishBatch
+        self.publishBatchMs = publishBatchMs
+        self.ringBuffer = ringBuffer
+        self.charMap = charMap
+        self.logCfg = logCfg
+        self.shmRing = shmRing #if not None, the samples are only written in this ShmRecordRing, the sinks are consumer processes
+        self.ioTh = ioTh #all the requests to motor_br_dev are executed by the serial I/O owner thread
         if self.yarpSrvEnable == True:
+            import yarp #loaded only when the yarp service is enabled
             self.yarpOutPort = yarp.BufferedPortBottle()
-            self.yarpOutPort.open("/motorbrake/out")
+            self.yarpOutPort.open(portPrefix + "/motorbrake/out")
+        #throughput of the last acquisition session
+        self.numOfSamples = 0
+        self.acqDuration = 0.0
+        #gaps of the last acquisition session
+        self.numOfGaps = 0
+        self.numOfDropped = 0
+        self.outageStats = StreamingStatistics("acquisition gap duration")
+        self.gapStartNs = 0 #0 if there isn't a gap in progress
+        self.gapsDurationNs = 0 #total duration of the gaps closed
     def run(self):
         print ("MotorBrakeDataCollector is starting ")
-        if self.filelog:
-            with open(self.filelog, 'w') as f:
-                f.write("#\tTime\tSpeed[deg/sec]\tTorque[Nm]\tRotation[R or L]\n")
+        if self.shmRing is not None:
+            sinks = ShmRingSink(self.shmRing, self.ringBuffer)
+        else:
+            sinks = MotorBrakeDataSinks(self.filelog, self.logFormat, self.yarpOutPort if self.yarpSrvEnable else None,
+                                        self.publishBatch, self.publishBatchMs, self.ringBuffer, self.charMap, self.logCfg)
+        sinks.open()
+        if self.acqMode != ACQ_MODE_POLL:
+            #in streaming modes the rate is given by the serial link, so the period is not used
+            self.ioTh.submitPoll(self.motor_br_dev.startStreaming, self.acqMode).result()
+        acqStartTime = time.monotonic()
+        numOfSamples = 0
+        self.numOfGaps = 0
+        self.numOfDropped = 0
+        self.outageStats.reset()
+        self.gapStartNs = 0
+        self.gapsDurationNs = 0
+        numOfBadFrames = 0 #consecutive
+        self.scheduler.start()
         
         while True:
             if self.stopEvt.is_set():
+                if self.gapStartNs != 0:
+                    self.__endGap(sinks)
+                if self.acqMode != ACQ_MODE_POLL:
+                    try:
+                        self.ioTh.submitPoll(self.motor_br_dev.stopStreaming).result()
+                    except (serial.SerialException, OSError):
+                        pass #the port is lost, there is nothing to stop
+                acqDuration = time.monotonic() - acqStartTime
+                self.numOfSamples = numOfSamples
+                self.acqDuration = acqDuration
+                if acqDuration > 0:
+                    print("MotorBrakeDataCollector: acquired", numOfSamples, "samples,", numOfSamples/acqDuration, "samples/sec")
+                if self.acqMode == ACQ_MODE_POLL:
+                    self.scheduler.printStats()
+                self.printGapStats()
+                sinks.close()
                 if self.yarpSrvEnable ==True:
                     self.yarpOutPort.close()
-                if self.filelog:
-                    f.close()
                 print ("MotorBrakeDataCollector is closing...")
                 break;
-            start_time = time.time()
-            with self.lock:
-                motor_br_data = self.motor_br_dev.getData()
-
-            if self.filelog:
-                with open(self.filelog, 'a') as f:
-                    f.write(str(motor_br_data.progNum) + '\t' + motor_br_data.time + '\t' + str(motor_br_data.speed) + '\t' + str(motor_br_data.torque) + '\t' + motor_br_data.rotation + '\t' + '\n')
-            if self.yarpSrvEnable ==True:
-                bottle = self.yarpOutPort.prepare()
-                bottle.clear()
-                bottle.addFloat32(motor_br_data.speed)
-                bottle.addFloat32(motor_br_data.torque)
-                bottle.addString(motor_br_data.rotation) #R is Clockwise dynamometer shaft rotation (right), while L is Counterclockwise dynamometer shaft rotation (left).
-                self.yarpOutPort.write()
-            thExeDuration = time.time() - start_time
-            #print("MotorBrakeDataCollectorThread: exetime=", thExeDuration, "sleep for", self.period-thExeDuration)
-            sleep_time = self.period-thExeDuration
-            if sleep_time>0:
-                time.sleep(sleep_time) #go to sleep for remaing time
-
-            #ATTENTION:
-            #note about sleep function
-            #Changed in version 3.5: The function now sleeps at least secs even if the sleep is interrupted by a signal,
-            #except if the signal handler raises an exception (see PEP 475 for the rationale).
-            #from: https://docs.python.org/3/library/time.html#time.sleep
+            try:
+                if self.acqMode == ACQ_MODE_POLL:
+                    motor_br_data = self.ioTh.submitPoll(self.motor_br_dev.getData).result()
+                else:
+                    motor_br_data = self.ioTh.submitPoll(self.motor_br_dev.getStreamData).result()
+            except (serial.SerialException, OSError) as e:
+                print(colored('MotorBrakeDataCollector: serial port lost (' + str(e) + ')', 'white', 'on_red'))
+                self.__reconnect(numOfSamples, acqStartTime)
+                numOfBadFrames = 0
+                continue
+
+            if self.motor_br_dev.lastFrameOk:
+                if self.gapStartNs != 0:
+                    self.__endGap(sinks)
+                numOfBadFrames = 0
+                numOfSamples += 1
+                sinks.write(motor_br_data)
+            else:
+                #mydata still contains the previous sample: it is not written again
+                self.__beginGap(GAP_REASON_GARBAGE)
+                self.gapDropped += 1
+                numOfBadFrames += 1
+                try:
+                    if numOfBadFrames < MAX_CONSECUTIVE_BAD_FRAMES:
+                        self.ioTh.submitPoll(self.motor_br_dev.resync).result()
+                    else:
+                        print(colored('MotorBrakeDataCollector: ' + str(numOfBadFrames) + ' bad data strings, reconnecting...', 'white', 'on_red'))
+                        self.__reconnect(numOfSamples, acqStartTime)
+                        numOfBadFrames = 0
+                except (serial.SerialException, OSError) as e:
+                    print(colored('MotorBrakeDataCollector: serial port lost (' + str(e) + ')', 'white', 'on_red'))
+                    self.__reconnect(numOfSamples, acqStartTime)
+                    numOfBadFrames = 0
+            if self.acqMode == ACQ_MODE_POLL:
+                self.scheduler.waitNextDeadline() #go to sleep until the deadline of the next sample
                  
+    def printGapStats(self):
+        if self.numOfGaps == 0:
+            print("MotorBrakeDataCollector: no gaps")
+            return
+        print(colored("MotorBrakeDataCollector: gaps= " + str(self.numOfGaps) + "  dropped samples= " + str(self.numOfDropped) +
+                      "  resyncs= " + str(self.motor_br_dev.numOfResyncs) + "  reconnections= " + str(self.motor_br_dev.numOfReconnections), 'blue'))
+        self.outageStats.printStats()
+
+    def __beginGap(self, reason): #private method
+        if self.gapStartNs == 0:
+            self.gapStartNs = time.monotonic_ns()
+            self.gapDropped = 0
+            self.gapReason = reason
+        elif reason == GAP_REASON_PORT_LOST:
+            self.gapReason = reason #a gap that ends with the loss of the port is reported as such
+
+    def __endGap(self, sinks): #private method
+        durationNs = time.monotonic_ns() - self.gapStartNs
+        #not printed: the gap is in the log and in the statistics printed at stop
+        sinks.writeGap(MotorBrakeGap(self.gapStartNs, durationNs, self.gapDropped, self.gapReason))
+        self.numOfGaps += 1
+        self.numOfDropped += self.gapDropped
+        self.outageStats.add(durationNs)
+        self.gapsDurationNs += durationNs
+        self.gapStartNs = 0
+
+    # Reopens the port with exponential backoff until it succeeds or the acquisition is stopped.
+    # The samples not acquired in the meanwhile are estimated by the period (poll mode) or by
+    # the rate achieved before the gap, without the time of the previous gaps (streaming modes),
+    # and added to the gap.
+    def __reconnect(self, numOfSamples, acqStartTime): #private method
+        self.__beginGap(GAP_REASON_PORT_LOST)
+        startNs = time.monotonic_ns()
+        delay = RECONNECT_MIN_DELAY
+        while not self.stopEvt.wait(delay):
+            if self.ioTh.submitPoll(self.motor_br_dev.reconnect).result():
+                print(colored('MotorBrakeDataCollector: serial port reopened', 'green'))
+                break
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        outageNs = time.monotonic_ns() - startNs
+        if self.acqMode == ACQ_MODE_POLL:
+            self.gapDropped += int(outageNs // self.scheduler.periodNs) if self.scheduler.periodNs > 0 else 0
+            self.scheduler.resync()
+        else:
+            acquiringNs = self.gapStartNs - int(acqStartTime * 1e9) - self.gapsDurationNs
+            if numOfSamples > 0 and acquiringNs > 0:
+                self.gapDropped += int(outageNs * numOfSamples / acquiringNs)
+
     
     #TODO: add alive message      
     def setLogFileName(self, fileName):
@@ -0,0 +1,187 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# This module is the asyncio variant of the driver for the motor brake
+# Magtrol DSP6001 device (see motorBrakeDriver.py).
+# The serial port is read without blocking: its file descriptor is
+# registered in the event loop by loop.add_reader(), the received bytes
+# are split in frames and each frame is routed to the data queue, if it is
+# a data string, or to the answer queue if a command is waiting for its
+# answer. The other frames, e.g. data strings garbled by the link, go to the
+# data queue, where they are counted as malformed. In this way the data
+# polling and the commands don't need a lock and the timeouts are cheap; only
+# the commands are serialized among them by an asyncio.Lock, because an
+# answer cannot be matched to its command.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import time
+import asyncio
+import serial
+from termcolor import colored
+from src.motorBrakeDriver import MotorBrakeCfg
+from src.motorBrakeDriver import MotorBrakeOuputData
+from src.motorBrakeDriver import dsp6001_end
+from src.motorBrakeDriver import ACQ_MODE_POLL
+from src.motorBrakeDriver import ACQ_MODE_PIPELINE
+from src.motorBrakeFrameParser import DSP6001FrameParser
+from src.motorBrakeInstrumentation import stageTimers, STAGE_SERIAL_WRITE, STAGE_READLINE, STAGE_PARSE, STAGE_GET_DATA
+
+# -------------------------------------------------------------------------
+# Asyncio driver
+# -------------------------------------------------------------------------
+DATA_TIMEOUT_PERIODS = 4 #max wait of a data string, in acquisition periods
+DATA_FRAME_CHARS = 20    #characters of an OD request plus its data string
+
+# Returns the max wait (seconds) of a data string: a few acquisition periods, but
+# at least twice the time needed by the serial link to transfer request and answer
+def getDataTimeout(period, baudrate):
+    return max(DATA_TIMEOUT_PERIODS * period, 2 * DATA_FRAME_CHARS * 10 / baudrate)
+
+class AsyncMotorBrake:
+    "This is the asyncio variant of the class MotorBrake"
+
+    #timeout is the max wait of the answer to a command, dataTimeout the one of a data string
+    def __init__(self, comport, baudrate, timeout=1.0, dataTimeout=1.0):
+        self.cfg=MotorBrakeCfg(comport, baudrate)
+        self.mydata = MotorBrakeOuputData()
+        self.serialPort = serial.Serial()
+        self.serialPort.baudrate = self.cfg.baudrate
+        self.serialPort.port = self.cfg.comport
+        self.serialPort.bytesize = 8
+        self.serialPort.timeout = 0 #non blocking reads
+        self.serialPort.stopbits = serial.STOPBITS_ONE
+        self.timeout = timeout #seconds to wait for an answer
+        self.dataTimeout = dataTimeout
+        self.frameParser = DSP6001FrameParser()
+        self.rxBuffer = bytearray()
+        self.dataFrames = asyncio.Queue()
+        self.answers = asyncio.Queue()
+        self.cmdIsPending = False #True while a command waits for its answer
+        self.cmdLock = None #one command at a time: the answers are not tagged with their command
+        self.loop = None
+        self.streamingMode = ACQ_MODE_POLL
+        self.numOfTimeouts = 0
+        self.lastFrameOk = False #False if the last data string was garbled or missing: mydata has not been updated
+
+    # It must be called by a coroutine running in the event loop that will read the port
+    def openSerialPort(self):
+        try:
+            if not self.serialPort.is_open:
+                self.serialPort.open()
+        except serial.serialutil.SerialException:
+            return False
+        self.loop = asyncio.get_running_loop()
+        self.cmdLock = asyncio.Lock()
+        self.loop.add_reader(self.serialPort.fileno(), self.__onReadable)
+        return True
+
+    def closeSerialPort(self):
+        if self.serialPort.is_open:
+            self.loop.remove_reader(self.serialPort.fileno())
+            self.serialPort.close()
+
+    async def getData(self):
+        start_time = time.monotonic_ns()
+        self.__clearQueue(self.dataFrames) #late answers of previous requests
+        t = stageTimers.start()
+        self.serialPort.write(("OD"+dsp6001_end).encode())
+        t = stageTimers.lap(STAGE_SERIAL_WRITE, t)
+        return await self.__readData(start_time, t)
+
+    def startStreaming(self, mode):
+        self.__clearQueue(self.dataFrames)
+        if mode == ACQ_MODE_PIPELINE:
+            self.serialPort.write(("OD"+dsp6001_end).encode()) #first request in flight
+        self.streamingMode = mode
+
+    def stopStreaming(self):
+        self.streamingMode = ACQ_MODE_POLL
+        self.__clearQueue(self.dataFrames)
+
+    async def getStreamData(self):
+        start_time = time.monotonic_ns()
+        t = stageTimers.start()
+        if self.streamingMode == ACQ_MODE_PIPELINE:
+            #the next request is sent before reading the answer of the previous one
+            self.serialPort.write(("OD"+dsp6001_end).encode())
+            t = stageTimers.lap(STAGE_SERIAL_WRITE, t)
+        return await self.__readData(start_time, t)
+
+    async def sendCommand(self, command):
+        return await self.__sendData(command)
+
+    async def sendTorqueSetpoint(self, trq):
+        setpoint = "Q"+str(trq)
+        return await self.__sendData(setpoint)
+
+    async def sendSpeedSetpoint(self, trq):
+        setpoint = "N"+str(trq)
+        return await self.__sendData(setpoint)
+
+    def __onReadable(self): #private method
+        try:
+            chunk = self.serialPort.read(max(1, self.serialPort.in_waiting))
+        except serial.serialutil.SerialException as e:
+            print ("Error communicating...: " + str(e))
+            self.loop.remove_reader(self.serialPort.fileno())
+            return
+        self.rxBuffer += chunk
+        while True:
+            end = self.rxBuffer.find(b'\n')
+            if end < 0:
+                break
+            frame = bytes(self.rxBuffer[:end+1])
+            del self.rxBuffer[:end+1]
+            #a frame starting with S is a data string, also if garbled: it is never taken as an answer
+            if self.cmdIsPending and not frame.startswith(b'S') and not self.frameParser.isDataFrame(frame):
+                self.answers.put_nowait(frame)
+            else:
+                self.dataFrames.put_nowait((time.monotonic_ns(), frame))
+
+    async def __readData(self, start_time, t): #private method
+        try:
+            rxTime, frame = await asyncio.wait_for(self.dataFrames.get(), self.dataTimeout)
+        except asyncio.TimeoutError:
+            self.numOfTimeouts += 1
+            self.lastFrameOk = False #mydata still contains the previous sample
+            if self.streamingMode == ACQ_MODE_PIPELINE:
+                #the answer has been lost: a new request is put in flight
+                self.serialPort.write(("OD"+dsp6001_end).encode())
+            return self.mydata
+        t = stageTimers.lap(STAGE_READLINE, t)
+        self.lastFrameOk = self.frameParser.parseInto(frame, self.mydata)
+        if self.lastFrameOk:
+            #mydata is updated only by valid data strings, as in MotorBrake
+            self.mydata.timestampNs = rxTime
+            self.mydata.progNum +=1
+        stageTimers.lap(STAGE_PARSE, t)
+        stageTimers.record(STAGE_GET_DATA, time.monotonic_ns() - start_time)
+        return self.mydata # check return value or reference
+
+    async def __sendData(self, cmd): #private method
+        if not self.serialPort.is_open:
+            print ("Cannot open serial port.")
+            return False
+        async with self.cmdLock:
+            try:
+                self.__clearQueue(self.answers)
+                self.cmdIsPending = True
+                self.serialPort.write((cmd+dsp6001_end).encode())
+                answer = await asyncio.wait_for(self.answers.get(), self.timeout)
+            except asyncio.TimeoutError:
+                print ("Error communicating...: no answer from device")
+                return False
+            except serial.serialutil.SerialException as e:
+                print ("Error communicating...: " + str(e))
+                return False
+            finally:
+                self.cmdIsPending = False
+        print(colored('\nMagtrol says:', 'yellow'), answer.decode(errors='replace'))
+        return True
+
+    def __clearQueue(self, q): #private method
+        while not q.empty():
+            q.get_nowait()
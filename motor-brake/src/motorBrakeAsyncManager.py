@@ -0,0 +1,246 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the asyncio variant of the Motor Brake Manager is defined.
+#  - AsyncMotorBrakeManager: acquisition, command handling and data sinks
+#    are coroutines running on one event loop, with the AsyncMotorBrake driver.
+#  - MotorBrakeAsyncRunner: thin wrapper that runs the event loop in a
+#    background thread and offers the same interface of MotorBrakeManager,
+#    so it can be used by the prompt menu and by the daemon mode.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import time
+import asyncio
+from threading import Thread
+from termcolor import colored
+from src.motorBrakeAsyncDriver import AsyncMotorBrake
+from src.motorBrakeAsyncDriver import getDataTimeout
+from src.motorBrakeDriver import ACQ_MODE_POLL
+from src.motorBrakeDriver import MotorBrakeGap
+from src.motorBrakeDriver import GAP_REASON_GARBAGE
+from src.MotorBrakeDataCollector import MotorBrakeDataSinks
+from src.motorBrakeScheduler import DeadlineScheduler
+from src.motorBrakeRingBuffer import SampleRingBuffer
+from src.motorBrakeInstrumentation import stageTimers
+from src.motorBrakeInstrumentation import MotorBrakeStatsExporter
+from src.motorBrakeSetpointCoalescer import SETPOINT_DEFAULT_MAX_RATE
+
+# -------------------------------------------------------------------------
+# Asyncio manager
+# -------------------------------------------------------------------------
+class AsyncMotorBrakeManager:
+    #Same return values of MotorBrakeManager.init
+    #The yarp port names are prefixed by portPrefix (e.g. "/brake1"), so more managers can run on the same yarp network
+    async def init(self, serialport, baudrate, yarpServiceOn, period, file, logFormat="tsv", acqMode="poll", overrunPolicy="catchup", publishBatch=1, publishBatchMs=0, livePlot=False, charMap=None, logCfg=None, maxCmdRate=SETPOINT_DEFAULT_MAX_RATE, portPrefix=""):
+        self.loop = asyncio.get_running_loop()
+        self.yarpServiceOn = yarpServiceOn
+        self.period = period
+        self.filelog = file
+        self.logFormat = logFormat
+        self.acqMode = acqMode
+        self.overrunPolicy = overrunPolicy
+        self.publishBatch = publishBatch
+        self.publishBatchMs = publishBatchMs
+        self.ringBuffer = SampleRingBuffer() if livePlot else None
+        self.charMap = charMap
+        self.logCfg = logCfg
+        self.acqTask = None
+        self.acqIsStopping = False
+        #1. open the serial port and init the driver
+        self.motor_br_dev = AsyncMotorBrake(serialport, baudrate, dataTimeout=getDataTimeout(period, baudrate))
+        ret = self.motor_br_dev.openSerialPort()
+        if ret == False:
+            return 1
+        print ("Serial Port opened successfully")
+        #2. start yarp network init
+        if yarpServiceOn == True:
+            #yarp is loaded only when its service is enabled
+            import yarp
+            from src.motorBrakeYarpCmdReader import DataProcessor
+            yarp.Network.init()
+            if not yarp.Network.checkNetwork():
+                print("yarpserver is not running")
+                return 2
+            print ("yarp network init successfully")
+            self.yarpOutPort = yarp.BufferedPortBottle()
+            self.yarpOutPort.open(portPrefix + "/motorbrake/out")
+            #the yarp reader calls submitCommand from its own thread
+            self.dataProc = DataProcessor(self.motor_br_dev, self, maxCmdRate)
+            self.yarpInputPort = yarp.Port()
+            self.yarpInputPort.setReader(self.dataProc)
+            self.yarpInputPort.open(portPrefix + "/motorbrake/cmd:i")
+        else:
+            print ("yarp network is not available ")
+        return 0
+
+    # Thread safe: schedules the coroutine function func(*args) on the event loop
+    # and returns a concurrent.futures.Future with its result.
+    def submitCommand(self, func, *args):
+        return asyncio.run_coroutine_threadsafe(func(*args), self.loop)
+
+    async def startAcquisition(self, filename):
+        if self.acqTask is not None and not self.acqTask.done():
+            return
+        self.filelog = filename
+        self.acqIsStopping = False
+        self.acqTask = asyncio.create_task(self.__acquire())
+
+    async def stopAcquisition(self):
+        if self.acqTask is None or self.acqTask.done():
+            return
+        #up to python 3.11 wait_for() swallows the cancellation if its future is done at the same
+        #time (e.g. a data string is always ready in pipeline mode): the flag stops the loop anyway
+        self.acqIsStopping = True
+        self.acqTask.cancel()
+        try:
+            await self.acqTask
+        except asyncio.CancelledError:
+            pass
+
+    async def sendTorqueSetpoint(self, torque):
+        return await self.motor_br_dev.sendTorqueSetpoint(torque)
+
+    async def sendSpeedSetpoint(self, speed):
+        return await self.motor_br_dev.sendSpeedSetpoint(speed)
+
+    async def sendCustomCommand(self, command):
+        return await self.motor_br_dev.sendCommand(command)
+
+    async def deinit(self):
+        await self.stopAcquisition()
+        if self.yarpServiceOn:
+            #the last setpoints received are sent before closing the serial port
+            for future in self.dataProc.close():
+                await asyncio.wrap_future(future)
+        print("closing serial port")
+        self.motor_br_dev.closeSerialPort()
+        if self.yarpServiceOn:
+            self.yarpInputPort.close()
+            self.yarpOutPort.close()
+            print("closing yarp network")
+            import yarp
+            yarp.Network.fini()
+        print("All services are closed")
+
+    async def __acquire(self): #private method
+        print ("MotorBrakeDataCollector is starting ")
+        sinks = MotorBrakeDataSinks(self.filelog, self.logFormat, self.yarpOutPort if self.yarpServiceOn else None,
+                                    self.publishBatch, self.publishBatchMs, self.ringBuffer, self.charMap, self.logCfg)
+        sinks.open()
+        scheduler = DeadlineScheduler(self.period, self.overrunPolicy)
+        if self.acqMode != ACQ_MODE_POLL:
+            #in streaming modes the rate is given by the serial link, so the period is not used
+            self.motor_br_dev.startStreaming(self.acqMode)
+        acqStartTime = time.monotonic()
+        numOfSamples = 0
+        #the garbled or missing data strings are written in the log as gaps, as in MotorBrakeDataCollectorThread
+        numOfGaps = 0
+        numOfDropped = 0
+        gapStartNs = 0 #0 if there isn't a gap in progress
+        gapDropped = 0
+        scheduler.start()
+        try:
+            while not self.acqIsStopping:
+                if self.acqMode == ACQ_MODE_POLL:
+                    motor_br_data = await self.motor_br_dev.getData()
+                else:
+                    motor_br_data = await self.motor_br_dev.getStreamData()
+                if self.motor_br_dev.lastFrameOk:
+                    if gapStartNs != 0:
+                        sinks.writeGap(MotorBrakeGap(gapStartNs, time.monotonic_ns() - gapStartNs, gapDropped, GAP_REASON_GARBAGE))
+                        numOfGaps += 1
+                        numOfDropped += gapDropped
+                        gapStartNs = 0
+                    numOfSamples += 1
+                    sinks.write(motor_br_data)
+                else:
+                    #the previous sample is not written again
+                    if gapStartNs == 0:
+                        gapStartNs = time.monotonic_ns()
+                        gapDropped = 0
+                    gapDropped += 1
+                if self.acqMode == ACQ_MODE_POLL:
+                    await scheduler.waitNextDeadlineAsync()
+        finally:
+            if gapStartNs != 0:
+                sinks.writeGap(MotorBrakeGap(gapStartNs, time.monotonic_ns() - gapStartNs, gapDropped, GAP_REASON_GARBAGE))
+                numOfGaps += 1
+                numOfDropped += gapDropped
+            if self.acqMode != ACQ_MODE_POLL:
+                self.motor_br_dev.stopStreaming()
+            acqDuration = time.monotonic() - acqStartTime
+            if acqDuration > 0:
+                print("MotorBrakeDataCollector: acquired", numOfSamples, "samples,", numOfSamples/acqDuration, "samples/sec",
+                      "timeouts=", self.motor_br_dev.numOfTimeouts)
+            print("MotorBrakeDataCollector: gaps=", numOfGaps, " dropped samples=", numOfDropped)
+            if self.acqMode == ACQ_MODE_POLL:
+                scheduler.printStats()
+            await asyncio.to_thread(sinks.close) #waits for the log writer without blocking the loop
+            print ("MotorBrakeDataCollector is closing...")
+
+
+# -------------------------------------------------------------------------
+# Thread wrapper
+# -------------------------------------------------------------------------
+
+# It runs the event loop in a background thread. The methods have the same
+# interface of MotorBrakeManager: they block until the coroutine is done, but
+# the commands that return a concurrent.futures.Future.
+class MotorBrakeAsyncRunner:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.loopTh = Thread(target=self.loop.run_forever, name="MotorBrakeAsyncLoop", daemon=True)
+        self.loopTh.start()
+        self.manager = AsyncMotorBrakeManager()
+        self.motor_br_dev = None
+        self.ringBuffer = None
+        self.statsExporterTh = None
+
+    def init(self, serialport, baudrate, yarpServiceOn, period, file, logFormat="tsv", acqMode="poll", overrunPolicy="catchup", publishBatch=1, publishBatchMs=0, livePlot=False, charMap=None, logCfg=None, statsFile="", statsPeriod=1.0, maxCmdRate=SETPOINT_DEFAULT_MAX_RATE, portPrefix=""):
+        self.charMap = charMap
+        ret = self.__run(self.manager.init(serialport, baudrate, yarpServiceOn, period, file, logFormat, acqMode, overrunPolicy,
+                                           publishBatch, publishBatchMs, livePlot, charMap, logCfg, maxCmdRate, portPrefix)).result()
+        self.motor_br_dev = self.manager.motor_br_dev
+        self.ringBuffer = self.manager.ringBuffer
+        if ret == 0 and (statsFile or yarpServiceOn):
+            #the exporter is a thread: it doesn't load the event loop
+            self.statsExporterTh = MotorBrakeStatsExporter(stageTimers, statsPeriod, statsFile, portPrefix + "/motorbrake/stats:o" if yarpServiceOn else "")
+            self.statsExporterTh.start()
+        return ret
+
+    def startAcquisition(self, filename):
+        self.__run(self.manager.startAcquisition(filename)).result()
+
+    def stopAcquisition(self):
+        self.__run(self.manager.stopAcquisition()).result()
+
+    def sendTorqueSetpoint(self, torque):
+        return self.__run(self.manager.sendTorqueSetpoint(torque))
+
+    def sendSpeedSetpoint(self, speed):
+        return self.__run(self.manager.sendSpeedSetpoint(speed))
+
+    def sendCustomCommand(self, command):
+        return self.__run(self.manager.sendCustomCommand(command))
+
+    #The setpoint profiles are executed by the serial I/O owner thread of MotorBrakeManager
+    def runProfile(self, fileName):
+        print(colored('WARNING: the setpoint profiles are not available with --asyncio', 'white', 'on_cyan'))
+        return False
+
+    def stopProfile(self):
+        pass
+
+    def deinit(self):
+        if self.statsExporterTh is not None:
+            self.statsExporterTh.stop() #before closing the yarp network
+            self.statsExporterTh = None
+        self.__run(self.manager.deinit()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loopTh.join()
+
+    def __run(self, coro): #private method
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
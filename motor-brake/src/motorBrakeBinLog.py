@@ -0,0 +1,177 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# This module defines the compact binary format of the acquisition log.
+# The file starts with a fixed header followed by fixed-size records, so
+# that it can be read with np.memmap without any parsing.
+#
+# Header (32 bytes, little endian):
+#   magic         8 bytes   b"MBRKLOG1"
+#   version       uint32
+#   recordSize    uint32
+#   wallAnchorNs  int64     time.time_ns() at session start
+#   monoAnchorNs  int64     time.monotonic_ns() taken together with wallAnchorNs
+#
+# Record (32 bytes, little endian):
+#   seq           uint64    progressive number of the sample
+#   timestampNs   int64     time.monotonic_ns() of the sample
+#   speed         float32   deg/sec
+#   torque        float32   Nm
+#   rotation      uint8     ord('R'), ord('L') or ord('-')
+#   padding       7 bytes
+#
+# Gap record (see MotorBrakeGap), it has rotation ord('G'):
+#   seq           number of samples dropped
+#   timestampNs   time.monotonic_ns() of the first sample dropped
+#   speed         duration of the gap [sec]
+#   torque        index of the reason in gapReasons
+# The gap records must be skipped when the samples are processed (see isGapRecord).
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import heapq
+import itertools
+import struct
+import time
+import numpy as np
+from src.motorBrakeLogWriter import TsvRecordFormat
+from src.motorBrakeLogWriter import WallClockFormatter
+from src.motorBrakeDriver import ROTATION_GAP
+from src.motorBrakeDriver import gapReasons
+
+# -------------------------------------------------------------------------
+# Format definition
+# -------------------------------------------------------------------------
+BIN_LOG_MAGIC = b"MBRKLOG1"
+BIN_LOG_VERSION = 1
+binLogHeaderStruct = struct.Struct("<8sIIqq")
+binLogRecordStruct = struct.Struct("<QqffB7x")
+
+binLogRecordDtype = np.dtype({
+    "names":   ["seq", "timestampNs", "speed", "torque", "rotation"],
+    "formats": ["<u8", "<i8", "<f4", "<f4", "u1"],
+    "offsets": [0, 8, 16, 20, 24],
+    "itemsize": binLogRecordStruct.size,
+})
+BIN_LOG_ROTATION_GAP = ord(ROTATION_GAP)
+
+# Returns the boolean mask of the gap records of an array of binLogRecordDtype
+def isGapRecord(records):
+    return records["rotation"] == BIN_LOG_ROTATION_GAP
+
+# Returns the gap line of the tab separated log (see TsvRecordFormat.encodeGap) of a gap record
+def _gapRecordToTsv(clock, seq, ts, duration, reasonIdx):
+    return "#gap\t" + clock.format(ts) + '\t' + str(duration) + '\t' + str(seq) + '\t' + gapReasons[int(reasonIdx)] + '\n'
+
+
+# Record format for MotorBrakeLogWriter that writes the binary records
+class BinRecordFormat:
+    def __init__(self, wallAnchorNs=None, monoAnchorNs=None):
+        if wallAnchorNs is None:
+            wallAnchorNs = time.time_ns()
+            monoAnchorNs = time.monotonic_ns()
+        self.wallAnchorNs = wallAnchorNs
+        self.monoAnchorNs = monoAnchorNs
+        self.record = bytearray(binLogRecordStruct.size)
+
+    def header(self):
+        return binLogHeaderStruct.pack(BIN_LOG_MAGIC, BIN_LOG_VERSION, binLogRecordStruct.size,
+                                       self.wallAnchorNs, self.monoAnchorNs)
+
+    def encode(self, data):
+        binLogRecordStruct.pack_into(self.record, 0, data.progNum, data.timestampNs,
+                                     data.speed, data.torque, ord(data.rotation[0]))
+        return self.record
+
+    def encodeGap(self, gap):
+        binLogRecordStruct.pack_into(self.record, 0, gap.numOfDropped, gap.startNs,
+                                     gap.durationNs / 1e9, gapReasons.index(gap.reason), BIN_LOG_ROTATION_GAP)
+        return self.record
+
+
+# -------------------------------------------------------------------------
+# Reading
+# -------------------------------------------------------------------------
+
+# Reads and checks the header of a binary log.
+# Returns the tuple (wallAnchorNs, monoAnchorNs)
+def readBinLogHeader(fileName):
+    with open(fileName, 'rb') as f:
+        raw = f.read(binLogHeaderStruct.size)
+    if len(raw) < binLogHeaderStruct.size:
+        raise ValueError(fileName + " is too short to be a motor brake binary log")
+    magic, version, recordSize, wallAnchorNs, monoAnchorNs = binLogHeaderStruct.unpack(raw)
+    if magic != BIN_LOG_MAGIC:
+        raise ValueError(fileName + " is not a motor brake binary log")
+    if version != BIN_LOG_VERSION or recordSize != binLogRecordStruct.size:
+        raise ValueError(fileName + ": unsupported binary log version " + str(version))
+    return wallAnchorNs, monoAnchorNs
+
+# Maps the records of a binary log in memory (zero-copy).
+# A trailing partial record, e.g. of a log not closed correctly, is ignored.
+def openBinLog(fileName):
+    readBinLogHeader(fileName)
+    numOfRecords = (os.path.getsize(fileName) - binLogHeaderStruct.size) // binLogRecordDtype.itemsize
+    if numOfRecords == 0:
+        return np.empty(0, dtype=binLogRecordDtype)
+    return np.memmap(fileName, dtype=binLogRecordDtype, mode='r', offset=binLogHeaderStruct.size, shape=(numOfRecords,))
+
+# Converts a binary log in the tab separated format written by the data collector
+def binLogToTsv(binFileName, tsvFileName, chunkSize=65536):
+    wallAnchorNs, monoAnchorNs = readBinLogHeader(binFileName)
+    records = openBinLog(binFileName)
+    clock = WallClockFormatter(wallAnchorNs, monoAnchorNs)
+    with open(tsvFileName, 'w') as f:
+        f.write(TsvRecordFormat().header().decode())
+        for start in range(0, len(records), chunkSize):
+            chunk = records[start:start+chunkSize]
+            lines = []
+            #speed and torque are iterated as float32 scalars so that str() gives their shortest representation
+            for seq, ts, speed, torque, rot in zip(chunk["seq"].tolist(), chunk["timestampNs"].tolist(),
+                                                   chunk["speed"], chunk["torque"], chunk["rotation"].tolist()):
+                if rot == BIN_LOG_ROTATION_GAP:
+                    lines.append(_gapRecordToTsv(clock, seq, ts, speed, torque))
+                    continue
+                lines.append(str(seq) + '\t' + clock.format(ts) + '\t' + str(speed) + '\t' + str(torque) + '\t' + chr(rot) + '\t' + '\n')
+            f.write(''.join(lines))
+    return len(records)
+
+# Used by mergeBinLogs: yields the records of a binary log as tuples
+# (timestampNs, devIdx, seq, speed, torque, rotation), reading chunkSize records at a time.
+# The device index keeps the order stable when two samples have the same timestamp.
+def _mergeBinLogsIter(records, devIdx, chunkSize):
+    for start in range(0, len(records), chunkSize):
+        chunk = records[start:start+chunkSize]
+        yield from zip(chunk["timestampNs"].tolist(), itertools.repeat(devIdx), chunk["seq"].tolist(),
+                       chunk["speed"], chunk["torque"], chunk["rotation"].tolist())
+
+# Merges the binary logs of several devices, acquired on the same host, in one
+# tab separated file ordered by time. The first column is the device name.
+# The monotonic clock is shared by all the processes of the host, so the samples
+# are aligned on their monotonic timestamps and the time of all of them is given
+# with the wall-clock anchor of the first log. The memory used doesn't depend on
+# the length of the logs.
+# Returns the number of merged records
+def mergeBinLogs(binFileNames, deviceNames, tsvFileName, chunkSize=65536):
+    wallAnchorNs, monoAnchorNs = readBinLogHeader(binFileNames[0])
+    clock = WallClockFormatter(wallAnchorNs, monoAnchorNs)
+    iterators = [_mergeBinLogsIter(openBinLog(fileName), devIdx, chunkSize) for devIdx, fileName in enumerate(binFileNames)]
+    numOfRecords = 0
+    with open(tsvFileName, 'w') as f:
+        f.write("Device\t" + TsvRecordFormat().header().decode())
+        lines = []
+        for ts, devIdx, seq, speed, torque, rot in heapq.merge(*iterators):
+            if rot == BIN_LOG_ROTATION_GAP:
+                lines.append(deviceNames[devIdx] + '\t' + _gapRecordToTsv(clock, seq, ts, speed, torque))
+                continue
+            lines.append(deviceNames[devIdx] + '\t' + str(seq) + '\t' + clock.format(ts) + '\t' + str(speed) + '\t' + str(torque) + '\t' + chr(rot) + '\t' + '\n')
+            if len(lines) >= chunkSize:
+                f.write(''.join(lines))
+                numOfRecords += len(lines)
+                lines.clear()
+        f.write(''.join(lines))
+        numOfRecords += len(lines)
+    return numOfRecords
@@ -0,0 +1,117 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class TorqueSpeedMap is defined. It characterizes the motor
+# while the test is running: the speed x torque plane is split in bins and
+# for each bin it keeps the number of samples, the mean and the variance of
+# the mechanical power, in constant memory.
+# The samples are collected in a small preallocated batch and merged in the
+# bins with vectorized NumPy operations (Chan et al. parallel variance).
+# The map can be queried during the test and it is saved as a compressed
+# .npz file at stop, so no second pass over the logs is needed.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import math
+import numpy as np
+from threading import Lock
+
+# -------------------------------------------------------------------------
+# Torque-speed map
+# -------------------------------------------------------------------------
+
+# speed in deg/sec and torque in Nm, as given by the driver.
+# The mechanical power is torque * speed in rad/sec, so it is in W.
+# The samples out of the ranges are counted but not binned.
+class TorqueSpeedMap:
+    def __init__(self, speedRange=(-3600.0, 3600.0), numOfSpeedBins=72, torqueRange=(-10.0, 10.0), numOfTorqueBins=40, fileName="", batchSize=256):
+        self.speedEdges = np.linspace(speedRange[0], speedRange[1], numOfSpeedBins + 1)
+        self.torqueEdges = np.linspace(torqueRange[0], torqueRange[1], numOfTorqueBins + 1)
+        self.shape = (numOfSpeedBins, numOfTorqueBins)
+        self.fileName = fileName
+        numOfBins = numOfSpeedBins * numOfTorqueBins
+        self.counts = np.zeros(numOfBins, dtype=np.int64)
+        self.mean = np.zeros(numOfBins)
+        self.m2 = np.zeros(numOfBins)
+        self.numOfOutOfRange = 0
+        self.batch = np.zeros((batchSize, 2))
+        self.batchLen = 0
+        self.lock = Lock() #between the acquisition, that merges the batches, and the queries
+
+    def addSample(self, speed, torque):
+        self.batch[self.batchLen] = (speed, torque)
+        self.batchLen += 1
+        if self.batchLen == len(self.batch):
+            self.flush()
+
+    # Merges the pending samples in the bins
+    def flush(self):
+        if self.batchLen == 0:
+            return
+        speed = self.batch[:self.batchLen, 0]
+        torque = self.batch[:self.batchLen, 1]
+        self.batchLen = 0
+        iSpeed = np.searchsorted(self.speedEdges, speed, side='right') - 1
+        iTorque = np.searchsorted(self.torqueEdges, torque, side='right') - 1
+        valid = (iSpeed >= 0) & (iSpeed < self.shape[0]) & (iTorque >= 0) & (iTorque < self.shape[1])
+        idx = iSpeed[valid] * self.shape[1] + iTorque[valid]
+        power = torque[valid] * speed[valid] * math.pi / 180
+        numOfBins = len(self.counts)
+        countsB = np.bincount(idx, minlength=numOfBins)
+        sumB = np.bincount(idx, weights=power, minlength=numOfBins)
+        hit = countsB > 0
+        meanB = np.zeros(numOfBins)
+        meanB[hit] = sumB[hit] / countsB[hit]
+        m2B = np.bincount(idx, weights=(power - meanB[idx])**2, minlength=numOfBins)
+        with self.lock:
+            self.numOfOutOfRange += int(np.count_nonzero(~valid))
+            countsA = self.counts[hit]
+            n = countsA + countsB[hit]
+            delta = meanB[hit] - self.mean[hit]
+            self.mean[hit] += delta * countsB[hit] / n
+            self.m2[hit] += m2B[hit] + delta**2 * countsA * countsB[hit] / n
+            self.counts[hit] = n
+
+    # The map can be handed to another process (e.g. a shared memory ring consumer): the lock is not pickled
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    # Returns copies of counts, mean power [W] and power variance [W^2] of each bin,
+    # with shape (numOfSpeedBins, numOfTorqueBins). The variance is 0 for bins with less than 2 samples.
+    def getMap(self):
+        with self.lock:
+            counts = self.counts.reshape(self.shape).copy()
+            mean = self.mean.reshape(self.shape).copy()
+            m2 = self.m2.reshape(self.shape).copy()
+        var = np.zeros(self.shape)
+        np.divide(m2, counts, out=var, where=counts > 1)
+        return counts, mean, var
+
+    def save(self, fileName=None):
+        if fileName is None:
+            fileName = self.fileName
+        if not fileName:
+            return
+        self.flush()
+        counts, mean, var = self.getMap()
+        np.savez_compressed(fileName, counts=counts, meanPower=mean, varPower=var,
+                            speedEdges=self.speedEdges, torqueEdges=self.torqueEdges,
+                            numOfOutOfRange=self.numOfOutOfRange)
+        print("TorqueSpeedMap saved in", fileName)
+
+    def printSummary(self):
+        counts, mean, var = self.getMap()
+        hit = np.argwhere(counts > 0)
+        print("TorqueSpeedMap: samples=", int(counts.sum()), " populated bins=", len(hit), " out of range=", self.numOfOutOfRange)
+        for iSpeed, iTorque in hit:
+            print("  speed[deg/sec] %8.1f..%8.1f  torque[Nm] %7.3f..%7.3f  n=%7d  power[W] mean=%9.3f std=%8.3f" % (
+                self.speedEdges[iSpeed], self.speedEdges[iSpeed+1], self.torqueEdges[iTorque], self.torqueEdges[iTorque+1],
+                counts[iSpeed, iTorque], mean[iSpeed, iTorque], math.sqrt(var[iSpeed, iTorque])))
@@ -0,0 +1,157 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the automatic discovery of the Magtrol DSP6001 is defined.
+# All the candidate serial ports are probed concurrently (one thread for
+# each port) by sending "*IDN?" at the likely baud rates, under a short
+# deadline; the device is identified by its identification string.
+# The port, the baud rate, the identification string and the hardware id
+# of the port (USB vid:pid and serial number) of the device found are
+# cached in a file, so the next startup connects with one probe: if the
+# cached port doesn't answer anymore, the port with the same hardware id
+# is tried (e.g. the USB adapter has been renumbered) before the full scan.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import json
+import time
+import serial
+import serial.tools.list_ports as portlist
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from threading import Event
+from src.motorBrakeDriver import dsp6001_end
+
+# -------------------------------------------------------------------------
+# General
+# -------------------------------------------------------------------------
+DSP6001_IDN_TAG = "DSP6001"                  #the identification string of the device contains it
+discoveryBaudrates = [19200, 9600, 4800, 2400] #baud rates probed, in this order
+DISCOVERY_PROBE_TIMEOUT = 0.3                #max wait (seconds) of the answer to one probe
+DISCOVERY_DEADLINE = 3.0                     #max duration (seconds) of the full scan
+discoveryCacheFile = os.path.join(os.path.expanduser("~"), ".motorbrake_device.json")
+
+class DiscoveredDevice:
+    def __init__(self, port, baudrate, idn, hwid=""):
+        self.port = port
+        self.baudrate = baudrate
+        self.idn = idn
+        self.hwid = hwid #hardware id of the port, see serial.tools.list_ports
+
+    def printData(self):
+        print("device", self.idn, "on", self.port, "at", self.baudrate, "baud (" + self.hwid + ")")
+
+# -------------------------------------------------------------------------
+# Probe
+# -------------------------------------------------------------------------
+
+# Sends "*IDN?" on port at baudrate and returns the answer, or "" if the
+# port cannot be opened or it doesn't answer within timeout seconds
+def probePort(port, baudrate, timeout=DISCOVERY_PROBE_TIMEOUT):
+    try:
+        with serial.Serial(port, baudrate, bytesize=8, stopbits=serial.STOPBITS_ONE, timeout=timeout, write_timeout=timeout) as ser:
+            ser.reset_input_buffer()
+            ser.write(("*IDN?" + dsp6001_end).encode())
+            return ser.readline().decode(errors="replace").strip()
+    except (serial.serialutil.SerialException, OSError, ValueError):
+        return ""
+
+def isDsp6001(idn):
+    return DSP6001_IDN_TAG in idn.upper()
+
+# Probes the baud rates one at a time on the same port, until the device answers or stopEvt is set
+def _probeBaudrates(port, baudrates, timeout, stopEvt):
+    for baudrate in baudrates:
+        if stopEvt.is_set():
+            break
+        idn = probePort(port, baudrate, timeout)
+        if isDsp6001(idn):
+            return DiscoveredDevice(port, baudrate, idn)
+    return None
+
+# -------------------------------------------------------------------------
+# Scan
+# -------------------------------------------------------------------------
+
+# Returns the dictionary port name -> hardware id of the serial ports of the host
+def listPorts():
+    return {p.device: p.hwid for p in portlist.comports()}
+
+# Probes concurrently all the ports (default: all the serial ports of the host)
+# and returns the list of DiscoveredDevice found within deadline seconds
+def scanPorts(ports=None, baudrates=discoveryBaudrates, timeout=DISCOVERY_PROBE_TIMEOUT, deadline=DISCOVERY_DEADLINE):
+    hwids = listPorts()
+    if ports is None:
+        ports = list(hwids.keys())
+    if len(ports) == 0:
+        return []
+    stopEvt = Event()
+    executor = ThreadPoolExecutor(max_workers=len(ports), thread_name_prefix="MotorBrakeDiscovery")
+    futures = [executor.submit(_probeBaudrates, port, baudrates, timeout, stopEvt) for port in ports]
+    done, notDone = wait(futures, timeout=deadline)
+    stopEvt.set() #the late probes end after their current baud rate
+    executor.shutdown(wait=False)
+    devices = []
+    for future in futures:
+        if future in done and future.result() is not None:
+            dev = future.result()
+            dev.hwid = hwids.get(dev.port, "")
+            devices.append(dev)
+    return devices
+
+# -------------------------------------------------------------------------
+# Cache
+# -------------------------------------------------------------------------
+def loadCachedDevice(cacheFile=discoveryCacheFile):
+    try:
+        with open(cacheFile) as f:
+            cfg = json.load(f)
+        return DiscoveredDevice(cfg["port"], int(cfg["baudrate"]), cfg["idn"], cfg.get("hwid", ""))
+    except (OSError, ValueError, KeyError):
+        return None
+
+def saveCachedDevice(dev, cacheFile=discoveryCacheFile):
+    try:
+        with open(cacheFile, 'w') as f:
+            json.dump({"port": dev.port, "baudrate": dev.baudrate, "idn": dev.idn, "hwid": dev.hwid, "time": time.time()}, f, indent=4)
+    except OSError as e:
+        print("Cannot write the discovery cache " + cacheFile + ": " + str(e))
+
+# -------------------------------------------------------------------------
+# Discovery
+# -------------------------------------------------------------------------
+
+# Returns the DiscoveredDevice of the DSP6001, or None if it is not found.
+#  1. the cached device is probed on its port and baud rate
+#  2. if it doesn't answer, the port with its hardware id is probed
+#  3. otherwise all the ports are scanned concurrently
+# The device found is saved in the cache. If more devices are found by the
+# scan, the first one is returned.
+def discoverDevice(cacheFile=discoveryCacheFile, ports=None, baudrates=discoveryBaudrates, timeout=DISCOVERY_PROBE_TIMEOUT, deadline=DISCOVERY_DEADLINE):
+    cached = loadCachedDevice(cacheFile) if cacheFile else None
+    if cached is not None:
+        if probePort(cached.port, cached.baudrate, timeout) == cached.idn:
+            print("Discovery: cached device found")
+            return cached
+        if cached.hwid and cached.hwid != "n/a":
+            movedPorts = [port for port, hwid in listPorts().items() if hwid == cached.hwid and port != cached.port]
+            for port in movedPorts:
+                if probePort(port, cached.baudrate, timeout) == cached.idn:
+                    print("Discovery: cached device moved to", port)
+                    dev = DiscoveredDevice(port, cached.baudrate, cached.idn, cached.hwid)
+                    saveCachedDevice(dev, cacheFile)
+                    return dev
+    print("Discovery: scanning the serial ports...")
+    devices = scanPorts(ports, baudrates, timeout, deadline)
+    if len(devices) == 0:
+        return None
+    if len(devices) > 1:
+        print("Discovery: more devices found, the first one is used")
+        for dev in devices:
+            dev.printData()
+    if cacheFile:
+        saveCachedDevice(devices[0], cacheFile)
+    return devices[0]
@@ -9,14 +9,13 @@
 
 
 import serial
-import datetime
-import re
 import time
-import numpy as np
 
-from datetime import datetime
 from termcolor import colored
 from colorama import init
+from src.motorBrakeFrameParser import DSP6001FrameParser
+from src.motorBrakeSerialReader import SerialFrameReader
+from src.motorBrakeInstrumentation import stageTimers, STAGE_SERIAL_WRITE, STAGE_READLINE, STAGE_PARSE, STAGE_GET_DATA
 
 # -------------------------------------------------------------------------
 # General
@@ -40,6 +39,25 @@ dsp6001_cmd = [
     ]
 dsp6001_end = "\r\n"
 
+# -------------------------------------------------------------------------
+# Acquisition modes
+# -------------------------------------------------------------------------
+# poll:       strict request/response, one "OD" for each getData call
+# pipeline:   one "OD" request is always in flight, so the device prepares the
+#             next answer while the previous one is transferred and parsed
+# continuous: the device has been configured to send data continuously,
+#             the driver only reads the data strings
+ACQ_MODE_POLL = "poll"
+ACQ_MODE_PIPELINE = "pipeline"
+ACQ_MODE_CONTINUOUS = "continuous"
+acqModes = [ACQ_MODE_POLL, ACQ_MODE_PIPELINE, ACQ_MODE_CONTINUOUS]
+
+# -------------------------------------------------------------------------
+# Read deadlines (milliseconds)
+# -------------------------------------------------------------------------
+DATA_DEADLINE_MS = 100  #max wait of a data string (about 12 ms at 19200 baud)
+CMD_DEADLINE_MS = 500   #max wait of the answer to a command
+
 
 
 class MotorBrakeCfg:
@@ -52,10 +70,28 @@ class MotorBrakeOuputData:
         self.torque=0.0 #Nm
         self.speed=0.0  #deg/sec
         self.rotation="-"
-        self.time = "::"
+        self.timestampNs = 0 #time.monotonic_ns() of the sample
         self.progNum=0
     def printData(self):
-        print(self.time, " torque[Nm]=", self.torque, " speed[deg/sec]= ", self.speed, "rotation=", self.rotation)
+        print(self.timestampNs, " torque[Nm]=", self.torque, " speed[deg/sec]= ", self.speed, "rotation=", self.rotation)
+
+# -------------------------------------------------------------------------
+# Acquisition gaps
+# -------------------------------------------------------------------------
+# A gap is a period without valid samples: the frames were garbled or the
+# port was lost. It is written in the logs in place of the samples dropped
+# (see TsvRecordFormat.encodeGap and BinRecordFormat.encodeGap).
+GAP_REASON_GARBAGE = "garbage"
+GAP_REASON_PORT_LOST = "port_lost"
+gapReasons = [GAP_REASON_GARBAGE, GAP_REASON_PORT_LOST]
+ROTATION_GAP = 'G' #rotation of the gap records of the binary log
+
+class MotorBrakeGap:
+    def __init__(self, startNs, durationNs, numOfDropped, reason):
+        self.startNs = startNs #time.monotonic_ns() of the first sample dropped
+        self.durationNs = durationNs
+        self.numOfDropped = numOfDropped
+        self.reason = reason #one of gapReasons
 
 
 
@@ -72,16 +108,21 @@ class MotorBrake:
         self.serialPort.bytesize = 8
         self.serialPort.timeout = 1
         self.serialPort.stopbits = serial.STOPBITS_ONE
-        self.time_array = np.array([])
-        self.acqTimingIsEna = False
-        self.acqTimingPeriod = 1
-        self.acqTimingStart = 0
+        self.streamingMode = ACQ_MODE_POLL
+        self.frameParser = DSP6001FrameParser()
+        self.reader = None #SerialFrameReader, created when the port is opened
+        self.dataDeadlineMs = DATA_DEADLINE_MS
+        self.cmdDeadlineMs = CMD_DEADLINE_MS
+        self.lastFrameOk = False #False if the last data string was garbled or missing: mydata has not been updated
+        self.numOfResyncs = 0
+        self.numOfReconnections = 0
 
     def openSerialPort(self):
         # Set up serial port for read
         try: 
             if not self.serialPort.is_open:
                 self.serialPort.open()
+                self.reader = SerialFrameReader(self.serialPort)
             return True
         except serial.serialutil.SerialException:
             return False
@@ -94,74 +135,129 @@ class MotorBrake:
     def getData(self):
         cmd_menu="OD"
         TX_messages = [cmd_menu+dsp6001_end]
-        start_time = time.time()
+        start_time = time.monotonic_ns()
+        if self.reader.hasPendingData():
+            self.reader.reset() #late answer of a previous request
+        t = stageTimers.start()
         for msg in TX_messages:
             self.serialPort.write( msg.encode() )
-        data = self.serialPort.readline().decode()
-        self.mydata.time = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        self.mydata.progNum +=1
-        if re.search("^S.+T.+R.+",data):
-            data_split_str = re.split("[S,T,R,L]", ''.join(data))
-            self.mydata.speed = (float(data_split_str[1])*60/360) #60/360 to transform from deg/sec to rpm
-            self.mydata.torque = (float(data_split_str[2])/1000) #/1000 to transform from mNm to Nm
-            self.mydata.rotation = data[12]
-            
-        curr_time = time.time() 
-        
-        if self.acqTimingIsEna == True:
-            self.time_array = np.append (self.time_array, curr_time-start_time)
-            
-            if(curr_time - self.acqTimingStart > self.acqTimingPeriod):
-                print("\n")
-                print(colored('----- STATISTIC -------', 'blue'))
-                mystr = "mean = " + str(np.mean(self.time_array))
-                print(colored(mystr, 'blue') )
-                mystr = "std = " + str(np.std(self.time_array))
-                print(colored(mystr, 'blue') )
-                mystr = "var = " + str(np.var(self.time_array))
-                print(colored(mystr, 'blue') )
-                mystr = "min = " + str(np.min(self.time_array))
-                print(colored(mystr, 'blue') )
-                mystr = "max = " + str(np.max(self.time_array))
-                print(colored(mystr, 'blue') )
-                print(colored('-----------------------', 'blue'))
-                
-                self.time_array.resize(0)
-                self.acqTimingStart = curr_time
+        t = stageTimers.lap(STAGE_SERIAL_WRITE, t)
+        frame = self.reader.readFrame(self.dataDeadlineMs)
+        t = stageTimers.lap(STAGE_READLINE, t)
+        self.__updateData(frame, start_time)
+        stageTimers.lap(STAGE_PARSE, t)
+        return self.mydata # check return value or reference
+
+    # Starts the streaming acquisition (see ACQ_MODE_PIPELINE and ACQ_MODE_CONTINUOUS).
+    # After this call the data must be read by getStreamData() until stopStreaming() is called.
+    def startStreaming(self, mode):
+        self.reader.reset()
+        if mode == ACQ_MODE_PIPELINE:
+            self.serialPort.write(("OD"+dsp6001_end).encode()) #first request in flight
+        self.streamingMode = mode
 
+    def stopStreaming(self):
+        if self.streamingMode == ACQ_MODE_PIPELINE:
+            self.reader.readFrame(self.dataDeadlineMs) #answer of the request in flight
+        self.reader.reset()
+        self.streamingMode = ACQ_MODE_POLL
+
+    def getStreamData(self):
+        start_time = time.monotonic_ns()
+        t = stageTimers.start()
+        if self.streamingMode == ACQ_MODE_PIPELINE:
+            #the next request is sent before reading the answer of the previous one
+            self.serialPort.write(("OD"+dsp6001_end).encode())
+            t = stageTimers.lap(STAGE_SERIAL_WRITE, t)
+        frame = self.reader.readFrame(self.dataDeadlineMs)
+        t = stageTimers.lap(STAGE_READLINE, t)
+        self.__updateData(frame, start_time)
+        stageTimers.lap(STAGE_PARSE, t)
         return self.mydata # check return value or reference
+
+    # Discards the received bytes after a garbled or missing data string, so the
+    # next request is not answered by stale bytes. In pipeline mode a new request
+    # is put in flight; in continuous mode the frame splitter realigns on the next
+    # terminator by itself, so nothing is discarded.
+    def resync(self):
+        if self.streamingMode == ACQ_MODE_CONTINUOUS:
+            return
+        self.reader.reset()
+        if self.streamingMode == ACQ_MODE_PIPELINE:
+            self.serialPort.write(("OD"+dsp6001_end).encode())
+        self.numOfResyncs += 1
+
+    # Closes and reopens the serial port (e.g. after a glitch of the USB adapter),
+    # restarting the streaming mode if it was active. Returns True if the port is open.
+    def reconnect(self):
+        mode = self.streamingMode
+        try:
+            self.closeSerialPort()
+        except (serial.serialutil.SerialException, OSError):
+            pass #the port is gone: it is reopened anyway
+        if not self.openSerialPort():
+            return False
+        self.numOfReconnections += 1
+        self.streamingMode = ACQ_MODE_POLL
+        if mode != ACQ_MODE_POLL:
+            try:
+                self.startStreaming(mode)
+            except (serial.serialutil.SerialException, OSError):
+                return False
+        return True
+
+    #frame is the position of the data string in the reader buffer, None if it has not been received in time
+    def __updateData(self, frame, start_time): #private method
+        rxTime = time.monotonic_ns()
+        if frame is None:
+            self.lastFrameOk = self.frameParser.parseInto(b"", self.mydata) #counted as malformed
+        else:
+            self.lastFrameOk = self.frameParser.parseInto(self.reader.buf, self.mydata, frame[0], frame[1])
+        if self.lastFrameOk:
+            #mydata is updated only by valid data strings, see MotorBrakeDataCollectorThread for the gaps
+            self.mydata.timestampNs = rxTime
+            self.mydata.progNum +=1
+        #the duration of the whole call is exported with the other stages, it is not printed here
+        stageTimers.record(STAGE_GET_DATA, time.monotonic_ns() - start_time)
+
     
     def closeSerialPort(self):
         if self.serialPort.is_open:
             self.serialPort.close()
     def sendCommand(self, command):
-        self.__sendData(command)
+        return self.__sendData(command)
 
     def sendTorqueSetpoint(self, trq):
         setpoint = "Q"+str(trq)
-        self.__sendData(setpoint)
+        return self.__sendData(setpoint)
 
 
     def sendSpeedSetpoint(self, trq):
         setpoint = "N"+str(trq)
-        self.__sendData(setpoint)
+        return self.__sendData(setpoint)
     
-    def disableAcquisitionTiming(self):
-        self.acqTimingIsEna = False
-
-    def enableAcquisitionTiming(self, period):
-        self.acqTimingIsEna = True
-        self.acqTimingPeriod = period
-        self.time_array.resize(0)
-        self.acqTimingStart = time.time()
-
     def __sendData(self, cmd): #private method
         if self.serialPort.is_open:
             try:
                 TX_messages = [cmd+dsp6001_end]
                 for msg in TX_messages:
+                    if self.streamingMode == ACQ_MODE_PIPELINE:
+                        #discard the answer of the request in flight before sending the command
+                        self.reader.readFrame(self.dataDeadlineMs)
                     self.serialPort.write(msg.encode())
-                    print(colored('\nMagtrol says:', 'yellow'), self.serialPort.readline().decode())
+                    frame = self.reader.readFrame(self.cmdDeadlineMs)
+                    if self.streamingMode == ACQ_MODE_CONTINUOUS:
+                        #skip the data strings sent by the device in the meanwhile
+                        numOfSkipped = 0
+                        while frame is not None and self.frameParser.isDataFrame(self.reader.buf, frame[0], frame[1]) and numOfSkipped < 10:
+                            numOfSkipped += 1
+                            frame = self.reader.readFrame(self.cmdDeadlineMs)
+                    if self.streamingMode == ACQ_MODE_PIPELINE:
+                        self.serialPort.write(("OD"+dsp6001_end).encode()) #new request in flight
+                    if frame is None:
+                        print(colored('\nMagtrol does not answer', 'yellow'))
+                        return False
+                    print(colored('\nMagtrol says:', 'yellow'), self.reader.getFrameBytes(frame).decode(errors="replace"))
                     return True
             except Exception as e:
                 print ("Error communicating...: " + str(e))
@@ -0,0 +1,80 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class DSP6001FrameParser is defined. It parses the answer of the
+# Magtrol DSP6001 to the "OD" command directly on the raw bytes read from
+# the serial port, without decoding them and without regular expressions.
+#
+# Frame layout: 'S' speed 'T' torque ('R'|'L') '\r\n'
+# for example   b'S    0T0.488R\r\n'
+#
+# The frame can be also a slice [start, end) of a bigger buffer (see
+# SerialFrameReader), so the frames are parsed where they have been received.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+# -------------------------------------------------------------------------
+# Frame layout constants
+# -------------------------------------------------------------------------
+CHAR_S = ord('S')
+CHAR_T = ord('T')
+CHAR_R = ord('R')
+CHAR_L = ord('L')
+CHAR_CR = ord('\r')
+CHAR_LF = ord('\n')
+
+# -------------------------------------------------------------------------
+# Frame parser
+# -------------------------------------------------------------------------
+class DSP6001FrameParser:
+    def __init__(self):
+        self.numOfFrames = 0
+        self.numOfMalformed = 0
+
+    # Returns the position of the rotation char if frame[start:end] has the layout S....T....R/L,
+    # otherwise -1. The terminator \r\n is optional.
+    def findRotation(self, frame, start=0, end=None):
+        if end is None:
+            end = len(frame)
+        while end > start and (frame[end-1] == CHAR_LF or frame[end-1] == CHAR_CR):
+            end -= 1
+        if end - start < 5 or frame[start] != CHAR_S:
+            return -1
+        rot = end - 1
+        if frame[rot] != CHAR_R and frame[rot] != CHAR_L:
+            return -1
+        return rot
+
+    def isDataFrame(self, frame, start=0, end=None):
+        return self.findRotation(frame, start, end) >= 0
+
+    # Parses frame[start:end] and, if it is valid, updates speed, torque and rotation of data
+    # (a MotorBrakeOuputData) applying the unit conversion.
+    # Returns True if the frame is valid, otherwise data is not modified and the
+    # malformed frame is counted.
+    def parseInto(self, frame, data, start=0, end=None):
+        self.numOfFrames += 1
+        rot = self.findRotation(frame, start, end)
+        if rot < 0:
+            self.numOfMalformed += 1
+            return False
+        t = frame.find(b'T', start+1, rot)
+        if t < 0:
+            self.numOfMalformed += 1
+            return False
+        try:
+            #float() accepts bytes and ignores the leading spaces of the speed field
+            speed = float(frame[start+1:t])
+            torque = float(frame[t+1:rot])
+        except ValueError:
+            self.numOfMalformed += 1
+            return False
+        data.speed = speed*60/360 #60/360 to transform from deg/sec to rpm
+        data.torque = torque/1000 #/1000 to transform from mNm to Nm
+        data.rotation = 'R' if frame[rot] == CHAR_R else 'L'
+        return True
+
+    def printStats(self):
+        print("DSP6001FrameParser: frames=", self.numOfFrames, " malformed=", self.numOfMalformed)
@@ -0,0 +1,162 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the instrumentation of the acquisition hot path is defined.
+#  - StageTimers: one StreamingStatistics (counter, mean, histogram) for
+#    each stage of the acquisition. The timers can be enabled and disabled
+#    at runtime; when they are disabled a stage costs only a flag check.
+#    The module instance stageTimers is shared by driver, serial I/O owner,
+#    scheduler and data sinks.
+#  - MotorBrakeStatsExporter: thread that periodically exports the timers
+#    on a yarp port and/or in a text file with the Prometheus format,
+#    instead of printing them on the console.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import time
+from threading import Thread
+from threading import Event
+from src.motorBrakeStatistics import StreamingStatistics
+
+# -------------------------------------------------------------------------
+# Stages
+# -------------------------------------------------------------------------
+STAGE_SERIAL_WRITE = "serial_write"       #write of the request on the serial port
+STAGE_READLINE = "readline"               #wait and read of the answer of the device
+STAGE_PARSE = "parse"                     #parsing of the data frame
+STAGE_IO_WAIT = "io_wait"                 #wait of a data request in the queue of the serial I/O owner (it replaced the device lock)
+STAGE_LOG_WRITE = "log_write"             #copy of the record in the log writer buffer
+STAGE_YARP_PUBLISH = "yarp_publish"       #publishing of the sample on the yarp port
+STAGE_SLEEP_OVERSHOOT = "sleep_overshoot" #delay of the wake up of the acquisition loop after its deadline
+STAGE_GET_DATA = "get_data"               #whole data request: write, wait and parse
+stages = [STAGE_SERIAL_WRITE, STAGE_READLINE, STAGE_PARSE, STAGE_IO_WAIT, STAGE_LOG_WRITE, STAGE_YARP_PUBLISH, STAGE_SLEEP_OVERSHOOT, STAGE_GET_DATA]
+
+# -------------------------------------------------------------------------
+# Stage timers
+# -------------------------------------------------------------------------
+
+# Usage in the hot path:
+#   t = stageTimers.start()
+#   ...stage A...
+#   t = stageTimers.lap(STAGE_A, t)
+#   ...stage B...
+#   stageTimers.lap(STAGE_B, t)
+# If the timers are disabled start() returns 0 and lap() does nothing.
+class StageTimers:
+    def __init__(self):
+        self.isEna = False
+        self.stats = {stage: StreamingStatistics(stage) for stage in stages}
+
+    def enable(self):
+        self.reset()
+        self.isEna = True
+
+    def disable(self):
+        self.isEna = False
+
+    def reset(self):
+        for st in self.stats.values():
+            st.reset()
+
+    def start(self):
+        return time.monotonic_ns() if self.isEna else 0
+
+    # Adds the time elapsed since startNs to the stage and returns the current time
+    def lap(self, stage, startNs):
+        if startNs == 0:
+            return 0 #disabled when the measure started
+        now = time.monotonic_ns()
+        self.stats[stage].add(now - startNs)
+        return now
+
+    # Adds a duration measured by the caller
+    def record(self, stage, valueNs):
+        if self.isEna:
+            self.stats[stage].add(valueNs)
+
+    # Returns the dictionary stage -> snapshot (see StreamingStatistics.getSnapshot) plus the sum in seconds
+    def getSnapshot(self):
+        snapshot = {}
+        for stage, st in self.stats.items():
+            snapshot[stage] = st.getSnapshot()
+            snapshot[stage]["sum"] = st.mean * st.count / 1e9
+        return snapshot
+
+stageTimers = StageTimers()
+
+
+# -------------------------------------------------------------------------
+# Exporter
+# -------------------------------------------------------------------------
+
+# Writes the snapshot of the timers in the Prometheus text format.
+# The file is replaced atomically, so a scraper never reads a partial file.
+def writePrometheusFile(fileName, snapshot, labels=""):
+    lines = ["# HELP motorbrake_stage_latency_seconds Duration of the stages of the motor brake acquisition",
+             "# TYPE motorbrake_stage_latency_seconds summary"]
+    for stage, snap in snapshot.items():
+        lbl = 'stage="' + stage + '"' + ("," + labels if labels else "")
+        for quantile, key in (("0.5", "p50"), ("0.99", "p99"), ("0.999", "p999")):
+            lines.append('motorbrake_stage_latency_seconds{' + lbl + ',quantile="' + quantile + '"} ' + repr(snap[key]))
+        lines.append('motorbrake_stage_latency_seconds_sum{' + lbl + '} ' + repr(snap["sum"]))
+        lines.append('motorbrake_stage_latency_seconds_count{' + lbl + '} ' + str(snap["count"]))
+    lines.append("# HELP motorbrake_stage_latency_max_seconds Max duration of the stages of the motor brake acquisition")
+    lines.append("# TYPE motorbrake_stage_latency_max_seconds gauge")
+    for stage, snap in snapshot.items():
+        lbl = 'stage="' + stage + '"' + ("," + labels if labels else "")
+        lines.append('motorbrake_stage_latency_max_seconds{' + lbl + '} ' + repr(snap["max"]))
+    tmpName = fileName + ".tmp"
+    with open(tmpName, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmpName, fileName)
+
+
+# Exports the stage timers every period seconds while they are enabled:
+#  - in the Prometheus text file fileName, if not empty
+#  - on the yarp port yarpPortName, if not empty. Each bottle contains, for
+#    each stage: name (string), count (int64), mean, p50, p99, max (float64, seconds)
+class MotorBrakeStatsExporter(Thread):
+    def __init__(self, timers, period=1.0, fileName="", yarpPortName=""):
+        Thread.__init__(self, name="MotorBrakeStatsExporter", daemon=True)
+        self.timers = timers
+        self.period = period
+        self.fileName = fileName
+        self.yarpPortName = yarpPortName
+        self.stopEvt = Event()
+        self.yarpOutPort = None
+        self.numOfExports = 0
+
+    def run(self):
+        if self.yarpPortName:
+            import yarp #the port is used only with the yarp service enabled
+            self.yarpOutPort = yarp.BufferedPortBottle()
+            self.yarpOutPort.open(self.yarpPortName)
+        while not self.stopEvt.wait(self.period):
+            if self.timers.isEna:
+                self.export()
+        if self.yarpOutPort is not None:
+            self.yarpOutPort.close()
+
+    def export(self):
+        snapshot = self.timers.getSnapshot()
+        if self.fileName:
+            writePrometheusFile(self.fileName, snapshot)
+        if self.yarpOutPort is not None:
+            bottle = self.yarpOutPort.prepare()
+            bottle.clear()
+            for stage, snap in snapshot.items():
+                bottle.addString(stage)
+                bottle.addInt64(snap["count"])
+                bottle.addFloat64(snap["mean"])
+                bottle.addFloat64(snap["p50"])
+                bottle.addFloat64(snap["p99"])
+                bottle.addFloat64(snap["max"])
+            self.yarpOutPort.write()
+        self.numOfExports += 1
+
+    def stop(self):
+        self.stopEvt.set()
+        self.join()
@@ -0,0 +1,89 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class MotorBrakeIoThread is defined. It is the only owner of the
+# motor-brake device driver: all the other threads (data collector, yarp
+# command reader and prompt menu) submit their requests to it and receive a
+# Future with the result, so the serial traffic is serialized without a
+# shared lock.
+# The requests are executed in priority order: the commands (setpoints,
+# custom commands) have priority over the data polling, so a setpoint
+# waits at most for the completion of the request in progress.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import time
+import queue
+import itertools
+from threading import Thread
+from concurrent.futures import Future
+from src.motorBrakeStatistics import StreamingStatistics
+from src.motorBrakeInstrumentation import stageTimers, STAGE_IO_WAIT
+
+# -------------------------------------------------------------------------
+# Request priorities (lower value is executed first)
+# -------------------------------------------------------------------------
+IO_PRIORITY_COMMAND = 0
+IO_PRIORITY_POLL = 1
+IO_PRIORITY_STOP = 2
+
+# -------------------------------------------------------------------------
+# Serial I/O owner
+# -------------------------------------------------------------------------
+class MotorBrakeIoThread (Thread):
+    def __init__(self, motor_br_dev):
+        Thread.__init__(self, name="MotorBrakeIoThread")
+        self.motor_br_dev = motor_br_dev
+        self.requests = queue.PriorityQueue()
+        self.seq = itertools.count() #keeps the FIFO order among requests with the same priority
+        self.numOfCmdsSinceLastPoll = 0
+        #statistics
+        self.cmdToWireStats = StreamingStatistics("command-to-wire latency")
+        self.acqGapStats = StreamingStatistics("acquisition gap caused by commands")
+
+    # Submits the call func(*args) and returns a Future with its result.
+    def submit(self, priority, func, *args):
+        future = Future()
+        self.requests.put((priority, next(self.seq), time.monotonic_ns(), func, args, future))
+        return future
+
+    def submitCommand(self, func, *args):
+        return self.submit(IO_PRIORITY_COMMAND, func, *args)
+
+    def submitPoll(self, func, *args):
+        return self.submit(IO_PRIORITY_POLL, func, *args)
+
+    # The pending requests are executed before stopping
+    def stop(self):
+        self.requests.put((IO_PRIORITY_STOP, next(self.seq), time.monotonic_ns(), None, (), None))
+        self.join()
+
+    def run(self):
+        print ("MotorBrakeIoThread is starting ")
+        while True:
+            priority, seq, submitNs, func, args, future = self.requests.get()
+            if func is None:
+                print ("MotorBrakeIoThread is closing...")
+                break
+            startNs = time.monotonic_ns()
+            if priority == IO_PRIORITY_COMMAND:
+                self.cmdToWireStats.add(startNs - submitNs)
+                self.numOfCmdsSinceLastPoll += 1
+            else:
+                stageTimers.record(STAGE_IO_WAIT, startNs - submitNs)
+            if priority == IO_PRIORITY_POLL and self.numOfCmdsSinceLastPoll > 0:
+                #this poll has been delayed by the commands executed before it
+                self.acqGapStats.add(startNs - submitNs)
+                self.numOfCmdsSinceLastPoll = 0
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def printStats(self):
+        self.cmdToWireStats.printStats()
+        self.acqGapStats.printStats()
@@ -0,0 +1,76 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class MotorBrakeLivePlot is defined. It plots speed and torque
+# while the acquisition is running, reading the SampleRingBuffer written by
+# the data collector: the plot never takes a lock shared with the
+# acquisition, so it cannot block it.
+# The lines are updated with blitting at a fixed frame rate and the history
+# is reduced with the min/max envelope decimation, so hours of data are
+# drawn with a fixed number of points.
+# The plot must run in the main thread (matplotlib GUI).
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
+from src.motorBrakeRingBuffer import minMaxDecimate
+
+# -------------------------------------------------------------------------
+# Live plot
+# -------------------------------------------------------------------------
+class MotorBrakeLivePlot:
+    def __init__(self, ringBuffer, fps=10, numOfBins=1000):
+        self.ringBuffer = ringBuffer
+        self.fps = fps
+        self.numOfBins = numOfBins
+
+    # Shows the plot and returns when the window is closed
+    def show(self):
+        self.fig, (self.axSpeed, self.axTorque) = plt.subplots(2, 1, sharex=True)
+        self.fig.suptitle('MAGTROL data')
+        self.speedLine, = self.axSpeed.plot([], [], label="speed")
+        self.torqueLine, = self.axTorque.plot([], [], label="torque", color="tab:orange")
+        self.axSpeed.set_ylabel('speed [deg/sec]')
+        self.axTorque.set_ylabel('torque [Nm]')
+        self.axTorque.set_xlabel('time [s]')
+        for ax in (self.axSpeed, self.axTorque):
+            ax.grid(True)
+            ax.set_xlim(0, 10)
+            ax.set_ylim(-1, 1)
+        #the reference is kept to avoid the animation being garbage collected
+        self.anim = FuncAnimation(self.fig, self.__update, interval=1000/self.fps, blit=True, cache_frame_data=False)
+        plt.show()
+
+    def __update(self, frame): #private method
+        data = self.ringBuffer.read()
+        if len(data) == 0:
+            return self.speedLine, self.torqueLine
+        t = data[:, 0] - data[0, 0]
+        ts, speed = minMaxDecimate(t, data[:, 1], self.numOfBins)
+        tt, torque = minMaxDecimate(t, data[:, 2], self.numOfBins)
+        self.speedLine.set_data(ts, speed)
+        self.torqueLine.set_data(tt, torque)
+        #blitting redraws only the lines: the axes are redrawn only when the limits change
+        redraw = self.__extendLimits(self.axSpeed, t[-1], speed)
+        redraw = self.__extendLimits(self.axTorque, t[-1], torque) or redraw
+        if redraw:
+            self.fig.canvas.draw_idle()
+        return self.speedLine, self.torqueLine
+
+    def __extendLimits(self, ax, tLast, y): #private method
+        changed = False
+        xmin, xmax = ax.get_xlim()
+        if tLast > xmax:
+            ax.set_xlim(0, tLast * 1.5)
+            changed = True
+        ymin, ymax = ax.get_ylim()
+        yLow = y.min()
+        yHigh = y.max()
+        if yLow < ymin or yHigh > ymax:
+            margin = 0.1 * (yHigh - yLow) + 1e-3
+            ax.set_ylim(min(ymin, yLow - margin), max(ymax, yHigh + margin))
+            changed = True
+        return changed
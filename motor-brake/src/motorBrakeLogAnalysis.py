@@ -0,0 +1,356 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# This module contains the post-processing of the acquisition logs used by
+# logAnalyzer.py. The logs are read in chunks (the binary logs are mapped in
+# memory, the tab separated ones are streamed, also if compressed or split
+# in chunks with a session index) and each step is a vectorized NumPy
+# operation that keeps only a small state between two chunks, so the memory
+# used doesn't depend on the length of the log:
+#  - UniformResampler: linear interpolation on a uniform time grid
+#  - MovingAverageFilter: trailing moving average
+#  - SteadyStateDetector: segments where speed and torque are steady
+#  - SignalSummary: count, mean, std, min and max of a signal
+#  - IntervalHistogram: percentiles of the sample intervals
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import gzip
+import math
+import numpy as np
+from src.motorBrakeBinLog import BIN_LOG_MAGIC
+from src.motorBrakeBinLog import openBinLog
+from src.motorBrakeBinLog import binLogHeaderStruct
+from src.motorBrakeBinLog import binLogRecordDtype
+from src.motorBrakeBinLog import isGapRecord
+
+# -------------------------------------------------------------------------
+# Log reading
+# -------------------------------------------------------------------------
+
+def _openLogFile(fileName):
+    if fileName.endswith(".gz"):
+        return gzip.open(fileName, 'rb')
+    if fileName.endswith(".zst"):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(fileName, 'rb'))
+    if fileName.endswith(".lz4"):
+        import lz4.frame
+        return lz4.frame.open(fileName, 'rb')
+    return open(fileName, 'rb')
+
+# Returns the list of the files of a session index (see MotorBrakeLogWriter), in order
+def _readSessionIndex(indexFileName):
+    folder = os.path.dirname(indexFileName)
+    fileNames = []
+    with open(indexFileName) as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) > 1:
+                fileNames.append(os.path.join(folder, fields[1]))
+    return fileNames
+
+def _isBinLog(fileName):
+    with _openLogFile(fileName) as f:
+        return f.read(len(BIN_LOG_MAGIC)) == BIN_LOG_MAGIC
+
+# Yields (timestamp [s], speed [deg/sec], torque [Nm], rotation) of a binary log, chunkSize samples at a time.
+# The rotation is the ASCII code of 'R' or 'L'. A plain binary log is mapped in memory, a compressed one is streamed. The gap records are skipped.
+def _iterBinLogChunks(fileName, chunkSize):
+    if os.path.splitext(fileName)[1] not in (".gz", ".zst", ".lz4"):
+        records = openBinLog(fileName)
+        for start in range(0, len(records), chunkSize):
+            chunk = records[start:start+chunkSize]
+            chunk = chunk[~isGapRecord(chunk)]
+            yield chunk["timestampNs"] / 1e9, chunk["speed"].astype(np.float64), chunk["torque"].astype(np.float64), chunk["rotation"]
+        return
+    with _openLogFile(fileName) as f:
+        f.read(binLogHeaderStruct.size)
+        while True:
+            raw = f.read(chunkSize * binLogRecordDtype.itemsize)
+            #a trailing partial record, e.g. of a chunk not closed correctly, is ignored
+            chunk = np.frombuffer(raw, dtype=binLogRecordDtype, count=len(raw) // binLogRecordDtype.itemsize)
+            if len(chunk) == 0:
+                return
+            chunk = chunk[~isGapRecord(chunk)]
+            yield chunk["timestampNs"] / 1e9, chunk["speed"].astype(np.float64), chunk["torque"].astype(np.float64), chunk["rotation"]
+
+# Yields (timestamp [s], speed [deg/sec], torque [Nm], rotation) of a tab separated log, chunkSize samples at a time.
+# The time of the tab separated log is the wall-clock time of the day with milliseconds,
+# so the timestamps are the seconds since midnight (see _unwrapDay).
+def _iterTsvLogChunks(fileName, chunkSize):
+    with _openLogFile(fileName) as f:
+        lines = []
+        for line in f:
+            if line.startswith(b'#'):
+                continue
+            lines.append(line)
+            if len(lines) == chunkSize:
+                yield _parseTsvLines(lines)
+                lines.clear()
+        if lines:
+            yield _parseTsvLines(lines)
+
+def _parseTsvLines(lines):
+    fields = [line.split(b'\t') for line in lines]
+    #the time is HH:MM:SS.mmm: the fixed width columns are converted without parsing each string
+    times = np.array([f[1] for f in fields], dtype='S12').view(np.uint8).reshape(-1, 12).astype(np.float64) - ord('0')
+    t = (times[:, 0]*10 + times[:, 1])*3600 + (times[:, 3]*10 + times[:, 4])*60 + times[:, 6]*10 + times[:, 7] + \
+        (times[:, 9]*100 + times[:, 10]*10 + times[:, 11]) / 1000
+    speed = np.array([f[2] for f in fields], dtype=np.float64)
+    torque = np.array([f[3] for f in fields], dtype=np.float64)
+    rotation = np.array([f[4][:1] for f in fields], dtype='S1').view(np.uint8)
+    return t, speed, torque, rotation
+
+# Adds in place 24h to the timestamps after midnight; returns the new (dayOffset, lastTime)
+def _unwrapDay(t, dayOffset, lastTime):
+    if len(t) == 0:
+        return dayOffset, lastTime
+    prev = np.concatenate(([t[0] if lastTime is None else lastTime - dayOffset], t[:-1]))
+    wraps = np.cumsum(t - prev < -43200) #a jump back of more than 12 hours is a change of day
+    t += dayOffset + wraps * 86400.0
+    return dayOffset + wraps[-1] * 86400.0, t[-1]
+
+# Yields (timestamp [s], speed [deg/sec], torque [Nm]) chunks of a log written by the Motor Brake Manager:
+# a binary or tab separated log (optionally compressed) or the session index of a log split in chunks.
+# The timestamps are relative to the first sample. With withRotation the chunks contain also the
+# rotation of each sample, as ASCII code of 'R' or 'L'.
+def iterLogChunks(fileName, chunkSize=65536, withRotation=False):
+    fileNames = _readSessionIndex(fileName) if fileName.endswith(".index") else [fileName]
+    t0 = None
+    dayOffset = 0.0
+    lastTime = None
+    for name in fileNames:
+        if _isBinLog(name):
+            chunks = _iterBinLogChunks(name, chunkSize)
+        else:
+            chunks = _iterTsvLogChunks(name, chunkSize)
+        for t, speed, torque, rotation in chunks:
+            if len(t) == 0:
+                continue
+            if t0 is None:
+                t0 = t[0]
+            #the chunks of a session continue the same time axis, also across midnight
+            dayOffset, lastTime = _unwrapDay(t, dayOffset, lastTime)
+            if withRotation:
+                yield t - t0, speed, torque, rotation
+            else:
+                yield t - t0, speed, torque
+
+
+# -------------------------------------------------------------------------
+# Processing steps
+# -------------------------------------------------------------------------
+
+# Linear interpolation of the signals on the grid 0, period, 2*period, ...
+# The last sample of a chunk is kept to interpolate the first grid points of the next one.
+class UniformResampler:
+    def __init__(self, period):
+        self.period = period
+        self.nextIdx = 0
+        self.lastT = None
+        self.lastValues = None
+
+    # values has shape (numOfSamples, numOfSignals); returns (grid times, resampled values)
+    def process(self, t, values):
+        if self.lastT is not None:
+            t = np.concatenate(([self.lastT], t))
+            values = np.concatenate((self.lastValues[np.newaxis, :], values))
+        self.lastT = t[-1]
+        self.lastValues = values[-1].copy()
+        lastIdx = int(math.floor(t[-1] / self.period + 1e-9))
+        grid = np.arange(self.nextIdx, lastIdx + 1) * self.period
+        self.nextIdx = max(self.nextIdx, lastIdx + 1)
+        out = np.empty((len(grid), values.shape[1]))
+        for col in range(values.shape[1]):
+            out[:, col] = np.interp(grid, t, values[:, col])
+        return grid, out
+
+
+# Trailing moving average over windowLen samples (the first samples are averaged on the available ones)
+class MovingAverageFilter:
+    def __init__(self, windowLen):
+        self.windowLen = max(1, int(windowLen))
+        self.history = None
+
+    def process(self, values):
+        if self.windowLen == 1 or len(values) == 0:
+            return values
+        numOfOld = 0 if self.history is None else len(self.history)
+        ext = values if self.history is None else np.concatenate((self.history, values))
+        self.history = ext[-(self.windowLen - 1):].copy()
+        csum = np.concatenate((np.zeros((1, ext.shape[1])), np.cumsum(ext, axis=0)))
+        end = np.arange(numOfOld, len(ext)) + 1
+        start = np.maximum(end - self.windowLen, 0)
+        return (csum[end] - csum[start]) / (end - start)[:, np.newaxis]
+
+
+# Finds the segments where the trailing window of windowLen grid samples has a
+# std of speed and torque less than speedTol and torqueTol, lasting at least
+# minDuration seconds: these are the steady states between two setpoint
+# changes. The start of a segment is the start of its first steady window and
+# its statistics are computed on the samples of the segment.
+class SteadyStateDetector:
+    def __init__(self, period, windowLen, speedTol, torqueTol, minDuration):
+        self.period = period
+        self.windowLen = max(2, int(windowLen))
+        self.tol = np.array([speedTol, torqueTol])
+        self.minDuration = minDuration
+        self.history = None
+        self.segment = None #[start time, end time, count, sums, squared sums] of the open segment
+        self.segments = []
+
+    # values has columns speed and torque; returns the segments completed in this chunk
+    def process(self, t, values):
+        numOfCompleted = len(self.segments)
+        ext = values if self.history is None else np.concatenate((self.history, values))
+        numOfOld = len(ext) - len(values)
+        self.history = ext[-(self.windowLen - 1):].copy()
+        csum = np.concatenate((np.zeros((1, 2)), np.cumsum(ext, axis=0)))
+        csum2 = np.concatenate((np.zeros((1, 2)), np.cumsum(ext**2, axis=0)))
+        end = np.arange(numOfOld, len(ext)) + 1
+        start = end - self.windowLen
+        full = start >= 0
+        start = np.maximum(start, 0)
+        n = (end - start)[:, np.newaxis]
+        mean = (csum[end] - csum[start]) / n
+        var = np.maximum((csum2[end] - csum2[start]) / n - mean**2, 0)
+        steady = full & np.all(np.sqrt(var) < self.tol, axis=1)
+        #runs of steady samples: [begin, end) indexes in this chunk
+        edges = np.diff(np.concatenate(([0], steady.astype(np.int8), [0])))
+        begins = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        if self.segment is not None and (len(begins) == 0 or begins[0] != 0):
+            self.__closeSegment()
+        for b, e in zip(begins, ends):
+            if self.segment is None:
+                self.segment = [t[b] - (self.windowLen - 1) * self.period, t[b], 0, np.zeros(2), np.zeros(2)]
+            seg = values[b:e]
+            self.segment[1] = t[e - 1]
+            self.segment[2] += len(seg)
+            self.segment[3] += seg.sum(axis=0)
+            self.segment[4] += (seg**2).sum(axis=0)
+            if e < len(values):
+                self.__closeSegment()
+        return self.segments[numOfCompleted:]
+
+    # Closes the segment still open at the end of the log
+    def finish(self):
+        if self.segment is not None:
+            self.__closeSegment()
+        return self.segments
+
+    def __closeSegment(self): #private method
+        startTime, endTime, count, sums, sums2 = self.segment
+        self.segment = None
+        if endTime - startTime < self.minDuration:
+            return
+        mean = sums / count
+        std = np.sqrt(np.maximum(sums2 / count - mean**2, 0))
+        self.segments.append({"start": startTime, "end": endTime, "speedMean": mean[0], "speedStd": std[0],
+                              "torqueMean": mean[1], "torqueStd": std[1],
+                              "powerMean": mean[0] * mean[1] * math.pi / 180})
+
+
+# Count, mean, std, min and max of a signal, merged chunk by chunk (Chan et al.)
+class SignalSummary:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        if len(x) == 0:
+            return
+        n = len(x)
+        mean = float(x.mean())
+        m2 = float(((x - mean)**2).sum())
+        tot = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / tot
+        self.m2 += m2 + delta**2 * self.count * n / tot
+        self.count = tot
+        self.min = min(self.min, float(x.min()))
+        self.max = max(self.max, float(x.max()))
+
+    def getStd(self):
+        return math.sqrt(self.m2 / self.count) if self.count > 1 else 0.0
+
+    def printSummary(self):
+        print("%-24s count=%10d  mean=%12.4f  std=%12.4f  min=%12.4f  max=%12.4f" % (
+            self.name, self.count, self.mean, self.getStd(), self.min if self.count else 0, self.max if self.count else 0))
+
+
+# Histogram of the sample intervals on log spaced bins from 1 us to 100 s,
+# used to estimate the percentiles (relative error about 1%).
+class IntervalHistogram:
+    def __init__(self):
+        self.edges = np.logspace(-6, 2, 1601)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.lastT = None
+        #exact extremes: the percentiles are only the edges of the bins
+        self.min = 0.0
+        self.max = 0.0
+
+    def add(self, t):
+        if len(t) == 0:
+            return
+        intervals = np.diff(t) if self.lastT is None else np.diff(np.concatenate(([self.lastT], t)))
+        self.lastT = t[-1]
+        if len(intervals) == 0:
+            return
+        self.min = float(intervals.min()) if self.counts.sum() == 0 else min(self.min, float(intervals.min()))
+        self.max = max(self.max, float(intervals.max()))
+        self.counts += np.bincount(np.searchsorted(self.edges, intervals), minlength=len(self.counts))
+
+    # Returns the interval [s] under which there are the quantile q (0..1) of the intervals
+    def getPercentile(self, q):
+        total = self.counts.sum()
+        if total == 0:
+            return 0.0
+        idx = int(np.searchsorted(np.cumsum(self.counts), q * total))
+        return float(self.edges[min(idx, len(self.edges) - 1)])
+
+
+# -------------------------------------------------------------------------
+# Analysis
+# -------------------------------------------------------------------------
+
+# Runs all the steps on a log. If outFileName is not empty the resampled and
+# filtered signals are written in it as tab separated values.
+# Returns the tuple (list of SignalSummary, IntervalHistogram, list of steady segments)
+def analyzeLog(fileName, period=0.01, filterWindow=0.1, steadyWindow=1.0, speedTol=5.0, torqueTol=0.02,
+               minSteadyDuration=2.0, outFileName="", chunkSize=65536):
+    resampler = UniformResampler(period)
+    lowPass = MovingAverageFilter(round(filterWindow / period))
+    detector = SteadyStateDetector(period, round(steadyWindow / period), speedTol, torqueTol, minSteadyDuration)
+    summaries = [SignalSummary("speed[deg/sec]"), SignalSummary("torque[Nm]"), SignalSummary("power[W]")]
+    intervals = IntervalHistogram()
+    outFile = open(outFileName, 'w') if outFileName else None
+    if outFile is not None:
+        outFile.write("Time[s]\tSpeed[deg/sec]\tTorque[Nm]\n")
+    try:
+        for t, speed, torque in iterLogChunks(fileName, chunkSize):
+            intervals.add(t)
+            summaries[0].add(speed)
+            summaries[1].add(torque)
+            summaries[2].add(speed * torque * math.pi / 180)
+            grid, values = resampler.process(t, np.column_stack((speed, torque)))
+            if len(grid) == 0:
+                continue
+            filtered = lowPass.process(values)
+            detector.process(grid, filtered)
+            if outFile is not None:
+                np.savetxt(outFile, np.column_stack((grid, filtered)), fmt="%.3f\t%.6g\t%.6g")
+    finally:
+        if outFile is not None:
+            outFile.close()
+    return summaries, intervals, detector.finish()
@@ -0,0 +1,309 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class MotorBrakeLogWriter is defined. It is the log sink used by
+# MotorBrakeDataCollectorThread: the log file is kept open for the whole
+# acquisition session, the records are formatted in preallocated buffers
+# and a background thread writes the full buffers on file, so that the
+# acquisition loop never waits for the disk.
+# For long tests the log can be compressed (gzip, or zstd/lz4 if the optional
+# packages zstandard/lz4 are installed) and split in chunks by size or time:
+# compression and rotation are done by the background thread too.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import gzip
+import time
+import queue
+from datetime import datetime
+from threading import Thread
+
+# -------------------------------------------------------------------------
+# Record formats
+# -------------------------------------------------------------------------
+
+# Converts the monotonic timestamps of the samples in the human readable
+# wall-clock time "%H:%M:%S.%f" (milliseconds) using a single anchor, i.e. a
+# couple of wall-clock and monotonic times taken together at session start.
+# strftime is called only once per second.
+class WallClockFormatter:
+    def __init__(self, wallAnchorNs=None, monoAnchorNs=None):
+        if wallAnchorNs is None:
+            wallAnchorNs = time.time_ns()
+            monoAnchorNs = time.monotonic_ns()
+        self.wallAnchorNs = wallAnchorNs
+        self.monoAnchorNs = monoAnchorNs
+        self.lastSec = -1
+        self.lastSecStr = ""
+
+    def toWallTimeNs(self, timestampNs):
+        return self.wallAnchorNs + timestampNs - self.monoAnchorNs
+
+    def format(self, timestampNs):
+        sec, ns = divmod(self.toWallTimeNs(timestampNs), 1000000000)
+        if sec != self.lastSec:
+            self.lastSec = sec
+            self.lastSecStr = datetime.fromtimestamp(sec).strftime("%H:%M:%S")
+        return self.lastSecStr + ".%03d" % (ns // 1000000)
+
+
+# Tab separated format, the same that the data collector has always written:
+# progNum, time, speed, torque, rotation (followed by an empty column).
+class TsvRecordFormat:
+    def __init__(self, wallAnchorNs=None, monoAnchorNs=None):
+        self.clock = WallClockFormatter(wallAnchorNs, monoAnchorNs)
+
+    def header(self):
+        return "#\tTime\tSpeed[deg/sec]\tTorque[Nm]\tRotation[R or L]\n".encode()
+
+    def encode(self, data):
+        return (str(data.progNum) + '\t' + self.clock.format(data.timestampNs) + '\t' + str(data.speed) + '\t' + str(data.torque) + '\t' + data.rotation + '\t' + '\n').encode()
+
+    # A gap (see MotorBrakeGap) is a comment line, so the readers of the log skip it:
+    # #gap <time of the first sample dropped> <duration [sec]> <dropped samples> <reason>
+    def encodeGap(self, gap):
+        return ("#gap\t" + self.clock.format(gap.startNs) + '\t' + str(gap.durationNs / 1e9) + '\t' + str(gap.numOfDropped) + '\t' + gap.reason + '\n').encode()
+
+
+# -------------------------------------------------------------------------
+# Compression and rotation
+# -------------------------------------------------------------------------
+LOG_COMPRESSION_NONE = "none"
+LOG_COMPRESSION_GZIP = "gzip"
+LOG_COMPRESSION_ZSTD = "zstd" #needs the zstandard package
+LOG_COMPRESSION_LZ4 = "lz4"   #needs the lz4 package
+logCompressions = [LOG_COMPRESSION_NONE, LOG_COMPRESSION_GZIP, LOG_COMPRESSION_ZSTD, LOG_COMPRESSION_LZ4]
+logCompressionExt = {LOG_COMPRESSION_NONE: "", LOG_COMPRESSION_GZIP: ".gz", LOG_COMPRESSION_ZSTD: ".zst", LOG_COMPRESSION_LZ4: ".lz4"}
+
+# Log options for long tests:
+# - compression: one of logCompressions
+# - rotateSize: a new chunk is started when the current one contains rotateSize bytes (before compression), 0: disabled
+# - rotateInterval: a new chunk is started every rotateInterval seconds, 0: disabled
+class MotorBrakeLogCfg:
+    def __init__(self, compression=LOG_COMPRESSION_NONE, rotateSize=0, rotateInterval=0):
+        self.compression = compression
+        self.rotateSize = rotateSize
+        self.rotateInterval = rotateInterval
+
+    def isRotationEna(self):
+        return self.rotateSize > 0 or self.rotateInterval > 0
+
+def isLogCompressionAvailable(compression):
+    try:
+        if compression == LOG_COMPRESSION_ZSTD:
+            import zstandard
+        elif compression == LOG_COMPRESSION_LZ4:
+            import lz4.frame
+    except ImportError:
+        return False
+    return compression in logCompressions
+
+# Returns a writable stream that compresses the data on rawFile.
+# Closing the stream terminates the compressed data but it doesn't close rawFile.
+def _openCompressor(rawFile, compression):
+    if compression == LOG_COMPRESSION_GZIP:
+        return gzip.GzipFile(fileobj=rawFile, mode='wb', compresslevel=6)
+    if compression == LOG_COMPRESSION_ZSTD:
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).stream_writer(rawFile, closefd=False)
+    if compression == LOG_COMPRESSION_LZ4:
+        import lz4.frame
+        return lz4.frame.LZ4FrameFile(rawFile, mode='wb')
+    return None
+
+
+# -------------------------------------------------------------------------
+# Log writer
+# -------------------------------------------------------------------------
+
+# The acquisition thread calls writeRecord() that copies the encoded record in
+# the active buffer. When the active buffer is full or it is older than
+# flushInterval seconds, it is handed off to the writer thread and a free buffer
+# is taken from the pool. The writer thread writes the buffers on file and gives
+# them back to the pool. The file is fsync-ed only in close().
+# With rotation (see MotorBrakeLogCfg) the log is split in chunks named
+# <name>.<chunk number><ext>[compression ext], e.g. test.0001.tsv.gz; each chunk
+# starts with the header of the format, so it can be read alone. When a chunk is
+# complete it is fsync-ed and listed in the session index <fileName>.index, so a
+# crash loses at most the chunk being written. Without rotation the file is
+# <fileName>[compression ext].
+class MotorBrakeLogWriter:
+    def __init__(self, fileName, recordFormat=None, bufferSize=65536, flushInterval=1.0, numOfBuffers=4, logCfg=None):
+        self.fileName = fileName
+        self.recordFormat = recordFormat if recordFormat is not None else TsvRecordFormat()
+        self.logCfg = logCfg if logCfg is not None else MotorBrakeLogCfg()
+        self.bufferSize = bufferSize
+        self.flushInterval = flushInterval
+        self.freeBuffers = queue.Queue()
+        for i in range(numOfBuffers):
+            self.freeBuffers.put(bytearray(bufferSize))
+        self.fullBuffers = queue.Queue()
+        self.file = None
+        self.rawFile = None
+        self.indexFile = None
+        self.writerTh = None
+        self.isOpen = False #owned by the acquisition thread: self.file is swapped by the writer thread at each rotation
+        self.chunkIdx = 0
+        #statistics
+        self.numOfRecords = 0
+        self.numOfFlushes = 0
+        self.numOfBufferStarvations = 0
+        self.flushLatencySum = 0.0
+        self.flushLatencyMax = 0.0
+        self.rawBytes = 0
+        self.compressedBytes = 0
+        self.writeTime = 0.0 #time spent by the writer thread in compressing and writing
+
+    def open(self):
+        if self.logCfg.isRotationEna():
+            self.indexFile = open(self.fileName + ".index", 'w')
+            self.indexFile.write("#\tFile\tStart\tRecords\tBytes\tCompressedBytes\n")
+        self.__openChunk()
+        self.activeBuffer = self.freeBuffers.get()
+        self.activeLen = 0
+        self.activeRecords = 0
+        self.activeStart = time.monotonic()
+        self.writerTh = Thread(target=self.__writerLoop, name="MotorBrakeLogWriter", daemon=True)
+        self.writerTh.start()
+        self.isOpen = True
+
+    def writeRecord(self, data):
+        self.__append(self.recordFormat.encode(data))
+
+    # Writes the record of a gap of the acquisition (see MotorBrakeGap)
+    def writeGap(self, gap):
+        self.__append(self.recordFormat.encodeGap(gap))
+
+    def close(self):
+        if not self.isOpen:
+            return
+        self.isOpen = False
+        if self.activeLen > 0:
+            self.__handOff()
+        self.fullBuffers.put(None) #tells to the writer thread to exit
+        self.writerTh.join()
+        self.__closeChunk()
+        if self.indexFile is not None:
+            self.indexFile.close()
+            self.indexFile = None
+
+    def getFlushLatencyMean(self):
+        if self.numOfFlushes == 0:
+            return 0.0
+        return self.flushLatencySum / self.numOfFlushes
+
+    # Returns the throughput of the writer thread in MB/s of uncompressed data
+    def getWriteThroughput(self):
+        if self.writeTime == 0:
+            return 0.0
+        return self.rawBytes / self.writeTime / 1e6
+
+    def printStats(self):
+        print("MotorBrakeLogWriter: records=", self.numOfRecords, " flushes=", self.numOfFlushes,
+              " flush latency mean[s]=", self.getFlushLatencyMean(), " max[s]=", self.flushLatencyMax,
+              " buffer starvations=", self.numOfBufferStarvations)
+        if self.logCfg.compression != LOG_COMPRESSION_NONE or self.logCfg.isRotationEna():
+            ratio = self.rawBytes / self.compressedBytes if self.compressedBytes > 0 else 0.0
+            print("MotorBrakeLogWriter: compression=", self.logCfg.compression, " chunks=", self.chunkIdx,
+                  " bytes=", self.rawBytes, " written bytes=", self.compressedBytes, " ratio=", ratio,
+                  " throughput[MB/s]=", self.getWriteThroughput())
+
+    def __append(self, rec): #private method
+        recLen = len(rec)
+        if self.activeLen + recLen > self.bufferSize:
+            self.__handOff()
+        end = self.activeLen + recLen
+        self.activeBuffer[self.activeLen:end] = rec #same length slice: no reallocation
+        self.activeLen = end
+        self.activeRecords += 1
+        self.numOfRecords += 1
+        if time.monotonic() - self.activeStart > self.flushInterval:
+            self.__handOff()
+
+    def __handOff(self): #private method
+        self.fullBuffers.put((self.activeBuffer, self.activeLen, self.activeRecords, time.monotonic()))
+        try:
+            self.activeBuffer = self.freeBuffers.get_nowait()
+        except queue.Empty:
+            #the writer thread is late: allocate a new buffer instead of blocking the acquisition
+            self.numOfBufferStarvations += 1
+            self.activeBuffer = bytearray(self.bufferSize)
+        self.activeLen = 0
+        self.activeRecords = 0
+        self.activeStart = time.monotonic()
+
+    def __writerLoop(self): #private method
+        while True:
+            item = self.fullBuffers.get()
+            if item is None:
+                break
+            buf, bufLen, numOfRecords, handOffTime = item
+            #a buffer contains only whole records, so the chunks are rotated between two buffers
+            if self.__isChunkComplete():
+                self.__closeChunk()
+                self.__openChunk()
+            startTime = time.monotonic()
+            self.file.write(memoryview(buf)[:bufLen])
+            if self.file is self.rawFile:
+                #a compressed stream is not flushed at each buffer, not to worsen the compression ratio
+                self.file.flush()
+            self.writeTime += time.monotonic() - startTime
+            self.rawBytes += bufLen
+            self.chunkBytes += bufLen
+            self.chunkRecords += numOfRecords
+            latency = time.monotonic() - handOffTime
+            self.numOfFlushes += 1
+            self.flushLatencySum += latency
+            if latency > self.flushLatencyMax:
+                self.flushLatencyMax = latency
+            self.freeBuffers.put(buf)
+
+    def __getChunkFileName(self): #private method
+        ext = logCompressionExt[self.logCfg.compression]
+        if not self.logCfg.isRotationEna():
+            return self.fileName + ext
+        root, fileExt = os.path.splitext(self.fileName)
+        return root + ".%04d" % self.chunkIdx + fileExt + ext
+
+    def __isChunkComplete(self): #private method
+        if self.chunkRecords == 0:
+            return False #no empty chunks, e.g. when the first samples arrive later than rotateInterval
+        if self.logCfg.rotateSize > 0 and self.chunkBytes >= self.logCfg.rotateSize:
+            return True
+        return self.logCfg.rotateInterval > 0 and time.monotonic() - self.chunkStart >= self.logCfg.rotateInterval
+
+    def __openChunk(self): #private method
+        self.chunkIdx += 1
+        self.chunkFileName = self.__getChunkFileName()
+        self.rawFile = open(self.chunkFileName, 'wb')
+        self.file = _openCompressor(self.rawFile, self.logCfg.compression) or self.rawFile
+        header = self.recordFormat.header()
+        self.file.write(header)
+        self.rawBytes += len(header)
+        self.chunkBytes = len(header)
+        self.chunkRecords = 0
+        self.chunkStart = time.monotonic()
+        self.chunkStartWall = time.time()
+
+    def __closeChunk(self): #private method
+        startTime = time.monotonic()
+        if self.file is not self.rawFile:
+            self.file.close() #writes the end of the compressed stream
+        self.rawFile.flush()
+        os.fsync(self.rawFile.fileno())
+        self.rawFile.close()
+        self.writeTime += time.monotonic() - startTime
+        self.file = None
+        self.rawFile = None
+        chunkSize = os.path.getsize(self.chunkFileName)
+        self.compressedBytes += chunkSize
+        if self.indexFile is not None:
+            #the chunk is listed only when it is complete and synced on disk
+            self.indexFile.write(str(self.chunkIdx) + '\t' + os.path.basename(self.chunkFileName) + '\t' +
+                                 datetime.fromtimestamp(self.chunkStartWall).isoformat(timespec='milliseconds') + '\t' +
+                                 str(self.chunkRecords) + '\t' + str(self.chunkBytes) + '\t' + str(chunkSize) + '\n')
+            self.indexFile.flush()
+            os.fsync(self.indexFile.fileno())
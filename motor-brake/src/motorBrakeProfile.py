@@ -0,0 +1,191 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the setpoint profiles are defined. A profile is a sequence of
+# speed/torque segments (steps, ramps, sine sweeps) read from a JSON file;
+# it is compiled in a list of timed setpoints and executed inside the
+# manager by MotorBrakeProfileRunner, on the same monotonic clock of the
+# acquisition, so its timing doesn't depend on external scripts or on the
+# yarp latency.
+#
+# Profile file:
+# {
+#     "rate": 20,
+#     "segments": [
+#         {"type": "step", "quantity": "speed", "value": 60, "duration": 5},
+#         {"type": "ramp", "quantity": "torque", "from": 0, "to": 2000, "duration": 10},
+#         {"type": "sine", "quantity": "speed", "offset": 60, "amplitude": 30,
+#          "freqStart": 0.1, "freqEnd": 1.0, "duration": 20},
+#         {"type": "hold", "duration": 2}
+#     ]
+# }
+#  - step: one setpoint, then the value is held for duration seconds
+#  - ramp: linear ramp from "from" to "to" in duration seconds
+#  - sine: sine sweep offset + amplitude*sin(phase), where the frequency goes
+#          linearly from freqStart to freqEnd Hz (freqEnd = freqStart: pure sine)
+#  - hold: no setpoint for duration seconds
+# Ramps and sines are discretized at "rate" setpoints/sec (it can be set
+# also in each segment, default 10). The values are sent to the device as they
+# are, like the setpoints received on the yarp port: speed is in rpm, torque in
+# mNm (the log instead has speed in deg/sec and torque in Nm).
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import json
+import math
+import time
+from threading import Thread
+from threading import Event
+from termcolor import colored
+from src.motorBrakeStatistics import StreamingStatistics
+
+# -------------------------------------------------------------------------
+# Profile
+# -------------------------------------------------------------------------
+PROFILE_QUANTITY_SPEED = "speed"
+PROFILE_QUANTITY_TORQUE = "torque"
+profileQuantities = [PROFILE_QUANTITY_SPEED, PROFILE_QUANTITY_TORQUE]
+profileSegmentTypes = ["step", "ramp", "sine", "hold"]
+PROFILE_DEFAULT_RATE = 10 #setpoints/sec of ramps and sines
+
+# Setpoint of a profile: offsetNs is the intended instant from the start of the profile
+class ProfileSetpoint:
+    def __init__(self, offsetNs, quantity, value):
+        self.offsetNs = offsetNs
+        self.quantity = quantity
+        self.value = value
+
+# Compiles the segments in the list of setpoints, ordered by time.
+# Returns (list of ProfileSetpoint, duration of the profile in ns).
+def compileProfile(segments, rate=PROFILE_DEFAULT_RATE):
+    setpoints = []
+    startNs = 0
+    for idx, seg in enumerate(segments):
+        segType = seg.get("type")
+        if segType not in profileSegmentTypes:
+            raise ValueError("segment " + str(idx) + ": unknown type " + str(segType))
+        if segType != "hold" and seg.get("quantity") not in profileQuantities:
+            raise ValueError("segment " + str(idx) + ": quantity must be one of " + str(profileQuantities))
+        duration = float(seg.get("duration", 0))
+        if duration < 0:
+            raise ValueError("segment " + str(idx) + ": negative duration")
+        durationNs = int(duration * 1e9)
+        segRate = float(seg.get("rate", rate))
+        #ramps and sines: one setpoint every 1/rate seconds plus the final one
+        numOfSteps = max(1, int(round(duration * segRate)))
+        if segType == "step":
+            setpoints.append(ProfileSetpoint(startNs, seg["quantity"], float(seg["value"])))
+        elif segType == "ramp":
+            start = float(seg["from"])
+            stop = float(seg["to"])
+            for i in range(numOfSteps + 1):
+                setpoints.append(ProfileSetpoint(startNs + durationNs * i // numOfSteps, seg["quantity"], start + (stop - start) * i / numOfSteps))
+        elif segType == "sine":
+            offset = float(seg.get("offset", 0))
+            amplitude = float(seg["amplitude"])
+            freqStart = float(seg["freqStart"])
+            freqEnd = float(seg.get("freqEnd", freqStart))
+            for i in range(numOfSteps + 1):
+                t = duration * i / numOfSteps
+                #linear chirp: the phase is the integral of the frequency
+                phase = 2 * math.pi * (freqStart * t + (freqEnd - freqStart) * t * t / (2 * duration)) if duration > 0 else 0.0
+                setpoints.append(ProfileSetpoint(startNs + durationNs * i // numOfSteps, seg["quantity"], offset + amplitude * math.sin(phase)))
+        startNs += durationNs
+    for sp in setpoints:
+        sp.value = round(sp.value, 3) #the device doesn't need more digits
+    return setpoints, startNs
+
+def loadProfile(fileName):
+    with open(fileName) as f:
+        cfg = json.load(f)
+    segments = cfg.get("segments", [])
+    if len(segments) == 0:
+        raise ValueError(fileName + ": no segments")
+    try:
+        return compileProfile(segments, float(cfg.get("rate", PROFILE_DEFAULT_RATE)))
+    except (KeyError, ValueError, TypeError) as e:
+        raise ValueError(fileName + ": " + str(e))
+
+
+# -------------------------------------------------------------------------
+# Profile runner
+# -------------------------------------------------------------------------
+
+# It executes the setpoints of a profile at their intended instants (startNs +
+# offsetNs on the monotonic clock). The setpoints are submitted to the serial
+# I/O owner as commands, so they have priority over the data polling.
+# Each setpoint is tagged with the sample index (progNum) of the last sample
+# acquired before it has been sent: the setpoint has effect from the next
+# sample of the log. If tagFileName is not empty the tags are written in it
+# as tab separated values at the end of the profile.
+# At the end the achieved timing is compared with the intended one:
+#  - lateness: instant the setpoint has been sent on the serial port - intended instant
+#  - duration: achieved and intended duration of the profile
+class MotorBrakeProfileRunner(Thread):
+    def __init__(self, motor_br_dev, ioTh, setpoints, durationNs, tagFileName="", startNs=0):
+        Thread.__init__(self, name="MotorBrakeProfileRunner")
+        self.motor_br_dev = motor_br_dev
+        self.ioTh = ioTh
+        self.setpoints = setpoints
+        self.durationNs = durationNs
+        self.tagFileName = tagFileName
+        self.startNs = startNs #0: the profile starts now
+        self.stopEvt = Event()
+        self.tags = [] #(setpoint index, sent instant, sample index, answer ok), appended by the serial I/O owner
+        self.latenessStats = StreamingStatistics("setpoint lateness")
+
+    def run(self):
+        if self.startNs == 0:
+            self.startNs = time.monotonic_ns()
+        print ("MotorBrakeProfileRunner is starting:", len(self.setpoints), "setpoints in", self.durationNs / 1e9, "sec")
+        futures = []
+        for idx, sp in enumerate(self.setpoints):
+            waitNs = self.startNs + sp.offsetNs - time.monotonic_ns()
+            if waitNs > 0 and self.stopEvt.wait(waitNs / 1e9):
+                break
+            if self.stopEvt.is_set():
+                break
+            func = self.motor_br_dev.sendSpeedSetpoint if sp.quantity == "speed" else self.motor_br_dev.sendTorqueSetpoint
+            futures.append(self.ioTh.submitCommand(self.__execute, idx, func, sp.value))
+        for future in futures:
+            future.result()
+        #the profile lasts until the end of its last segment
+        waitNs = self.startNs + self.durationNs - time.monotonic_ns()
+        if waitNs > 0:
+            self.stopEvt.wait(waitNs / 1e9)
+        self.endNs = time.monotonic_ns()
+        if self.tagFileName:
+            self.__writeTags()
+        self.printStats()
+        print ("MotorBrakeProfileRunner is closing...")
+
+    def stop(self):
+        self.stopEvt.set()
+        self.join()
+
+    def printStats(self):
+        print(colored("MotorBrakeProfileRunner: sent " + str(len(self.tags)) + "/" + str(len(self.setpoints)) + " setpoints, " +
+                      str(sum(1 for tag in self.tags if not tag[3])) + " not acknowledged", 'blue'))
+        print(colored("duration [sec]: intended= " + str(self.durationNs / 1e9) + " achieved= " + str((self.endNs - self.startNs) / 1e9), 'blue'))
+        self.latenessStats.printStats()
+
+    #It is called by the serial I/O owner
+    def __execute(self, idx, func, value): #private method
+        sentNs = time.monotonic_ns()
+        sampleIdx = self.motor_br_dev.mydata.progNum
+        ok = func(value)
+        self.tags.append((idx, sentNs, sampleIdx, ok))
+        self.latenessStats.add(max(0, sentNs - self.startNs - self.setpoints[idx].offsetNs))
+        return ok
+
+    def __writeTags(self): #private method
+        with open(self.tagFileName, 'w') as f:
+            f.write("#\tIntended[sec]\tSent[sec]\tLateness[ms]\tSample#\tQuantity\tValue\tAck\n")
+            for idx, sentNs, sampleIdx, ok in self.tags:
+                sp = self.setpoints[idx]
+                sentOffsetNs = sentNs - self.startNs
+                f.write(str(idx) + '\t' + str(sp.offsetNs / 1e9) + '\t' + str(sentOffsetNs / 1e9) + '\t' + str((sentOffsetNs - sp.offsetNs) / 1e6) + '\t' +
+                        str(sampleIdx) + '\t' + sp.quantity + '\t' + str(sp.value) + '\t' + str(int(bool(ok))) + '\n')
+        print("MotorBrakeProfileRunner: setpoint tags written in", self.tagFileName)
@@ -7,7 +7,6 @@
 # <valentina.gaggero@iit.it>
 # -------------------------------------------------------------------------
 
-import matplotlib.pyplot as plt
 from termcolor import colored
 import serial.tools.list_ports as portlist
 
@@ -25,6 +24,10 @@ MENU_CODE_set_sp=5
 MENU_CODE_custom=6
 MENU_CODE_ena_disa_acqtiming=7
 MENU_CODE_quit=8
+MENU_CODE_live_plot=9
+MENU_CODE_char_map=10
+MENU_CODE_stage_timers=11
+MENU_CODE_profile=12
 
 user_menu = {
     MENU_CODE_get_id: {"code":MENU_CODE_get_id, "usrStr":"Get motor-brake device Id and revision"},
@@ -35,6 +38,10 @@ user_menu = {
     MENU_CODE_custom: {"code":MENU_CODE_custom, "usrStr":"Custom"},
     MENU_CODE_ena_disa_acqtiming: {"code":MENU_CODE_ena_disa_acqtiming, "usrStr":"Enable/disable acquisition timing"},
     MENU_CODE_quit: {"code":MENU_CODE_quit, "usrStr":"Quit"},
+    MENU_CODE_live_plot: {"code":MENU_CODE_live_plot, "usrStr":"Show live plot"},
+    MENU_CODE_char_map: {"code":MENU_CODE_char_map, "usrStr":"Show torque-speed characterization map"},
+    MENU_CODE_stage_timers: {"code":MENU_CODE_stage_timers, "usrStr":"Enable/disable stage timers"},
+    MENU_CODE_profile: {"code":MENU_CODE_profile, "usrStr":"Run/stop setpoint profile"},
 }
 
 
@@ -42,10 +49,11 @@ user_menu = {
 # Plot data
 # -------------------------------------------------------------------------
 def plot_data(var):
+    import matplotlib.pyplot as plt #loaded only when a plot is requested
     time = []
     torque = []
     speed = []
-    for obj in var: time.append(obj.time)
+    for obj in var: time.append(obj.timestampNs/1e9)
     for obj in var: speed.append(obj.speed)
     for obj in var: torque.append(obj.torque)
     
@@ -0,0 +1,98 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the replay of the acquisition logs is defined. A recorded session
+# (tab separated or binary log, optionally compressed, or the session index
+# of a log split in chunks) is published again on the yarp port
+# /motorbrake/out with the same bottle layout of the live acquisition, so
+# the consumers of the port can be tested without the device:
+#  - speed 1: the original intervals between the samples are kept
+#  - speed N: the intervals are divided by N
+#  - speed 0: the samples are published as fast as possible
+# The log is read lazily, chunk by chunk (see iterLogChunks), so a
+# recording of any size is replayed in constant memory. The gaps of the
+# log are replayed as missing samples.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import time
+from threading import Thread
+from threading import Event
+from termcolor import colored
+from src.motorBrakeDriver import MotorBrakeOuputData
+from src.motorBrakeLogAnalysis import iterLogChunks
+from src.motorBrakeStatistics import StreamingStatistics
+
+REPLAY_SPEED_MAX = 0 #as fast as possible
+
+# Yields the samples of a log one at a time as (time from the first sample [s], speed, torque, rotation).
+# Only one chunk of chunkSize samples is in memory.
+def iterLogSamples(fileName, chunkSize=65536):
+    for t, speed, torque, rotation in iterLogChunks(fileName, chunkSize, withRotation=True):
+        yield from zip(t.tolist(), speed.tolist(), torque.tolist(), rotation.tobytes().decode(errors="replace"))
+
+
+# It publishes the samples of a log in sinks (a MotorBrakeDataSinks, usually with
+# only the yarp port enabled). Each sample is published at its intended instant
+# startNs + t/speed on the monotonic clock, so the delays don't accumulate; the
+# timestamp of the published sample is the instant of its publishing.
+# At the end the achieved throughput is compared with the intended one:
+#  - lateness: instant the sample has been published - intended instant
+#  - speed: duration of the recording / duration of the replay
+class MotorBrakeLogReplay(Thread):
+    def __init__(self, fileName, sinks, speed=1.0, chunkSize=65536):
+        Thread.__init__(self, name="MotorBrakeLogReplay")
+        self.fileName = fileName
+        self.sinks = sinks
+        self.speed = speed
+        self.chunkSize = chunkSize
+        self.stopEvt = Event()
+        #statistics
+        self.numOfSamples = 0
+        self.logDuration = 0.0
+        self.replayDuration = 0.0
+        self.latenessStats = StreamingStatistics("replay lateness")
+
+    def run(self):
+        print ("MotorBrakeLogReplay is starting: replay of", self.fileName, "at", "max speed" if self.speed == REPLAY_SPEED_MAX else "speed x" + str(self.speed))
+        data = MotorBrakeOuputData()
+        self.sinks.open()
+        startNs = time.monotonic_ns()
+        t = 0.0
+        for t, speed, torque, rotation in iterLogSamples(self.fileName, self.chunkSize):
+            if self.speed != REPLAY_SPEED_MAX:
+                intendedNs = startNs + int(t / self.speed * 1e9)
+                waitNs = intendedNs - time.monotonic_ns()
+                if waitNs > 0 and self.stopEvt.wait(waitNs / 1e9):
+                    break
+            if self.stopEvt.is_set():
+                break
+            data.progNum = self.numOfSamples
+            data.timestampNs = time.monotonic_ns()
+            data.speed = speed
+            data.torque = torque
+            data.rotation = rotation
+            self.sinks.write(data)
+            self.numOfSamples += 1
+            if self.speed != REPLAY_SPEED_MAX:
+                self.latenessStats.add(max(0, data.timestampNs - intendedNs))
+        self.replayDuration = (time.monotonic_ns() - startNs) / 1e9
+        self.logDuration = t
+        self.sinks.close()
+        self.printStats()
+        print ("MotorBrakeLogReplay is closing...")
+
+    def stop(self):
+        self.stopEvt.set()
+        self.join()
+
+    def printStats(self):
+        print(colored("MotorBrakeLogReplay: replayed " + str(self.numOfSamples) + " samples (" + str(self.logDuration) + " sec of log) in " +
+                      str(self.replayDuration) + " sec", 'blue'))
+        if self.replayDuration > 0:
+            print(colored("throughput= " + str(self.numOfSamples / self.replayDuration) + " samples/sec  achieved speed= x" +
+                          str(self.logDuration / self.replayDuration), 'blue'))
+        if self.speed != REPLAY_SPEED_MAX:
+            self.latenessStats.printStats()
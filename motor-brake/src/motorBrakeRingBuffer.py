@@ -0,0 +1,71 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class SampleRingBuffer is defined. It is a preallocated NumPy
+# ring buffer where the data collector writes timestamp, speed and torque
+# of each sample; the readers (e.g. the live plot) take a copy of its
+# content without stopping the writer.
+# In this module there is also the min/max envelope decimation used to
+# plot long histories with a fixed number of points.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import numpy as np
+
+# -------------------------------------------------------------------------
+# Ring buffer
+# -------------------------------------------------------------------------
+
+# Single writer, many readers. The capacity is rounded up to a power of two.
+# Columns: 0 = timestamp (seconds, monotonic clock), 1 = speed, 2 = torque
+class SampleRingBuffer:
+    def __init__(self, capacity=1<<20):
+        self.capacity = 1 << max(0, int(capacity) - 1).bit_length()
+        self.mask = self.capacity - 1
+        self.data = np.zeros((self.capacity, 3))
+        self.numOfWritten = 0
+
+    def write(self, timestampNs, speed, torque):
+        self.data[self.numOfWritten & self.mask] = (timestampNs / 1e9, speed, torque)
+        self.numOfWritten += 1
+
+    # Returns a copy of the samples in the buffer, in chronological order.
+    # The oldest samples can be overwritten by the writer during the copy:
+    # this is acceptable for plotting.
+    def read(self):
+        n = self.numOfWritten
+        if n <= self.capacity:
+            return self.data[:n].copy()
+        idx = n & self.mask
+        return np.concatenate((self.data[idx:], self.data[:idx]))
+
+
+# -------------------------------------------------------------------------
+# Decimation
+# -------------------------------------------------------------------------
+
+# Reduces (x, y) to at most 2*numOfBins points: the samples are split in
+# numOfBins bins and for each bin the min and the max of y are kept in their
+# time order, so the envelope of the signal (e.g. spikes) is preserved.
+def minMaxDecimate(x, y, numOfBins):
+    n = len(y)
+    if n <= 2 * numOfBins:
+        return x, y
+    binSize = n // numOfBins
+    start = n - binSize * numOfBins #the oldest samples that don't fill a bin are dropped
+    xb = x[start:].reshape(numOfBins, binSize)
+    yb = y[start:].reshape(numOfBins, binSize)
+    iMin = yb.argmin(axis=1)
+    iMax = yb.argmax(axis=1)
+    first = np.minimum(iMin, iMax)
+    second = np.maximum(iMin, iMax)
+    rows = np.arange(numOfBins)
+    xd = np.empty(2 * numOfBins)
+    yd = np.empty(2 * numOfBins)
+    xd[0::2] = xb[rows, first]
+    xd[1::2] = xb[rows, second]
+    yd[0::2] = yb[rows, first]
+    yd[1::2] = yb[rows, second]
+    return xd, yd
@@ -0,0 +1,112 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class DeadlineScheduler is defined. It paces the acquisition
+# loop on absolute deadlines of the monotonic clock: the n-th sample is
+# scheduled at start + n*period, so the execution time of the loop and the
+# sleep overshoot don't accumulate and wall-clock jumps have no effect.
+#
+# When the loop overruns a deadline the policy decides what to do:
+#  - catchup: the missed samples are acquired immediately, one after the
+#             other, so the average rate is exactly 1/period
+#  - skip:    the missed samples are skipped and the loop waits for the
+#             next deadline of the grid
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import time
+from src.motorBrakeStatistics import StreamingStatistics
+from src.motorBrakeInstrumentation import stageTimers, STAGE_SLEEP_OVERSHOOT
+
+# -------------------------------------------------------------------------
+# Overrun policies
+# -------------------------------------------------------------------------
+OVERRUN_POLICY_CATCHUP = "catchup"
+OVERRUN_POLICY_SKIP = "skip"
+overrunPolicies = [OVERRUN_POLICY_CATCHUP, OVERRUN_POLICY_SKIP]
+
+# -------------------------------------------------------------------------
+# Deadline scheduler
+# -------------------------------------------------------------------------
+class DeadlineScheduler:
+    def __init__(self, period, policy=OVERRUN_POLICY_CATCHUP):
+        self.periodNs = int(period * 1e9)
+        self.policy = policy
+        #statistics
+        self.numOfOverruns = 0
+        self.numOfSkipped = 0
+        self.jitterStats = StreamingStatistics("sample instant jitter")
+
+    def start(self):
+        self.startNs = time.monotonic_ns()
+        self.nextDeadline = self.startNs + self.periodNs
+        self.numOfOverruns = 0
+        self.numOfSkipped = 0
+        self.jitterStats.reset()
+
+    # Moves the deadlines after an outage of the acquisition: the grid restarts
+    # from now, so the catchup policy doesn't acquire the samples of the outage.
+    # The statistics are kept.
+    def resync(self):
+        self.nextDeadline = time.monotonic_ns() + self.periodNs
+
+    # Waits for the deadline of the next sample.
+    # The difference between the actual instant and the intended one is
+    # added to the jitter statistics.
+    def waitNextDeadline(self):
+        if self.periodNs <= 0:
+            return #no pacing
+        sleepNs = self.__getSleepTime()
+        if sleepNs > 0:
+            time.sleep(sleepNs / 1e9)
+            #ATTENTION:
+            #note about sleep function
+            #Changed in version 3.5: The function now sleeps at least secs even if the sleep is interrupted by a signal,
+            #except if the signal handler raises an exception (see PEP 475 for the rationale).
+            #from: https://docs.python.org/3/library/time.html#time.sleep
+        self.__wokeUp(sleepNs > 0)
+
+    # Same of waitNextDeadline, for the acquisition running on an asyncio event loop
+    async def waitNextDeadlineAsync(self):
+        import asyncio #loaded by the asyncio manager: the threaded one doesn't pay for it at startup
+        if self.periodNs <= 0:
+            return #no pacing
+        sleepNs = self.__getSleepTime()
+        if sleepNs > 0:
+            await asyncio.sleep(sleepNs / 1e9)
+        self.__wokeUp(sleepNs > 0)
+
+    # Returns the rate achieved since start()
+    def getAchievedRate(self):
+        elapsedNs = time.monotonic_ns() - self.startNs
+        if elapsedNs <= 0:
+            return 0.0
+        return self.jitterStats.count / (elapsedNs / 1e9)
+
+    def printStats(self):
+        if self.periodNs <= 0:
+            return
+        print("DeadlineScheduler: policy=", self.policy, " nominal rate[Hz]=", 1e9/self.periodNs,
+              " achieved rate[Hz]=", self.getAchievedRate(), " overruns=", self.numOfOverruns,
+              " skipped samples=", self.numOfSkipped)
+        self.jitterStats.printStats()
+
+    # Applies the overrun policy and returns the time to sleep until the next deadline
+    def __getSleepTime(self): #private method
+        now = time.monotonic_ns()
+        if now > self.nextDeadline:
+            self.numOfOverruns += 1
+            if self.policy == OVERRUN_POLICY_SKIP:
+                missed = (now - self.nextDeadline) // self.periodNs + 1
+                self.numOfSkipped += missed
+                self.nextDeadline += missed * self.periodNs
+        return self.nextDeadline - now
+
+    def __wokeUp(self, slept): #private method
+        jitterNs = time.monotonic_ns() - self.nextDeadline
+        self.jitterStats.add(jitterNs)
+        if slept:
+            stageTimers.record(STAGE_SLEEP_OVERSHOOT, jitterNs)
+        self.nextDeadline += self.periodNs
@@ -0,0 +1,121 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class SerialFrameReader is defined. It is the reader layer of the
+# MotorBrake driver over its serial port:
+#  - all the bytes available on the port are read with one bulk read into a
+#    preallocated bytearray, instead of the small reads of readline()
+#  - the frames terminated by '\n' are split inside that buffer: readFrame()
+#    returns the position of the frame, that is parsed in place
+#  - each read has its own deadline in milliseconds, so a missing terminator
+#    costs the deadline of the request and not the timeout of the port
+# On POSIX the port is waited with select() and read with os.readv()
+# directly into the buffer; elsewhere pyserial read() is used with the
+# remaining time of the deadline as timeout.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import time
+import select
+import serial
+
+SERIAL_READER_BUFFER_SIZE = 4096 #bytes, much more than a frame
+
+class SerialFrameReader:
+    # serialPort must be already open
+    def __init__(self, serialPort, bufferSize=SERIAL_READER_BUFFER_SIZE):
+        self.serialPort = serialPort
+        self.buf = bytearray(bufferSize)
+        self.view = memoryview(self.buf)
+        self.start = 0   #first byte not consumed yet
+        self.scanned = 0 #the bytes in [start, scanned) don't contain '\n'
+        self.end = 0     #end of the received bytes
+        try:
+            self.fd = serialPort.fileno()
+            hasReadv = hasattr(os, "readv")
+        except (AttributeError, OSError, NotImplementedError):
+            self.fd = -1
+            hasReadv = False
+        self.useFd = self.fd >= 0 and hasReadv
+        #statistics
+        self.numOfReads = 0
+        self.numOfBytes = 0
+        self.numOfFrames = 0
+        self.numOfTimeouts = 0
+        self.numOfOverflows = 0
+
+    # Returns the tuple (start, end) of the next frame in buf (the terminator is
+    # included), or None if no complete frame is received within deadlineMs
+    # milliseconds. The frame is valid until the next call.
+    def readFrame(self, deadlineMs):
+        deadlineNs = time.monotonic_ns() + int(deadlineMs * 1e6)
+        while True:
+            lf = self.buf.find(b'\n', self.scanned, self.end)
+            if lf >= 0:
+                frameStart = self.start
+                self.start = lf + 1
+                self.scanned = self.start
+                self.numOfFrames += 1
+                return frameStart, lf + 1
+            self.scanned = self.end
+            remainingNs = deadlineNs - time.monotonic_ns()
+            if remainingNs <= 0:
+                self.numOfTimeouts += 1
+                return None
+            self.__fill(remainingNs)
+
+    # Returns a copy of the frame, for the answers that are not parsed in place
+    def getFrameBytes(self, frame):
+        return bytes(self.view[frame[0]:frame[1]])
+
+    # Discards the received bytes, also the ones not read from the port yet
+    def reset(self):
+        self.serialPort.reset_input_buffer()
+        self.start = self.scanned = self.end = 0
+
+    # Returns True if there are received bytes not consumed yet
+    def hasPendingData(self):
+        return self.end > self.start or self.serialPort.in_waiting > 0
+
+    def printStats(self):
+        print("SerialFrameReader: reads=", self.numOfReads, " bytes=", self.numOfBytes, " frames=", self.numOfFrames,
+              " timeouts=", self.numOfTimeouts, " overflows=", self.numOfOverflows)
+
+    # Waits at most timeoutNs for data and appends to the buffer all the available bytes
+    def __fill(self, timeoutNs): #private method
+        if self.start > 0 and self.start == self.end:
+            self.start = self.scanned = self.end = 0 #all consumed: nothing to move
+        elif self.end == len(self.buf):
+            if self.start == 0:
+                #a full buffer without terminator: it is garbage
+                self.numOfOverflows += 1
+                self.start = self.scanned = self.end = 0
+            else:
+                #moves the partial frame at the beginning of the buffer
+                pending = self.end - self.start
+                self.buf[0:pending] = self.buf[self.start:self.end]
+                self.start = 0
+                self.scanned = pending
+                self.end = pending
+        if self.useFd:
+            ready, _, _ = select.select([self.fd], [], [], timeoutNs / 1e9)
+            if not ready:
+                return
+            try:
+                n = os.readv(self.fd, [self.view[self.end:]])
+            except BlockingIOError:
+                return
+            if n == 0:
+                #same check of pyserial: readable without data means the device has gone
+                raise serial.SerialException("device reports readiness to read but returned no data (device disconnected?)")
+        else:
+            self.serialPort.timeout = timeoutNs / 1e9
+            data = self.serialPort.read(min(max(1, self.serialPort.in_waiting), len(self.buf) - self.end))
+            n = len(data)
+            self.buf[self.end:self.end + n] = data
+        self.end += n
+        self.numOfReads += 1
+        self.numOfBytes += n
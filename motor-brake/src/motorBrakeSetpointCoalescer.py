@@ -0,0 +1,113 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class MotorBrakeSetpointCoalescer is defined. It sits between the
+# yarp command reader and the serial I/O owner and limits the load of the
+# setpoints streamed by a controller on /motorbrake/cmd:i:
+#  - latest value wins: for each setpoint type (torque, speed) only the last
+#    received value waits to be sent; a value received while an older one is
+#    still waiting replaces it, and the older one is counted as coalesced
+#  - at most one setpoint of each type is queued to the serial I/O owner
+#  - the setpoints are sent at most maxRate times per second (all the types
+#    together), so the commands, that have priority over the data polling,
+#    cannot take more than this share of the serial link
+# At close the values still waiting are sent, so the device always gets the
+# last setpoint received.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import time
+from threading import Thread
+from threading import Condition
+from termcolor import colored
+
+SETPOINT_DEFAULT_MAX_RATE = 20.0 #setpoints/sec, 0: no limit
+
+class _SetpointSlot:
+    def __init__(self, name):
+        self.name = name
+        self.func = None
+        self.value = None
+        self.pendingSinceNs = 0 #0 if no value is waiting
+        self.inFlight = False   #True while a value is queued to the serial I/O owner
+        self.future = None      #Future of the last value queued
+        #statistics
+        self.numOfReceived = 0
+        self.numOfSent = 0
+        self.numOfCoalesced = 0
+
+# ioTh is any object with submitCommand(func, *args) returning a concurrent.futures.Future,
+# e.g. MotorBrakeIoThread or the asyncio manager
+class MotorBrakeSetpointCoalescer(Thread):
+    def __init__(self, ioTh, maxRate=SETPOINT_DEFAULT_MAX_RATE):
+        Thread.__init__(self, name="MotorBrakeSetpointCoalescer")
+        self.ioTh = ioTh
+        self.minIntervalNs = int(1e9 / maxRate) if maxRate > 0 else 0
+        self.cond = Condition()
+        self.slots = {}
+        self.lastSentNs = 0
+        self.isClosing = False
+
+    # Thread safe: the value replaces the one of the same type that is still waiting
+    def submit(self, name, func, value):
+        with self.cond:
+            slot = self.slots.get(name)
+            if slot is None:
+                slot = self.slots[name] = _SetpointSlot(name)
+            slot.numOfReceived += 1
+            if slot.pendingSinceNs != 0:
+                slot.numOfCoalesced += 1
+            else:
+                slot.pendingSinceNs = time.monotonic_ns()
+            slot.func = func
+            slot.value = value
+            self.cond.notify()
+
+    def run(self):
+        with self.cond:
+            while True:
+                nowNs = time.monotonic_ns()
+                readyNs = self.lastSentNs + self.minIntervalNs
+                waiting = [slot for slot in self.slots.values() if slot.pendingSinceNs != 0]
+                if self.isClosing:
+                    #the last values are sent without waiting for the rate limit
+                    for slot in waiting:
+                        self.__send(slot)
+                    break
+                ready = [slot for slot in waiting if not slot.inFlight]
+                if ready and nowNs >= readyNs:
+                    #the oldest value first, so a type streamed fast doesn't starve the other
+                    self.__send(min(ready, key=lambda slot: slot.pendingSinceNs))
+                    continue
+                #with values ready it waits for the rate limit, otherwise for a new value or the end of a send
+                self.cond.wait((readyNs - nowNs) / 1e9 if ready else None)
+
+    # Returns the Futures of the setpoints not executed yet by the serial I/O owner
+    def close(self):
+        with self.cond:
+            self.isClosing = True
+            self.cond.notify()
+        self.join()
+        return [slot.future for slot in self.slots.values() if slot.future is not None and not slot.future.done()]
+
+    def printStats(self):
+        for slot in self.slots.values():
+            print(colored("MotorBrakeSetpointCoalescer " + slot.name + ": received= " + str(slot.numOfReceived) + "  sent= " + str(slot.numOfSent) +
+                          "  coalesced= " + str(slot.numOfCoalesced), 'blue'))
+
+    #It is called with the lock held
+    def __send(self, slot): #private method
+        slot.inFlight = True
+        slot.numOfSent += 1
+        slot.pendingSinceNs = 0
+        self.lastSentNs = time.monotonic_ns()
+        slot.future = self.ioTh.submitCommand(slot.func, slot.value)
+        slot.future.add_done_callback(lambda f: self.__done(slot))
+
+    #It is called by the serial I/O owner when the setpoint has been sent
+    def __done(self, slot): #private method
+        with self.cond:
+            slot.inFlight = False
+            self.cond.notify()
@@ -0,0 +1,225 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the shared memory ring buffer is defined. In this mode the data
+# collector only writes fixed-size records in a multiprocessing.shared_memory
+# block, while the sinks (log file, yarp publishing, characterization map)
+# run in consumer processes: their GIL usage and GC pauses don't affect the
+# sampling anymore.
+#  - ShmRecordRing: the ring buffer, created by the acquisition process and
+#    attached by the consumers
+#  - ShmRingSink: the writer, used by the data collector in place of
+#    MotorBrakeDataSinks
+#  - ShmRingConsumer: the reader, one for each consumer process; it detects
+#    the overruns (records overwritten before being read) and measures the lag
+#  - shmSinksConsumer: the body of a consumer process that feeds a
+#    MotorBrakeDataSinks with the records read from the ring
+#
+# Layout of the shared memory block (little endian):
+#   writeCount    uint64    number of records written since the creation
+#   closed        uint64    1 when the writer has finished
+#   capacity      uint64    number of records of the ring (power of two)
+#   padding       up to 64 bytes
+#   records       capacity records with the layout of the binary log, gap records included (see motorBrakeBinLog.py)
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import time
+import signal
+import numpy as np
+from multiprocessing import shared_memory
+from termcolor import colored
+from src.motorBrakeBinLog import binLogRecordStruct
+from src.motorBrakeBinLog import binLogRecordDtype
+from src.motorBrakeBinLog import BIN_LOG_ROTATION_GAP
+from src.motorBrakeDriver import MotorBrakeOuputData
+from src.motorBrakeDriver import MotorBrakeGap
+from src.motorBrakeDriver import gapReasons
+from src.motorBrakeStatistics import StreamingStatistics
+
+SHM_RING_HEADER_SIZE = 64
+
+# -------------------------------------------------------------------------
+# Ring buffer
+# -------------------------------------------------------------------------
+
+# Single writer, many readers: each reader keeps its own read position.
+# The capacity is rounded up to a power of two.
+class ShmRecordRing:
+    def __init__(self, name=None, capacity=1<<16):
+        if name is None:
+            capacity = 1 << max(0, int(capacity) - 1).bit_length()
+            self.shm = shared_memory.SharedMemory(create=True, size=SHM_RING_HEADER_SIZE + capacity * binLogRecordDtype.itemsize)
+            self.isOwner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.isOwner = False
+        self.name = self.shm.name
+        self.header = np.ndarray((3,), dtype='<u8', buffer=self.shm.buf)
+        if self.isOwner:
+            self.header[:] = (0, 0, capacity)
+        self.capacity = int(self.header[2])
+        self.mask = self.capacity - 1
+        self.records = np.ndarray((self.capacity,), dtype=binLogRecordDtype, buffer=self.shm.buf, offset=SHM_RING_HEADER_SIZE)
+
+    def getWriteCount(self):
+        return int(self.header[0])
+
+    def isClosed(self):
+        return self.header[1] != 0
+
+    # The record is written before updating the counter, so a reader never sees a record not written yet
+    def write(self, data):
+        writeCount = int(self.header[0])
+        binLogRecordStruct.pack_into(self.shm.buf, SHM_RING_HEADER_SIZE + (writeCount & self.mask) * binLogRecordDtype.itemsize,
+                                     data.progNum, data.timestampNs, data.speed, data.torque, ord(data.rotation[0]))
+        self.header[0] = writeCount + 1
+
+    def writeGap(self, gap):
+        writeCount = int(self.header[0])
+        binLogRecordStruct.pack_into(self.shm.buf, SHM_RING_HEADER_SIZE + (writeCount & self.mask) * binLogRecordDtype.itemsize,
+                                     gap.numOfDropped, gap.startNs, gap.durationNs / 1e9, gapReasons.index(gap.reason), BIN_LOG_ROTATION_GAP)
+        self.header[0] = writeCount + 1
+
+    def setClosed(self):
+        self.header[1] = 1
+
+    # The owner also removes the shared memory block
+    def close(self):
+        #the numpy views must be released before closing the block
+        self.header = None
+        self.records = None
+        self.shm.close()
+        if self.isOwner:
+            self.shm.unlink()
+
+
+# Writer with the interface of MotorBrakeDataSinks, used by the data collector.
+# ringBuffer is the SampleRingBuffer of the live plot, that runs in the acquisition process, or None
+class ShmRingSink:
+    def __init__(self, ring, ringBuffer=None):
+        self.ring = ring
+        self.ringBuffer = ringBuffer
+
+    def open(self):
+        pass
+
+    def write(self, motor_br_data):
+        self.ring.write(motor_br_data)
+        if self.ringBuffer is not None:
+            self.ringBuffer.write(motor_br_data.timestampNs, motor_br_data.speed, motor_br_data.torque)
+
+    def writeGap(self, gap):
+        self.ring.writeGap(gap)
+
+    # The consumers drain the ring and then stop
+    def close(self):
+        self.ring.setClosed()
+
+
+# -------------------------------------------------------------------------
+# Consumer
+# -------------------------------------------------------------------------
+class ShmRingConsumer:
+    def __init__(self, ring, name=""):
+        self.ring = ring
+        self.name = name
+        #the ring is created for one acquisition session: a consumer started late reads it from the beginning,
+        #if the records have not been overwritten yet
+        self.readCount = 0
+        #statistics
+        self.numOfRecords = 0
+        self.numOfOverruns = 0
+        self.numOfLost = 0
+        self.maxBacklog = 0
+        self.lagStats = StreamingStatistics("consumer " + name + " lag")
+
+    # Returns a copy of the records not read yet (at most maxRecords) as an array of binLogRecordDtype.
+    # The records overwritten by the writer before being read are counted as lost.
+    def read(self, maxRecords=4096):
+        writeCount = self.ring.getWriteCount()
+        backlog = writeCount - self.readCount
+        if backlog > self.ring.capacity:
+            self.__lose(backlog - self.ring.capacity)
+            backlog = self.ring.capacity
+        self.maxBacklog = max(self.maxBacklog, backlog)
+        n = min(backlog, maxRecords)
+        if n == 0:
+            return self.ring.records[:0].copy()
+        chunk = self.ring.records[(self.readCount + np.arange(n)) & self.ring.mask]
+        #the writer could have overwritten the oldest records during the copy
+        overwritten = self.ring.getWriteCount() - self.ring.capacity - self.readCount
+        if overwritten > 0:
+            self.__lose(min(overwritten, n))
+            chunk = chunk[min(overwritten, n):]
+            n -= min(overwritten, n)
+        self.readCount += n
+        self.numOfRecords += n
+        if n > 0:
+            #lag: age of the newest record when it is handed to the consumer
+            self.lagStats.add(time.monotonic_ns() - int(chunk["timestampNs"][-1]))
+        return chunk
+
+    # True when the writer has finished and all the records have been read
+    def isDrained(self):
+        return self.ring.isClosed() and self.readCount >= self.ring.getWriteCount()
+
+    def printStats(self):
+        print(colored("ShmRingConsumer " + self.name + ": records= " + str(self.numOfRecords) + "  overruns= " + str(self.numOfOverruns) +
+                      "  lost records= " + str(self.numOfLost) + "  max backlog= " + str(self.maxBacklog), 'blue'))
+        self.lagStats.printStats()
+
+    def __lose(self, numOfRecords): #private method
+        self.numOfOverruns += 1
+        self.numOfLost += numOfRecords
+        self.readCount += numOfRecords
+
+
+# Body of a consumer process: it reads the ring and writes each record in a
+# MotorBrakeDataSinks with the given log and yarp settings (yarpPortName is
+# empty if the yarp publishing is not done by this consumer). charMap is a
+# TorqueSpeedMap or None and logCfg a MotorBrakeLogCfg or None.
+def shmSinksConsumer(ringName, consumerName, logFileName, logFormat, yarpPortName, publishBatch, publishBatchMs, charMap, logCfg=None, pollInterval=0.005):
+    #ctrl+c is handled by the acquisition process, that closes the ring
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from src.MotorBrakeDataCollector import MotorBrakeDataSinks
+    yarpOutPort = None
+    if yarpPortName:
+        import yarp
+        yarp.Network.init()
+        yarpOutPort = yarp.BufferedPortBottle()
+        yarpOutPort.open(yarpPortName)
+    ring = ShmRecordRing(ringName)
+    consumer = ShmRingConsumer(ring, consumerName)
+    sinks = MotorBrakeDataSinks(logFileName, logFormat, yarpOutPort, publishBatch, publishBatchMs, None, charMap, logCfg)
+    sinks.open()
+    data = MotorBrakeOuputData()
+    while True:
+        chunk = consumer.read()
+        if len(chunk) == 0:
+            if consumer.isDrained():
+                break
+            time.sleep(pollInterval)
+            continue
+        #speed and torque are float32 in the ring: they are converted through their shortest representation,
+        #so the log doesn't get float32 rounding artifacts (see binLogToTsv)
+        for seq, ts, speed, torque, rot in zip(chunk["seq"].tolist(), chunk["timestampNs"].tolist(), chunk["speed"],
+                                               chunk["torque"], chunk["rotation"].tolist()):
+            if rot == BIN_LOG_ROTATION_GAP:
+                sinks.writeGap(MotorBrakeGap(ts, int(round(float(speed) * 1e9)), seq, gapReasons[int(torque)]))
+                continue
+            data.progNum = seq
+            data.timestampNs = ts
+            data.speed = float(str(speed))
+            data.torque = float(str(torque))
+            data.rotation = chr(rot)
+            sinks.write(data)
+    sinks.close()
+    consumer.printStats()
+    chunk = None
+    ring.close()
+    if yarpOutPort is not None:
+        yarpOutPort.close()
+        yarp.Network.fini()
@@ -0,0 +1,163 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class DSP6001Simulator is defined. It simulates a Magtrol DSP6001
+# on a Linux pseudo-terminal, so the Motor Brake Manager can be run and
+# benchmarked without the hardware: the driver opens simulator.portName as
+# if it were the real serial port.
+# The simulator answers to "*IDN?", "OD", "Q#" and "N#" and it can be
+# configured with:
+#  - a response latency (seconds)
+#  - the baud rate used to pace the answers (10 bits per char)
+#  - gaussian noise on speed and torque
+#  - the probability of sending a corrupted frame
+#  - the continuous output of data strings
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import pty
+import tty
+import time
+import random
+import queue
+import select
+from threading import Thread
+from threading import Event
+from threading import Lock
+
+# -------------------------------------------------------------------------
+# DSP6001 simulator
+# -------------------------------------------------------------------------
+class DSP6001Simulator:
+    def __init__(self, baudrate=19200, latency=0.0, noiseStd=0.0, corruptProb=0.0, continuousPeriod=0.0, idn="MAGTROL,DSP6001,SIMULATOR,1.0"):
+        self.baudrate = baudrate
+        self.latency = latency
+        self.noiseStd = noiseStd
+        self.corruptProb = corruptProb
+        self.continuousPeriod = continuousPeriod #if >0 a data string is sent every continuousPeriod seconds
+        self.idn = idn
+        self.speedSetpoint = 0.0  #device units (rpm)
+        self.torqueSetpoint = 0.0 #device units (mNm)
+        self.rotation = 'R'
+        self.portName = ""
+        #statistics
+        self.numOfRequests = 0
+        self.numOfCorrupted = 0
+        self.lastSetpointRxNs = 0 #time.monotonic_ns() when the last Q# or N# has been received
+        self.txQueue = queue.Queue()
+        self.stopEvt = Event()
+        self.writeLock = Lock()
+        self.masterFd = -1
+        self.slaveFd = -1
+
+    def start(self):
+        self.masterFd, self.slaveFd = pty.openpty()
+        tty.setraw(self.slaveFd)
+        self.portName = os.ttyname(self.slaveFd)
+        self.stopEvt.clear()
+        self.th = Thread(target=self.__run, name="DSP6001Simulator", daemon=True)
+        self.th.start()
+        self.txTh = Thread(target=self.__runTx, name="DSP6001SimulatorTx", daemon=True)
+        self.txTh.start()
+        if self.continuousPeriod > 0:
+            self.contTh = Thread(target=self.__runContinuous, name="DSP6001SimulatorCont", daemon=True)
+            self.contTh.start()
+        return self.portName
+
+    def stop(self):
+        self.stopEvt.set()
+        self.th.join()
+        self.txTh.join()
+        if self.continuousPeriod > 0:
+            self.contTh.join()
+        os.close(self.masterFd)
+        os.close(self.slaveFd)
+
+    def getDataString(self):
+        speed = self.speedSetpoint
+        torque = self.torqueSetpoint
+        if self.noiseStd > 0:
+            speed += random.gauss(0, self.noiseStd)
+            torque += random.gauss(0, self.noiseStd)
+        frame = "S%5dT%.3f%s" % (round(speed), torque, self.rotation)
+        if self.corruptProb > 0 and random.random() < self.corruptProb:
+            self.numOfCorrupted += 1
+            cut = random.randint(0, len(frame)-1)
+            frame = frame[:cut] + "#" + frame[cut+1:]
+        return frame
+
+    # Reception: each command is processed when it has been completely received,
+    # then its answer is queued to the transmission after the response latency.
+    # Reception and transmission are independent, as in a full duplex serial link.
+    def __run(self): #private method
+        buf = b''
+        while not self.stopEvt.is_set():
+            ready, _, _ = select.select([self.masterFd], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                rx = os.read(self.masterFd, 1024)
+            except OSError:
+                break
+            if self.baudrate > 0:
+                time.sleep(len(rx) * 10 / self.baudrate) #time needed by the serial link
+            buf += rx
+            while b'\n' in buf:
+                line, buf = buf.split(b'\n', 1)
+                answer = self.__process(line.strip().decode(errors='replace'))
+                if answer is not None:
+                    self.txQueue.put((time.monotonic() + self.latency, answer))
+
+    def __runTx(self): #private method
+        while not self.stopEvt.is_set():
+            try:
+                readyTime, answer = self.txQueue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            waitTime = readyTime - time.monotonic()
+            if waitTime > 0:
+                time.sleep(waitTime)
+            self.__send(answer)
+
+    def __runContinuous(self): #private method
+        nextTime = time.monotonic()
+        while not self.stopEvt.is_set():
+            self.__send(self.getDataString())
+            nextTime += self.continuousPeriod
+            sleepTime = nextTime - time.monotonic()
+            if sleepTime > 0:
+                time.sleep(sleepTime)
+
+    def __process(self, cmd): #private method
+        if cmd == "":
+            return None
+        self.numOfRequests += 1
+        if cmd == "*IDN?":
+            return self.idn
+        if cmd == "OD":
+            return self.getDataString()
+        if len(cmd) > 1 and cmd[0] in ('Q', 'N'):
+            try:
+                val = float(cmd[1:])
+            except ValueError:
+                return "ERR"
+            self.lastSetpointRxNs = time.monotonic_ns()
+            if cmd[0] == 'Q':
+                self.torqueSetpoint = val
+            else:
+                self.speedSetpoint = val
+            return "OK"
+        return "ERR"
+
+    def __send(self, answer): #private method
+        data = (answer + "\r\n").encode()
+        with self.writeLock:
+            if self.baudrate > 0:
+                time.sleep(len(data) * 10 / self.baudrate) #time needed by the serial link
+            try:
+                os.write(self.masterFd, data)
+            except OSError:
+                pass #the port has been closed
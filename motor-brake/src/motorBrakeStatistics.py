@@ -0,0 +1,118 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Here the class StreamingStatistics is defined. It accumulates durations
+# (in nanoseconds) in constant time and constant memory:
+#  - mean and variance with the Welford algorithm
+#  - min and max
+#  - a log-linear histogram (HDR-like) used to estimate the percentiles
+# All the memory is allocated in the constructor, so add() can be called
+# in the acquisition hot path.
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import math
+from termcolor import colored
+
+# -------------------------------------------------------------------------
+# Streaming statistics
+# -------------------------------------------------------------------------
+
+# The histogram has subBucketCount linear buckets for the values less than
+# subBucketCount ns, then for each power of two there are subBucketCount/2
+# buckets, so the relative error of the percentiles is less than 2/subBucketCount.
+# Values bigger than maxValueNs are counted in the last bucket.
+class StreamingStatistics:
+    def __init__(self, name="", subBucketBits=7, maxValueNs=10*1000*1000*1000):
+        self.name = name
+        self.subBucketBits = subBucketBits
+        self.subBucketCount = 1 << subBucketBits
+        self.subBucketHalfCount = self.subBucketCount >> 1
+        self.maxValueNs = maxValueNs
+        self.counts = [0] * (self.__bucketIndex(maxValueNs) + 1)
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = 0
+        self.max = 0
+
+    def add(self, valueNs):
+        if valueNs < 0:
+            valueNs = 0
+        self.count += 1
+        delta = valueNs - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (valueNs - self.mean)
+        if self.count == 1 or valueNs < self.min:
+            self.min = valueNs
+        if valueNs > self.max:
+            self.max = valueNs
+        if valueNs > self.maxValueNs:
+            valueNs = self.maxValueNs
+        self.counts[self.__bucketIndex(valueNs)] += 1
+
+    def getVariance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / self.count
+
+    def getStd(self):
+        return math.sqrt(self.getVariance())
+
+    # Returns the value in ns under which there are the quantile q (0..1) of the samples
+    def getPercentile(self, q):
+        if self.count == 0:
+            return 0
+        threshold = q * self.count
+        acc = 0
+        for idx, c in enumerate(self.counts):
+            acc += c
+            if c > 0 and acc >= threshold:
+                return min(self.__bucketValue(idx), self.max)
+        return self.max
+
+    # Returns a dictionary with all statistics, expressed in seconds
+    def getSnapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.mean / 1e9,
+            "std": self.getStd() / 1e9,
+            "var": self.getVariance() / 1e18,
+            "min": self.min / 1e9,
+            "max": self.max / 1e9,
+            "p50": self.getPercentile(0.5) / 1e9,
+            "p99": self.getPercentile(0.99) / 1e9,
+            "p999": self.getPercentile(0.999) / 1e9,
+        }
+
+    def printStats(self):
+        snapshot = self.getSnapshot()
+        print("\n")
+        title = '----- STATISTIC ' + (self.name + ' ' if self.name else '') + '-------'
+        print(colored(title, 'blue'))
+        for key in snapshot:
+            mystr = key + " = " + str(snapshot[key])
+            print(colored(mystr, 'blue') )
+        print(colored('-----------------------', 'blue'))
+
+    def __bucketIndex(self, valueNs): #private method
+        if valueNs < self.subBucketCount:
+            return valueNs
+        shift = valueNs.bit_length() - self.subBucketBits
+        subBucket = valueNs >> shift
+        return self.subBucketCount + (shift - 1) * self.subBucketHalfCount + (subBucket - self.subBucketHalfCount)
+
+    # Returns the highest value counted in the bucket idx
+    def __bucketValue(self, idx): #private method
+        if idx < self.subBucketCount:
+            return idx
+        shift = (idx - self.subBucketCount) // self.subBucketHalfCount + 1
+        subBucket = (idx - self.subBucketCount) % self.subBucketHalfCount + self.subBucketHalfCount
+        return ((subBucket + 1) << shift) - 1
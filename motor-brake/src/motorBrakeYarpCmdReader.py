@@ -4,24 +4,17 @@
 # Here is defined the MotorBrakeYarpCmdReader class and its help classes,
 # that takes care to receive a command from the input yarp port and forwards
 # it to the motor-brake device.
+# This module needs yarp: it is imported only when the yarp service is enabled.
 #
 # Written by V. Gaggero
 # <valentina.gaggero@iit.it>
 # -------------------------------------------------------------------------
 
-from concurrent.futures import thread
-import serial.tools.list_ports as portlist
 import yarp
 from threading import Thread
-from threading import Event
-from threading import Lock
-from src.motorBrakeDriver import MotorBrake as MotBrDriver
-import matplotlib.pyplot as plt
-from termcolor import colored
-from colorama import init
-import sys
-import argparse
-import time
+from src.motorBrakeInstrumentation import stageTimers
+from src.motorBrakeSetpointCoalescer import MotorBrakeSetpointCoalescer
+from src.motorBrakeSetpointCoalescer import SETPOINT_DEFAULT_MAX_RATE
 
 #-------------------------------------------------------------------------------
 # Here two classes are defined:
@@ -30,13 +23,23 @@ import time
 #  - DataProcessor: it has the goal of listening to the port /motorbrake/cmd:i
 #    and processes any received command: if the command has been parsed successfully 
 #    it forwards the command to the motor-brake's driver else the command is ignored.
+#    The setpoints go through a MotorBrakeSetpointCoalescer, that sends only the
+#    latest value of each type at most maxCmdRate times per second.
 #-------------------------------------------------------------------------------
 
 class DataProcessor(yarp.PortReader):
-    def __init__(self, motor_br_dev, lock):
+    def __init__(self, motor_br_dev, ioTh, maxCmdRate=SETPOINT_DEFAULT_MAX_RATE):
         super().__init__()
-        self.lock = lock
+        self.ioTh = ioTh
         self.motor_br_dev = motor_br_dev
+        self.coalescer = MotorBrakeSetpointCoalescer(ioTh, maxCmdRate)
+        self.coalescer.start()
+
+    #The last setpoints received are sent before closing. Returns the Futures of the setpoints not executed yet.
+    def close(self):
+        futures = self.coalescer.close()
+        self.coalescer.printStats()
+        return futures
     
     def read(self,connection):
         if not(connection.isValid()):
@@ -68,14 +71,20 @@ class DataProcessor(yarp.PortReader):
             return False
         if cmdList[0] == 'torque':
             val = float(cmdList[1])
-            with self.lock:
-                self.motor_br_dev.sendTorqueSetpoint(val)
-            print("MotorBrakeYarpCmdReader sends torque=", val)
+            #the setpoint is queued to the coalescer: the yarp reader doesn't wait for the device
+            self.coalescer.submit('torque', self.motor_br_dev.sendTorqueSetpoint, val)
+            print("MotorBrakeYarpCmdReader receives torque=", val)
         elif  cmdList[0] == 'speed':
             val = float(cmdList[1])
-            with self.lock:
-                self.motor_br_dev.sendSpeedSetpoint(val)
-            print("MotorBrakeYarpCmdReader sends speed=", val)
+            self.coalescer.submit('speed', self.motor_br_dev.sendSpeedSetpoint, val)
+            print("MotorBrakeYarpCmdReader receives speed=", val)
+        elif cmdList[0] == 'stats' and len(cmdList) > 1 and cmdList[1] in ('on', 'off'):
+            #the stage timers are switched at runtime, see motorBrakeInstrumentation
+            if cmdList[1] == 'on':
+                stageTimers.enable()
+            else:
+                stageTimers.disable()
+            print("MotorBrakeYarpCmdReader stage timers", cmdList[1])
         else:
             print("MotorBrakeYarpCmdReader command unknown!! ", cmdList[0])
             return False
@@ -88,21 +97,23 @@ class DataProcessor(yarp.PortReader):
 
 
 class MotorBrakeYarpCmdReader (Thread):
-    def __init__(self, motor_br_dev, stopEvt, lock):
+    def __init__(self, motor_br_dev, stopEvt, ioTh, portPrefix="", maxCmdRate=SETPOINT_DEFAULT_MAX_RATE):
         Thread.__init__(self)
         self.stopEvt = stopEvt
-        self.lock = lock
+        self.portName = portPrefix + "/motorbrake/cmd:i"
+        self.ioTh = ioTh
         self.yarpInputPort = yarp.Port()
-        self.dataProc = DataProcessor(motor_br_dev,lock)
+        self.dataProc = DataProcessor(motor_br_dev,ioTh, maxCmdRate)
         self.yarpInputPort.setReader(self.dataProc)
         
     def run(self):
         print ("MotorBrakeYarpCmdReader is starting ")
-        self.yarpInputPort.open("/motorbrake/cmd:i")
+        self.yarpInputPort.open(self.portName)
         while True:
             self.stopEvt.wait()
             print ("MotorBrakeYarpCmdReader is closing...")
             self.yarpInputPort.close()
+            self.dataProc.close() #the serial I/O owner executes the last setpoints before stopping
             break;
             
             
@@ -110,7 +121,5 @@ class MotorBrakeYarpCmdReader (Thread):
             # self.yarpInputPort.read(bottle)
             # print("I read", bottle.toString())
 
-            #with self.lock:
-            #    motor_br_data = self.motor_br_dev.setData()
 
                  
\ No newline at end of file
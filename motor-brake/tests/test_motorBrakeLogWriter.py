@@ -0,0 +1,60 @@
+# -------------------------------------------------------------------------
+# Copyright (C) iCub Tech - Istituto Italiano di Tecnologia (IIT)
+#
+# Tests of MotorBrakeLogWriter: every record written before close() must be
+# on disk after it, also when close() is called while the writer thread is
+# rotating the log.
+#
+# Run from the motor-brake folder with: python -m pytest -q tests
+#
+# Written by V. Gaggero
+# <valentina.gaggero@iit.it>
+# -------------------------------------------------------------------------
+
+import os
+import gzip
+from src.motorBrakeDriver import MotorBrakeOuputData
+from src.motorBrakeLogWriter import MotorBrakeLogWriter
+from src.motorBrakeLogWriter import MotorBrakeLogCfg
+from src.motorBrakeLogWriter import LOG_COMPRESSION_GZIP
+
+NUM_OF_RECORDS = 3000
+
+def writeLog(fileName, logCfg):
+    writer = MotorBrakeLogWriter(fileName, bufferSize=4096, logCfg=logCfg)
+    writer.open()
+    data = MotorBrakeOuputData()
+    for i in range(NUM_OF_RECORDS):
+        data.progNum = i
+        data.speed = 10.0
+        data.torque = 0.5
+        data.rotation = 'R'
+        writer.writeRecord(data)
+    writer.close()
+    return writer
+
+# Returns the list of the chunk files of the index and the number of records they contain
+def readChunks(fileName):
+    folder = os.path.dirname(fileName)
+    with open(fileName + ".index") as f:
+        chunks = [line.split('\t')[1] for line in f if not line.startswith('#')]
+    numOfRecords = 0
+    for chunk in chunks:
+        with gzip.open(os.path.join(folder, chunk), 'rt') as f: #fails if the gzip stream is not terminated
+            numOfRecords += sum(1 for line in f if not line.startswith('#'))
+    return chunks, numOfRecords
+
+def test_closeDuringRotationKeepsAllRecords(tmp_path):
+    for run in range(30):
+        fileName = str(tmp_path / ("log%02d.tsv" % run))
+        writer = writeLog(fileName, MotorBrakeLogCfg(LOG_COMPRESSION_GZIP, rotateSize=10000))
+        assert not writer.writerTh.is_alive()
+        chunks, numOfRecords = readChunks(fileName)
+        assert len(chunks) == writer.chunkIdx
+        assert numOfRecords == NUM_OF_RECORDS
+
+def test_closeTwice(tmp_path):
+    fileName = str(tmp_path / "log.tsv")
+    writer = writeLog(fileName, MotorBrakeLogCfg(LOG_COMPRESSION_GZIP, rotateSize=10000))
+    writer.close()
+    assert readChunks(fileName)[1] == NUM_OF_RECORDS